@@ -0,0 +1,123 @@
+# benchmark_db_profiles.py
+#
+# 比較 db/pragmas.py 中各個 SQLite PRAGMA 設定檔 (durable / balanced / fast)
+# 在我們實際任務工作負載下的寫入吞吐量與 fsync 次數。
+#
+# 工作負載模擬一個轉錄任務的完整生命週期：
+#   add_task -> 逐段 append_task_segments -> update_task_status('completed') -> 數筆系統日誌
+#
+# 用法:
+#   python scripts/benchmark_db_profiles.py --tasks 200 --segments 20
+#   python scripts/benchmark_db_profiles.py --backend memory   # 排除磁碟 I/O 的干擾
+#
+# 若系統中有安裝 `strace`，每個設定檔會在 `strace -c` 之下執行以統計 fsync/fdatasync
+# 系統呼叫次數；否則 fsync 欄位顯示為 n/a。
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+
+def run_workload(profile: str, db_path: Path, num_tasks: int, num_segments: int, backend: str = "file") -> dict:
+    """在指定的設定檔下執行一次工作負載，回傳耗時與操作數。"""
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from db import backends, database, pragmas
+    backends.set_backend(backend)
+    database.DB_FILE = db_path
+    pragmas.set_profile_name(profile)
+    database.initialize_database()
+
+    operations = 0
+    start = time.perf_counter()
+    for i in range(num_tasks):
+        task_id = f"bench-{i}"
+        database.add_task(task_id, json.dumps({"input_file": f"/tmp/{task_id}.mp3", "model_size": "tiny"}))
+        operations += 1
+        for seq in range(num_segments):
+            database.append_task_segments(task_id, [{"start": seq * 2.0, "end": seq * 2.0 + 1.8, "text": f"第 {seq} 句轉錄文字。"}])
+            operations += 1
+        transcript = "".join(f"第 {seq} 句轉錄文字。" for seq in range(num_segments))
+        database.update_task_status(task_id, "completed", json.dumps({"transcript": transcript}))
+        operations += 1
+        for level in ("INFO", "DEBUG", "INFO"):
+            database.add_system_log("benchmark", level, f"任務 {task_id} 狀態更新")
+            operations += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "profile": profile,
+        "backend": backend,
+        "operations": operations,
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(operations / elapsed, 1) if elapsed else None,
+    }
+
+
+def count_fsyncs(strace_output: str) -> int | None:
+    """解析 `strace -c` 的摘要表格，加總 fsync 與 fdatasync 的呼叫次數。"""
+    total = None
+    for line in strace_output.splitlines():
+        parts = line.split()
+        if parts and parts[-1] in ("fsync", "fdatasync") and len(parts) >= 4:
+            try:
+                total = (total or 0) + int(parts[3])
+            except ValueError:
+                continue
+    return total
+
+
+def run_profile_in_subprocess(profile: str, args) -> dict:
+    """在獨立的子程序中執行單一設定檔，以便隔離快取並 (可選) 透過 strace 計數。"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "bench.db"
+        trace_file = Path(tmp_dir) / "strace.txt"
+        cmd = [
+            sys.executable, __file__, "--run-profile", profile, "--db", str(db_path),
+            "--tasks", str(args.tasks), "--segments", str(args.segments), "--backend", args.backend,
+        ]
+        strace = shutil.which("strace")
+        if strace:
+            cmd = [strace, "-f", "-c", "-e", "trace=fsync,fdatasync", "-o", str(trace_file)] + cmd
+
+        completed = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["fsyncs"] = count_fsyncs(trace_file.read_text()) if trace_file.exists() else None
+        result["db_bytes"] = sum(p.stat().st_size for p in Path(tmp_dir).glob("bench.db*"))
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite PRAGMA 設定檔基準測試。")
+    parser.add_argument("--tasks", type=int, default=200, help="模擬的任務數量。")
+    parser.add_argument("--segments", type=int, default=20, help="每個任務的轉錄片段數量。")
+    parser.add_argument("--profiles", type=str, default="durable,balanced,fast", help="要比較的設定檔，以逗號分隔。")
+    parser.add_argument("--backend", type=str, default="file", choices=["file", "memory"], help="儲存後端 (見 db/backends.py)。")
+    parser.add_argument("--run-profile", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--db", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        # 子程序模式：只執行工作負載並輸出 JSON
+        print(json.dumps(run_workload(args.run_profile, Path(args.db), args.tasks, args.segments, args.backend)))
+        return
+
+    results = [run_profile_in_subprocess(p.strip(), args) for p in args.profiles.split(",") if p.strip()]
+
+    print(f"工作負載: {args.tasks} 個任務 x {args.segments} 個片段 (後端: {args.backend})")
+    print(f"{'profile':<10} {'ops':>8} {'seconds':>9} {'ops/s':>10} {'fsyncs':>8} {'db bytes':>10}")
+    for r in results:
+        fsyncs = r["fsyncs"] if r["fsyncs"] is not None else "n/a"
+        print(f"{r['profile']:<10} {r['operations']:>8} {r['seconds']:>9} {r['ops_per_second']:>10} {fsyncs:>8} {r['db_bytes']:>10}")
+
+
+if __name__ == "__main__":
+    main()
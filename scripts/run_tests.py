@@ -98,8 +98,13 @@ def main():
         template_content = template_path.read_text(encoding='utf-8')
         # 將預留位置 %%PYTHON_EXEC%% 替換為當前 Python 直譯器的絕對路徑
         config_content = template_content.replace("%%PYTHON_EXEC%%", sys.executable)
+        # 測試預設使用記憶體儲存後端，避免讀寫真實的 tasks.db (可用 DB_BACKEND=file 覆寫)
+        db_backend = os.environ.get("DB_BACKEND", "memory")
+        config_content = config_content.replace(
+            "[watcher:db_manager]\n", f"[watcher:db_manager]\nenv.DB_BACKEND = {db_backend}\n", 1
+        )
         config_path.write_text(config_content, encoding='utf-8')
-        log.info(f"✅ config/circus.ini 已根據 {sys.executable} 動態生成。")
+        log.info(f"✅ config/circus.ini 已根據 {sys.executable} 動態生成 (DB_BACKEND={db_backend})。")
 
         log.info("--- 正在啟動 Circus 來管理後端服務 ---")
         circus_cmd = [sys.executable, "-m", "circus.circusd", "config/circus.ini"]
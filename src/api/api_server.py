@@ -1,16 +1,17 @@
 # api_server.py
 import uuid
+import hashlib
 import shutil
 import logging
 import json
 import subprocess
 import sys
-import threading
 import asyncio
+import functools
 import os
 import time
 from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, WebSocket, WebSocketDisconnect, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
@@ -19,6 +20,11 @@ from typing import Optional, Dict, List
 # 匯入新的資料庫客戶端
 # from db import database # REMOVED: No longer used directly
 from db.client import get_client
+from api.model_registry import ModelRegistry
+from api.system_monitor import SystemStatsSampler
+from api.connection_manager import ConnectionManager
+from api.segment_batcher import SegmentBatcher
+from api.job_scheduler import JobScheduler, PROCESS_GROUP_KWARGS
 
 # --- JULES 於 2025-08-09 的修改：設定應用程式全域時區 ---
 # 為了確保所有日誌和資料庫時間戳都使用一致的時區，我們在應用程式啟動的
@@ -64,30 +70,7 @@ def setup_database_logging():
 
 
 # --- WebSocket 連線管理器 ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        log.info(f"新用戶端連線。目前共 {len(self.active_connections)} 個連線。")
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        log.info(f"一個用戶端離線。目前共 {len(self.active_connections)} 個連線。")
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-    async def broadcast_json(self, data: dict):
-        for connection in self.active_connections:
-            await connection.send_json(data)
-
+# 每個連線各有一個有界發送佇列與發送任務，廣播不會被緩慢的用戶端拖慢
 manager = ConnectionManager()
 
 
@@ -98,13 +81,58 @@ from contextlib import asynccontextmanager
 # 客戶端內部有重試機制，會等待 DB 管理者服務就緒
 db_client = get_client()
 
+# --- 模型登錄表 ---
+# 在程序內追蹤本地快取中已存在與下載中的模型，取代每次上傳都啟動子程序檢查
+model_registry = ModelRegistry()
+
+# --- 系統資源取樣器 ---
+# 單一背景取樣器負責收集資源使用狀態，新樣本透過 /api/ws 推送給所有連線
+system_sampler = SystemStatsSampler(interval=2.0, disk_path=ROOT_DIR)
+
+def _push_system_stats(sample: dict, loop: asyncio.AbstractEventLoop):
+    """在取樣執行緒中呼叫：只有在有連線會收到時才排程廣播。"""
+    if manager.has_recipients("SYSTEM_STATS"):
+        asyncio.run_coroutine_threadsafe(
+            manager.broadcast_json({"type": "SYSTEM_STATS", "payload": sample}), loop
+        )
+
+# --- 背景工作排程器 ---
+# 轉錄、下載與 AI 分析依資源限制同時執行的數量，超出的請求會排隊等待
+job_scheduler = JobScheduler()
+
+# --- 轉錄片段合併器 ---
+# 依任務暫存轉錄片段，每批只寫入資料庫一次並送出一則 TRANSCRIPTION_UPDATE
+segment_batcher = SegmentBatcher()
+
+def _publish_segments(task_id: str, loop: asyncio.AbstractEventLoop, segments: list[dict]):
+    """將一批片段附加到 task_segments，並以單一訊息推送給前端。"""
+    # 將片段附加到 task_segments，讓重新連線的客戶端可以從序號續讀
+    last_seq = db_client.append_task_segments(task_id, segments)
+    batch = [{k: v for k, v in segment.items() if k != "type"} for segment in segments]
+    if last_seq is not None:
+        # 同一批片段的序號是連續的
+        for offset, segment in enumerate(batch):
+            segment["seq"] = last_seq - len(batch) + 1 + offset
+    message = {
+        "type": "TRANSCRIPTION_UPDATE",
+        "payload": {"task_id": task_id, "segments": batch, "seq": last_seq}
+    }
+    asyncio.run_coroutine_threadsafe(manager.broadcast_json(message), loop)
+
 # --- FastAPI Lifespan Manager ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 在應用程式啟動時執行的程式碼
     setup_database_logging()
     log.info("資料庫日誌處理器已透過 lifespan 事件設定。")
+    model_registry.start()
+    loop = asyncio.get_running_loop()
+    system_sampler.on_sample = lambda sample: _push_system_stats(sample, loop)
+    system_sampler.start()
     yield
+    system_sampler.stop()
+    model_registry.stop()
+    await manager.close_all()
     # 可以在此處加入應用程式關閉時執行的程式碼
 
 # --- FastAPI 應用實例 ---
@@ -141,19 +169,45 @@ from fastapi.responses import FileResponse
 
 # --- JULES'S NEW FEATURE: App State API Endpoints ---
 
+APP_STATE_KEY = 'ui_settings'
+
+
+def _app_state_etag(version: int) -> str:
+    """以 app_state 的版本號產生強 ETag。"""
+    return f'"{version}"'
+
+
+def _parse_etag_version(header_value: Optional[str]) -> Optional[int]:
+    """從 If-Match / If-None-Match 標頭解析出版本號，無法解析時回傳 None。"""
+    if not header_value:
+        return None
+    tag = header_value.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        return None
+
+
 @app.get("/api/app_state", response_class=JSONResponse)
-async def get_app_state_endpoint():
+async def get_app_state_endpoint(request: Request):
     """
     獲取應用程式的 UI 狀態。
+    回應帶有以版本號產生的 ETag；客戶端以 If-None-Match 帶回相同 ETag 時回傳 304。
     """
     try:
         # 我們將所有 UI 狀態儲存在一個鍵 'ui_settings' 下
-        state_json = db_client.get_app_state(key='ui_settings')
-        if state_json:
-            # 如果資料庫中有資料，解析並回傳
-            return JSONResponse(content=json.loads(state_json))
-        # 如果資料庫中沒有，回傳一個空的預設物件
-        return JSONResponse(content={})
+        entry = db_client.get_app_state_versioned(key=APP_STATE_KEY)
+        if not entry:
+            # 如果資料庫中沒有，回傳一個空的預設物件
+            return JSONResponse(content={}, headers={"ETag": _app_state_etag(0), "Cache-Control": "no-cache"})
+
+        headers = {"ETag": _app_state_etag(entry["version"]), "Cache-Control": "no-cache"}
+        if _parse_etag_version(request.headers.get("if-none-match")) == entry["version"]:
+            return Response(status_code=304, headers=headers)
+        # 如果資料庫中有資料，解析並回傳
+        return JSONResponse(content=json.loads(entry["value"]), headers=headers)
     except Exception as e:
         log.error(f"獲取 app_state 時 API 發生錯誤: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="無法獲取應用程式狀態")
@@ -161,25 +215,119 @@ async def get_app_state_endpoint():
 @app.post("/api/app_state", status_code=200)
 async def set_app_state_endpoint(request: Request):
     """
-    儲存應用程式的 UI 狀態。
+    儲存 (完整取代) 應用程式的 UI 狀態。可選擇性地以 If-Match 標頭進行樂觀並行控制。
     """
     try:
         new_state = await request.json()
         # 將收到的 JSON 物件轉換為字串以便儲存
         state_json = json.dumps(new_state)
-        db_client.set_app_state(key='ui_settings', value=state_json)
-        return {"status": "success", "message": "應用程式狀態已儲存"}
+        expected_version = _parse_etag_version(request.headers.get("if-match"))
+        result = db_client.set_app_state(key=APP_STATE_KEY, value=state_json, expected_version=expected_version)
+        if result.get("status") == "conflict":
+            return JSONResponse(
+                status_code=412,
+                content={"detail": "應用程式狀態已被其他客戶端修改。", "version": result.get("version")},
+                headers={"ETag": _app_state_etag(result.get("version") or 0)}
+            )
+        if result.get("status") != "success":
+            raise HTTPException(status_code=500, detail="無法儲存應用程式狀態")
+        version = result["version"]
+        return JSONResponse(
+            content={"status": "success", "message": "應用程式狀態已儲存", "version": version},
+            headers={"ETag": _app_state_etag(version)}
+        )
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="無效的 JSON 格式。")
     except Exception as e:
         log.error(f"儲存 app_state 時 API 發生錯誤: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="無法儲存應用程式狀態")
 
+@app.patch("/api/app_state", status_code=200)
+async def patch_app_state_endpoint(request: Request):
+    """
+    以 JSON Merge Patch (RFC 7386) 局部更新應用程式的 UI 狀態。
+    若請求帶有 If-Match 標頭，只有在版本相符時才會套用，否則回傳 412。
+    """
+    try:
+        patch = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="無效的 JSON 格式。")
+    if not isinstance(patch, dict):
+        raise HTTPException(status_code=400, detail="Merge patch 必須是 JSON 物件。")
+
+    try:
+        expected_version = _parse_etag_version(request.headers.get("if-match"))
+        result = db_client.patch_app_state(key=APP_STATE_KEY, patch=patch, expected_version=expected_version)
+    except Exception as e:
+        log.error(f"局部更新 app_state 時 API 發生錯誤: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="無法更新應用程式狀態")
+
+    if result.get("status") == "conflict":
+        return JSONResponse(
+            status_code=412,
+            content={"detail": "應用程式狀態已被其他客戶端修改。", "version": result.get("version")},
+            headers={"ETag": _app_state_etag(result.get("version") or 0)}
+        )
+    if result.get("status") != "success":
+        raise HTTPException(status_code=500, detail="無法更新應用程式狀態")
+    return JSONResponse(
+        content={"status": "success", "version": result["version"]},
+        headers={"ETag": _app_state_etag(result["version"])}
+    )
+
+# 內容定址的檔案 (檔名即內容雜湊) 永遠不會改變，可讓瀏覽器長期快取
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 其他檔案可能被重新命名或覆寫，每次使用前以 ETag 向伺服器確認 (未變動時回傳 304)
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def _file_etag(path: Path, stat_result: os.stat_result) -> str:
+    """
+    產生檔案的強 ETag。內容定址儲存區中的檔案直接使用其內容雜湊；
+    其他檔案以檔名、大小與修改時間產生 (重新命名後 ETag 也會改變，下載檔名因此保持正確)。
+    """
+    if path.parent == BLOBS_DIR:
+        return f'"{path.stem}"'
+    base = f"{path.name}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return f'"{hashlib.sha256(base.encode()).hexdigest()[:32]}"'
+
+
+def _etag_matches(header_value: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否符合 (依 RFC 9110 使用弱比較，並支援 '*' 與多個 ETag)。"""
+    if not header_value:
+        return False
+    if header_value.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header_value.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def _cached_file_response(request: Request, path: Path, **kwargs) -> Response:
+    """
+    回傳帶有 ETag、Cache-Control 的檔案回應，並處理 If-None-Match (304)。
+    Range / If-Range 請求 (206) 由 FileResponse 依我們提供的 ETag 處理，
+    因此預覽音訊時拖動播放位置只會傳輸需要的部分。
+
+    :param kwargs: 傳給 FileResponse 的其他參數 (例如 filename、media_type)。
+    """
+    path = Path(path)
+    stat_result = path.stat()
+    headers = {
+        "ETag": _file_etag(path, stat_result),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if path.parent == BLOBS_DIR else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, stat_result=stat_result, **kwargs)
+
+
 @app.get("/media/{file_path:path}")
-async def serve_media_files(file_path: str):
+async def serve_media_files(file_path: str, request: Request):
     """
     一個新的API端點，專門用來安全地提供媒體檔案。
     它會手動處理URL解碼，以解決複雜檔名的問題。
+    支援 Range 請求與 ETag 快取驗證。
     """
     try:
         # URL 解碼，將 %20 轉為空格，處理中文等
@@ -192,7 +340,7 @@ async def serve_media_files(file_path: str):
              raise HTTPException(status_code=403, detail="禁止存取。")
 
         if os.path.exists(safe_path) and os.path.isfile(safe_path):
-            return FileResponse(safe_path)
+            return _cached_file_response(request, Path(safe_path))
         else:
             log.warning(f"請求的媒體檔案不存在: {safe_path}")
             return JSONResponse(status_code=404, content={"detail": "File not found"})
@@ -214,6 +362,126 @@ def convert_to_media_url(absolute_path_str: str) -> str:
         return absolute_path_str
 
 
+# --- 內容定址的上傳儲存 ---
+# 上傳的檔案在寫入磁碟的同時計算 SHA-256，並以雜湊值作為檔名存放，
+# 相同內容的檔案只會保存一份。
+BLOBS_DIR = UPLOADS_DIR / "blobs"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _commit_blob(temp_path: Path, content_hash: str, extension: str) -> Path:
+    """將已寫完的暫存檔移入內容定址的儲存區 (同一檔案系統內的 rename，不複製資料)。"""
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    final_path = BLOBS_DIR / f"{content_hash}{extension.lower()}"
+    if final_path.exists():
+        # 相同內容已存在，丟棄這份副本
+        temp_path.unlink()
+    else:
+        os.replace(temp_path, final_path)
+    return final_path
+
+
+def _store_upload(source, extension: str) -> tuple[Path, str]:
+    """
+    將上傳串流寫入內容定址的儲存區 (在執行緒中呼叫，避免阻塞事件迴圈)。
+
+    :param source: 可讀取的二進位檔案物件。
+    :param extension: 副檔名 (例如 '.mp3')，保留以便轉錄工具辨識格式。
+    :return: (儲存路徑, SHA-256 十六進位字串)。
+    """
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    temp_path = BLOBS_DIR / f".incoming-{uuid.uuid4().hex}"
+    try:
+        with open(temp_path, "wb") as buffer:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                buffer.write(chunk)
+        content_hash = digest.hexdigest()
+        return _commit_blob(temp_path, content_hash, extension), content_hash
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+# --- 可續傳的分段上傳 ---
+# 大型檔案以 init / 依 offset 附加分段 / finalize 三個步驟上傳。分段直接附加到
+# incoming 目錄中的 `.part` 檔，finalize 時以 rename 移入內容定址的儲存區並建立任務。
+# 目前已收到的位元組數就是 `.part` 檔的大小，連線中斷後用戶端查詢 offset 即可續傳。
+INCOMING_DIR = UPLOADS_DIR / "incoming"
+# 超過此時間未完成的上傳會在下一次 init 時被清除
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+# 建議用戶端使用的分段大小
+UPLOAD_SUGGESTED_CHUNK_SIZE = 8 * 1024 * 1024
+
+# upload_id -> (已雜湊的位元組數, hashlib 物件)。分段依序附加，因此可以邊收邊算雜湊；
+# 伺服器重啟後快取遺失時，finalize 會重新讀取整個檔案計算。
+_upload_hashers: Dict[str, tuple] = {}
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _upload_paths(upload_id: str) -> tuple[Path, Path]:
+    """回傳 (資料檔, 中繼資料檔) 路徑；upload_id 不合法時回傳 404，避免路徑穿越。"""
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except ValueError:
+        raise HTTPException(status_code=404, detail="找不到指定的上傳")
+    return INCOMING_DIR / f"{upload_id}.part", INCOMING_DIR / f"{upload_id}.json"
+
+
+def _upload_lock(upload_id: str) -> asyncio.Lock:
+    """同一個上傳的分段與 finalize 依序處理，避免重複送出的分段交錯寫入。"""
+    data_path, _ = _upload_paths(upload_id)
+    return _upload_locks.setdefault(data_path.stem, asyncio.Lock())
+
+
+def _load_upload_session(upload_id: str) -> tuple[dict, Path, Path]:
+    data_path, meta_path = _upload_paths(upload_id)
+    try:
+        session = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        raise HTTPException(status_code=404, detail="找不到指定的上傳，可能已完成或已過期")
+    session["offset"] = data_path.stat().st_size if data_path.exists() else 0
+    return session, data_path, meta_path
+
+
+def _purge_stale_uploads():
+    """清除超過保留時間仍未完成的上傳。"""
+    if not INCOMING_DIR.is_dir():
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for meta_path in INCOMING_DIR.glob("*.json"):
+        try:
+            if meta_path.stat().st_mtime < cutoff:
+                meta_path.with_suffix(".part").unlink(missing_ok=True)
+                meta_path.unlink(missing_ok=True)
+                _upload_hashers.pop(meta_path.stem, None)
+                _upload_locks.pop(meta_path.stem, None)
+                log.info(f"🧹 已清除過期的上傳: {meta_path.stem}")
+        except OSError:
+            continue
+
+
+def _write_upload_data(f, data: bytes, digest=None):
+    """將分段資料附加到上傳檔並更新雜湊 (在執行緒中呼叫)。"""
+    f.write(data)
+    if digest:
+        digest.update(data)
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transcription_dedup_key(content_hash: str, model_size: str, language: Optional[str], beam_size: int) -> str:
+    """相同檔案內容與轉錄參數會產生相同結果，以此作為去重鍵。"""
+    return f"transcribe:{content_hash}:{model_size}:{language or 'auto'}:{beam_size}"
+
+
 # --- API 端點 ---
 
 @app.get("/", response_class=HTMLResponse)
@@ -229,24 +497,35 @@ async def serve_frontend(request: Request):
 def check_model_exists(model_size: str) -> bool:
     """
     檢查指定的 Whisper 模型是否已經被下載到本地快取。
+    查詢由程序內的模型登錄表回答，不會啟動任何子程序。
     """
     # JULES'S FIX: 增加一個環境變數來強制使用模擬轉錄器，以支援混合模式測試
     force_mock = os.environ.get("FORCE_MOCK_TRANSCRIBER") == "true"
-    tool_script_path = ROOT_DIR / "src" / "tools" / ("mock_transcriber.py" if IS_MOCK_MODE or force_mock else "transcriber.py")
-    log.info(f"使用 '{tool_script_path}' 檢查模型 '{model_size}' 是否存在...")
+    if IS_MOCK_MODE or force_mock:
+        # 在模擬模式下，我們假設任何模型都「存在」，以避免觸發下載
+        return True
+    return model_registry.is_present(model_size)
+
+
+def _active_download_task(model_size: str) -> str | None:
+    """
+    若此模型已經有一個尚未結束的下載任務，回傳其 ID，讓新的轉錄任務可以直接依賴它。
+    """
+    task_id = model_registry.get_download_task(model_size)
+    if not task_id:
+        return None
+    task = db_client.get_task_status(task_id)
+    if task and task.get("status") in ("pending", "processing"):
+        return task_id
+    # 下載任務已結束 (或已被清理)，但模型仍不存在：視為下載失敗，允許重新建立
+    model_registry.mark_download_finished(model_size)
+    return None
 
-    # 我們透過呼叫一個輕量級的工具腳本來檢查。
-    check_command = [sys.executable, str(tool_script_path), "--command=check", f"--model_size={model_size}"]
-    try:
-        # 在模擬模式下，mock_transcriber.py 會永遠回傳 "exists"
-        result = subprocess.run(check_command, capture_output=True, text=True, check=True)
-        output = result.stdout.strip().lower()
-        log.info(f"模型 '{model_size}' 檢查結果: {output}")
-        # 必須完全匹配 "exists"，避免 "not_exists" 被錯誤判斷為 True
-        return output == "exists"
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        log.error(f"檢查模型 '{model_size}' 時發生錯誤: {e}")
-        return False
+
+@app.get("/api/models")
+async def get_models_endpoint():
+    """回傳模型登錄表的狀態：快取目錄、已存在的模型與下載中的模型。"""
+    return JSONResponse(content=model_registry.snapshot())
 
 @app.post("/api/transcribe", status_code=202)
 async def create_transcription_task(
@@ -259,16 +538,11 @@ async def create_transcription_task(
     接收音訊檔案，根據模型是否存在，決定是直接建立轉錄任務，
     還是先建立一個下載任務和一個依賴於它的轉錄任務。
     """
-    # 1. 檢查模型是否存在
-    model_is_present = check_model_exists(model_size)
-
-    # 2. 保存上傳的檔案
+    # 1. 保存上傳的檔案 (邊寫入邊計算雜湊，以內容定址儲存)
     transcribe_task_id = str(uuid.uuid4())
     file_extension = Path(file.filename).suffix or ".wav"
-    saved_file_path = UPLOADS_DIR / f"{transcribe_task_id}{file_extension}"
     try:
-        with open(saved_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        saved_file_path, content_hash = await asyncio.to_thread(_store_upload, file.file, file_extension)
         log.info(f"檔案已儲存至: {saved_file_path}")
     except Exception as e:
         log.error(f"❌ 儲存檔案時發生錯誤: {e}", exc_info=True)
@@ -276,31 +550,63 @@ async def create_transcription_task(
     finally:
         await file.close()
 
-    # 3. 根據模型是否存在來建立任務
+    return create_transcription_tasks_for_file(
+        transcribe_task_id, saved_file_path, content_hash, file.filename, model_size, language, beam_size
+    )
+
+
+def create_transcription_tasks_for_file(
+    transcribe_task_id: str, saved_file_path: Path, content_hash: str, original_filename: str,
+    model_size: str, language: Optional[str], beam_size: int
+):
+    """
+    為已儲存的上傳檔案建立轉錄任務。若相同內容與參數的任務已完成，直接重用其結果；
+    否則依模型是否存在，建立轉錄任務或「下載模型 + 依賴的轉錄任務」。
+    """
     transcription_payload = {
         "input_file": str(saved_file_path),
-        "original_filename": file.filename, # JULES'S FIX: Store the original filename
+        "original_filename": original_filename, # JULES'S FIX: Store the original filename
         "output_dir": "transcripts",
         "model_size": model_size,
         "language": language,
-        "beam_size": beam_size
+        "beam_size": beam_size,
+        "content_hash": content_hash
     }
+    dedup_key = transcription_dedup_key(content_hash, model_size, language, beam_size)
+
+    # 2. 相同檔案已用相同參數轉錄過：直接以其結果完成新任務，不需要模型也不需要重新計算
+    source_task_id = db_client.add_task_from_completed(transcribe_task_id, json.dumps(transcription_payload), dedup_key)
+    if source_task_id:
+        return {"task_id": transcribe_task_id, "type": "transcribe", "status": "completed", "deduplicated_from": source_task_id}
+
+    # 3. 根據模型是否存在來建立任務
+    model_is_present = check_model_exists(model_size)
 
     if model_is_present:
         # 模型已存在，直接建立轉錄任務
         log.info(f"✅ 模型 '{model_size}' 已存在，直接建立轉錄任務: {transcribe_task_id}")
-        db_client.add_task(transcribe_task_id, json.dumps(transcription_payload), task_type='transcribe')
+        db_client.add_task(transcribe_task_id, json.dumps(transcription_payload), task_type='transcribe', dedup_key=dedup_key)
         # JULES: 修正 API 回應，使其與前端的通用處理邏輯一致，補上 type 欄位
         return {"task_id": transcribe_task_id, "type": "transcribe"}
     else:
-        # 模型不存在，建立下載任務和依賴的轉錄任務
+        # 模型不存在：若已有進行中的下載任務就直接依賴它，否則建立新的下載任務
+        download_task_id = _active_download_task(model_size)
+        if download_task_id:
+            log.info(f"⏳ 模型 '{model_size}' 正在下載中 (任務 '{download_task_id}')，轉錄任務 '{transcribe_task_id}' 將等待它完成。")
+            db_client.add_task(transcribe_task_id, json.dumps(transcription_payload), task_type='transcribe', depends_on=download_task_id, dedup_key=dedup_key)
+            return JSONResponse(content={"tasks": [
+                {"task_id": download_task_id, "type": "download"},
+                {"task_id": transcribe_task_id, "type": "transcribe"}
+            ]})
+
         download_task_id = str(uuid.uuid4())
         log.warning(f"⚠️ 模型 '{model_size}' 不存在。建立下載任務 '{download_task_id}' 和依賴的轉錄任務 '{transcribe_task_id}'")
 
         download_payload = {"model_size": model_size}
         db_client.add_task(download_task_id, json.dumps(download_payload), task_type='download')
+        model_registry.mark_downloading(model_size, download_task_id)
 
-        db_client.add_task(transcribe_task_id, json.dumps(transcription_payload), task_type='transcribe', depends_on=download_task_id)
+        db_client.add_task(transcribe_task_id, json.dumps(transcription_payload), task_type='transcribe', depends_on=download_task_id, dedup_key=dedup_key)
 
         # 我們回傳轉錄任務的 ID，讓前端可以追蹤最終結果
         return JSONResponse(content={"tasks": [
@@ -309,6 +615,131 @@ async def create_transcription_task(
         ]})
 
 
+@app.post("/api/uploads")
+async def init_upload(payload: Dict):
+    """
+    開始一個可續傳的分段上傳。
+
+    payload: {"filename", "size" (總位元組數，可選), "model_size", "language", "beam_size"}
+    回傳 upload_id 與目前的 offset (0)。
+    """
+    filename = payload.get("filename")
+    if not filename:
+        raise HTTPException(status_code=400, detail="缺少 filename 參數")
+    size = payload.get("size")
+    if size is not None and (not isinstance(size, int) or size < 0):
+        raise HTTPException(status_code=400, detail="size 必須是非負整數")
+    try:
+        beam_size = int(payload.get("beam_size") or 5)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="beam_size 必須是正整數")
+    if beam_size < 1:
+        raise HTTPException(status_code=400, detail="beam_size 必須是正整數")
+
+    await asyncio.to_thread(_purge_stale_uploads)
+    INCOMING_DIR.mkdir(parents=True, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    data_path, meta_path = _upload_paths(upload_id)
+    session = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": size,
+        "model_size": payload.get("model_size") or "tiny",
+        "language": payload.get("language") or None,
+        "beam_size": beam_size,
+        "created_at": time.time(),
+    }
+    data_path.touch()
+    meta_path.write_text(json.dumps(session, ensure_ascii=False), encoding="utf-8")
+    _upload_hashers[upload_id] = (0, hashlib.sha256())
+    log.info(f"📤 開始分段上傳 {upload_id}: {filename} ({size if size is not None else '未知'} 位元組)")
+    return {"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": UPLOAD_SUGGESTED_CHUNK_SIZE}
+
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload_status(upload_id: str):
+    """查詢上傳目前已收到的位元組數，用戶端在中斷後依此 offset 續傳。"""
+    session, _, _ = _load_upload_session(upload_id)
+    return {"upload_id": session["upload_id"], "offset": session["offset"], "size": session["size"],
+            "filename": session["filename"]}
+
+
+@app.put("/api/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """
+    在 `offset` 位置附加一個分段 (請求主體即為原始位元組)。
+    offset 必須等於目前已收到的位元組數，否則回傳 409 與正確的 offset。
+    """
+    lock = _upload_lock(upload_id)
+    async with lock:
+        session, data_path, meta_path = _load_upload_session(upload_id)
+        current = session["offset"]
+        if offset != current:
+            return JSONResponse(status_code=409, content={"detail": "offset 不符", "offset": current})
+
+        cached = _upload_hashers.get(session["upload_id"])
+        digest = cached[1] if cached and cached[0] == current else None
+        written = 0
+        # 收到的資料先累積到 UPLOAD_CHUNK_SIZE，再交給執行緒寫入與計算雜湊，避免阻塞事件迴圈
+        buffer = bytearray()
+        f = await asyncio.to_thread(open, data_path, "ab")
+        try:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if session["size"] is not None and current + written + len(buffer) + len(chunk) > session["size"]:
+                    raise HTTPException(status_code=413, detail="上傳的資料超過宣告的檔案大小")
+                buffer += chunk
+                if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                    data, buffer = bytes(buffer), bytearray()
+                    await asyncio.to_thread(_write_upload_data, f, data, digest)
+                    written += len(data)
+        finally:
+            # 即使連線在分段中途中斷，已收到的位元組仍然有效，下次從新的 offset 續傳
+            if buffer:
+                await asyncio.to_thread(_write_upload_data, f, bytes(buffer), digest)
+                written += len(buffer)
+            await asyncio.to_thread(f.close)
+            if digest:
+                _upload_hashers[session["upload_id"]] = (current + written, digest)
+            else:
+                _upload_hashers.pop(session["upload_id"], None)
+        os.utime(meta_path)  # 更新最後活動時間，避免進行中的上傳被視為過期
+        return {"upload_id": session["upload_id"], "offset": current + written, "size": session["size"]}
+
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """
+    完成上傳：將檔案移入內容定址的儲存區並建立轉錄任務。
+    回傳值與 `POST /api/transcribe` 相同。
+    """
+    lock = _upload_lock(upload_id)
+    async with lock:
+        session, data_path, meta_path = _load_upload_session(upload_id)
+        if session["size"] is not None and session["offset"] != session["size"]:
+            return JSONResponse(status_code=409, content={
+                "detail": "檔案尚未上傳完成", "offset": session["offset"], "size": session["size"]
+            })
+
+        cached = _upload_hashers.pop(session["upload_id"], None)
+        if cached and cached[0] == session["offset"]:
+            content_hash = cached[1].hexdigest()
+        else:
+            content_hash = await asyncio.to_thread(_hash_file, data_path)
+
+        file_extension = Path(session["filename"]).suffix or ".wav"
+        saved_file_path = await asyncio.to_thread(_commit_blob, data_path, content_hash, file_extension)
+        meta_path.unlink(missing_ok=True)
+    _upload_locks.pop(session["upload_id"], None)
+    log.info(f"📥 分段上傳 {session['upload_id']} 完成 ({session['offset']} 位元組)，檔案已儲存至: {saved_file_path}")
+
+    return create_transcription_tasks_for_file(
+        str(uuid.uuid4()), saved_file_path, content_hash, session["filename"],
+        session["model_size"], session["language"], session["beam_size"]
+    )
+
+
 @app.get("/api/status/{task_id}")
 async def get_task_status_endpoint(task_id: str):
     """
@@ -337,6 +768,73 @@ async def get_task_status_endpoint(task_id: str):
     return JSONResponse(content=response_data)
 
 
+@app.get("/api/tasks/{task_id}/segments")
+async def get_task_segments_endpoint(task_id: str, after_seq: int = 0, limit: Optional[int] = None):
+    """
+    獲取任務在 `after_seq` 之後新增的轉錄片段，讓前端可以增量續讀即時逐字稿。
+    """
+    segments = db_client.get_task_segments(task_id, after_seq=after_seq, limit=limit)
+    last_seq = segments[-1]["seq"] if segments else after_seq
+    return JSONResponse(content={"task_id": task_id, "segments": segments, "last_seq": last_seq})
+
+
+def _status_message_type(task_type: str) -> str:
+    """依任務類型決定前端使用的 WebSocket 狀態訊息類型。"""
+    if task_type and ("youtube" in task_type or "gemini" in task_type):
+        return "YOUTUBE_STATUS"
+    return "TRANSCRIPTION_STATUS"
+
+
+async def cancel_task(task_id: str, reason: str = None) -> dict | None:
+    """
+    取消任務：將任務及其所有待處理的依賴任務標記為 'cancelled'，
+    移除排程器中排隊的工作、終止執行中工作的子程序，並通知前端。
+
+    :return: 取消結果；任務不存在時回傳 None。
+    """
+    task_info = db_client.get_task_status(task_id)
+    if not task_info:
+        return None
+
+    # 先設定排程器的取消旗標，再寫入資料庫：背景工作之後的 is_cancelled() 檢查都會看到取消，
+    # 已經越過檢查的工作寫入最終狀態時也會因任務已取消而被資料庫拒絕 (見 update_task_status)
+    root_job = job_scheduler.cancel(task_id) if task_info["status"] in ("pending", "processing") else None
+    cancelled_ids = db_client.cancel_task(task_id, reason) or []
+    stopped_jobs = 1 if root_job else 0
+    for cancelled_id in cancelled_ids:
+        if cancelled_id != task_id and job_scheduler.cancel(cancelled_id):
+            stopped_jobs += 1
+        cancelled_info = task_info if cancelled_id == task_id else db_client.get_task_status(cancelled_id)
+        cancelled_type = cancelled_info.get("type") if cancelled_info else None
+        await manager.broadcast_json({
+            "type": _status_message_type(cancelled_type),
+            "payload": {"task_id": cancelled_id, "status": "cancelled", "task_type": cancelled_type, "cancelled_by": task_id}
+        })
+
+    if cancelled_ids:
+        log.info(f"🛑 任務 {task_id} 已取消 (連帶取消 {len(cancelled_ids)} 個任務，停止 {stopped_jobs} 個背景工作)。")
+    return {
+        "task_id": task_id,
+        "status": "cancelled" if cancelled_ids else task_info["status"],
+        "cancelled": cancelled_ids,
+        "stopped_jobs": stopped_jobs,
+    }
+
+
+@app.post("/api/tasks/{task_id}/cancel")
+async def cancel_task_endpoint(task_id: str):
+    """
+    取消一個排隊中或執行中的任務 (連同其子程序與所有待處理的依賴任務)。
+    任務已經結束時回傳 409。
+    """
+    result = await cancel_task(task_id, reason="使用者取消了任務")
+    if result is None:
+        raise HTTPException(status_code=404, detail="找不到指定的任務")
+    if not result["cancelled"]:
+        raise HTTPException(status_code=409, detail=f"任務已經結束 (狀態: {result['status']})，無法取消")
+    return result
+
+
 @app.post("/api/log/action", status_code=200)
 async def log_action_endpoint(payload: Dict):
     """
@@ -352,8 +850,6 @@ async def log_action_endpoint(payload: Dict):
     return {"status": "logged"}
 
 
-import psutil
-
 @app.get("/api/application_status")
 async def get_application_status():
     """
@@ -367,41 +863,24 @@ async def get_application_status():
     }
 
 @app.get("/api/system_stats")
-async def get_system_stats():
+async def get_system_stats(history: int = Query(30, ge=0, le=500)):
     """
-    獲取並回傳當前的系統資源使用狀態（CPU, RAM, GPU）。
+    回傳背景取樣器快取的最新系統資源使用狀態（CPU, RAM, 磁碟, GPU, 程序 RSS），
+    以及最近 `history` 筆歷史樣本。此端點不會進行任何取樣。
     """
-    # CPU
-    cpu_usage = psutil.cpu_percent(interval=0.1)
+    sample = system_sampler.latest()
+    if sample is None:
+        # 取樣器尚未啟動 (例如在測試中直接呼叫)，在執行緒中取樣一次以免阻塞事件迴圈
+        sample = await asyncio.to_thread(system_sampler.sample)
+    return {**sample, "history": system_sampler.history(history) if history else []}
 
-    # RAM
-    ram = psutil.virtual_memory()
-    ram_usage = ram.percent
-
-    # GPU (透過 nvidia-smi)
-    gpu_usage = None
-    gpu_detected = False
-    try:
-        # 執行 nvidia-smi 命令
-        result = subprocess.run(
-            ['nvidia-smi', '--query-gpu=utilization.gpu', '--format=csv,noheader,nounits'],
-            capture_output=True, text=True, check=True
-        )
-        # 解析輸出
-        gpu_usage = float(result.stdout.strip())
-        gpu_detected = True
-    except (FileNotFoundError, subprocess.CalledProcessError) as e:
-        # nvidia-smi 不存在或執行失敗
-        log.debug(f"無法獲取 GPU 資訊: {e}")
-        gpu_usage = None
-        gpu_detected = False
 
-    return {
-        "cpu_usage": cpu_usage,
-        "ram_usage": ram_usage,
-        "gpu_usage": gpu_usage,
-        "gpu_detected": gpu_detected,
-    }
+@app.get("/api/jobs")
+async def get_jobs():
+    """
+    回傳背景工作排程器的狀態：各資源的槽位上限、執行中與排隊中的工作。
+    """
+    return job_scheduler.snapshot()
 
 
 @app.get("/api/tasks")
@@ -427,27 +906,155 @@ async def get_all_tasks_endpoint():
     return JSONResponse(content=tasks)
 
 
+@app.get("/api/queue/stats")
+async def get_queue_stats_endpoint(window_minutes: int = Query(5, ge=1, le=1440)):
+    """
+    獲取佇列統計資訊，供 UI 與監控使用。
+    """
+    try:
+        return JSONResponse(content=db_client.get_queue_stats(window_minutes=window_minutes))
+    except Exception as e:
+        log.error(f"❌ 獲取佇列統計時 API 出錯: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="獲取佇列統計時發生內部錯誤")
+
+
 @app.get("/api/logs")
 async def get_system_logs_endpoint(
     levels: List[str] = Query(None, alias="level"),
-    sources: List[str] = Query(None, alias="source")
+    sources: List[str] = Query(None, alias="source"),
+    since_id: Optional[int] = Query(None, ge=0),
+    until: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    latest: bool = False,
+    task_id: Optional[str] = None
 ):
     """
-    獲取系統日誌，可按等級和來源進行篩選。
+    獲取系統日誌，可按等級、來源與任務 ID 進行篩選。
+    `since_id` 可作為游標只取得新日誌；`latest=true` 搭配 `limit` 則回傳最新的 N 筆 (由新到舊)。
     """
-    log.info(f"API: 正在查詢系統日誌 (Levels: {levels}, Sources: {sources})")
+    log.info(f"API: 正在查詢系統日誌 (Levels: {levels}, Sources: {sources}, task_id: {task_id}, since_id: {since_id}, limit: {limit}, latest: {latest})")
     try:
-        logs = db_client.get_system_logs(levels=levels, sources=sources)
+        logs = db_client.get_system_logs(
+            levels=levels, sources=sources, since_id=since_id, until=until, limit=limit, latest=latest, task_id=task_id
+        )
         return JSONResponse(content=logs)
     except Exception as e:
         log.error(f"❌ 查詢系統日誌時 API 出錯: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="查詢系統日誌時發生內部錯誤")
 
 
+# --- 即時日誌串流 (Server-Sent Events) ---
+LOG_STREAM_POLL_INTERVAL = 1.0       # 秒；沒有新日誌時的查詢間隔
+LOG_STREAM_BATCH_LIMIT = 500         # 單次查詢最多取得的日誌筆數
+LOG_STREAM_HEARTBEAT_SECONDS = 15    # 閒置時送出註解行，避免代理伺服器關閉連線
+
+
+async def _log_event_stream(request: Request, filters: dict, cursor: int):
+    """
+    從 `cursor` 之後開始，持續以 SSE 格式送出符合篩選條件的新日誌。
+    每次查詢都走 since_id 游標，因此每輪只傳輸新寫入的資料列。
+    注意：此處不可寫入任何日誌，否則串流會不斷看到自己產生的日誌。
+    """
+    # 告訴瀏覽器斷線後 3 秒重連；重連時 EventSource 會自動帶上 Last-Event-ID
+    yield "retry: 3000\n\n"
+    last_sent = time.monotonic()
+    while not await request.is_disconnected():
+        try:
+            rows = await asyncio.to_thread(
+                db_client.get_system_logs, since_id=cursor, limit=LOG_STREAM_BATCH_LIMIT, **filters
+            ) or []
+        except Exception:
+            rows = []
+        for row in rows:
+            cursor = row["id"]
+            yield f"id: {row['id']}\nevent: log\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+        now = time.monotonic()
+        if rows:
+            last_sent = now
+        elif now - last_sent >= LOG_STREAM_HEARTBEAT_SECONDS:
+            yield ": keep-alive\n\n"
+            last_sent = now
+        # 一次沒取完代表還有積壓，立即再查一次
+        if len(rows) < LOG_STREAM_BATCH_LIMIT:
+            await asyncio.sleep(LOG_STREAM_POLL_INTERVAL)
+
+
+@app.get("/api/logs/stream")
+async def stream_system_logs_endpoint(
+    request: Request,
+    levels: List[str] = Query(None, alias="level"),
+    sources: List[str] = Query(None, alias="source"),
+    task_id: Optional[str] = None,
+    since_id: Optional[int] = Query(None, ge=0),
+    backlog: int = Query(0, ge=0, le=1000)
+):
+    """
+    以 Server-Sent Events 即時推送新寫入的系統日誌，支援與 `/api/logs` 相同的篩選條件。
+    `since_id` (或重連時的 `Last-Event-ID` 標頭) 可從指定位置續傳；
+    未提供時從目前最新的日誌之後開始，並可用 `backlog` 先送出最近的 N 筆。
+    """
+    filters = {"levels": levels, "sources": sources, "task_id": task_id}
+
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since_id = int(last_event_id)
+
+    if since_id is None:
+        try:
+            latest = await asyncio.to_thread(
+                db_client.get_system_logs, limit=max(backlog, 1), latest=True, **filters
+            ) or []
+        except Exception as e:
+            log.error(f"❌ 開啟日誌串流時 API 出錯: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="開啟日誌串流時發生內部錯誤")
+        if not latest:
+            since_id = 0
+        elif backlog:
+            since_id = latest[-1]["id"] - 1
+        else:
+            since_id = latest[0]["id"]
+
+    return StreamingResponse(
+        _log_event_stream(request, filters, since_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/logs/stages")
+async def get_stage_durations_endpoint(task_id: Optional[str] = None, since: Optional[str] = None):
+    """
+    依處理階段彙總結構化日誌中的耗時 (可限定單一任務或起始時間)。
+    """
+    try:
+        return JSONResponse(content=db_client.get_stage_durations(task_id=task_id, since=since))
+    except Exception as e:
+        log.error(f"❌ 彙總階段耗時時 API 出錯: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="彙總階段耗時時發生內部錯誤")
+
+
+@app.get("/api/search")
+async def search_transcripts_endpoint(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """
+    在所有已完成任務的逐字稿與 AI 報告中進行全文檢索，回傳依相關度排序的摘錄。
+    """
+    try:
+        results = db_client.search_transcripts(q, limit=limit, offset=offset)
+        return JSONResponse(content={"query": q, "results": results})
+    except Exception as e:
+        log.error(f"❌ 全文檢索時 API 出錯: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="全文檢索時發生內部錯誤")
+
+
 @app.get("/api/download/{task_id}")
-async def download_transcript(task_id: str):
+async def download_transcript(task_id: str, request: Request):
     """
     根據任務 ID 下載轉錄結果檔案。
+    支援 Range 請求 (續傳下載) 與 ETag 快取驗證。
     """
     task = db_client.get_task_status(task_id)
     if not task:
@@ -487,7 +1094,6 @@ async def download_transcript(task_id: str):
             raise HTTPException(status_code=404, detail="檔案遺失或無法讀取。")
 
         # 提供檔案下載
-        from fastapi.responses import FileResponse
         ext = file_path.suffix.lower()
         if ext == '.pdf':
             media_type = 'application/pdf'
@@ -499,7 +1105,7 @@ async def download_transcript(task_id: str):
             media_type = f'audio/{ext.strip(".")}'
         else:
             media_type = 'text/plain'
-        return FileResponse(path=file_path, filename=file_path.name, media_type=media_type)
+        return _cached_file_response(request, file_path, filename=file_path.name, media_type=media_type)
 
     except (json.JSONDecodeError, KeyError) as e:
         log.error(f"❌ 解析任務 {task_id} 的結果時出錯: {e}")
@@ -767,11 +1373,12 @@ async def process_youtube_urls(request: Request):
 
 def trigger_model_download(model_size: str, loop: asyncio.AbstractEventLoop):
     """
-    在一個單獨的執行緒中執行模型下載，並透過 WebSocket 回報結果。
+    透過排程器在背景執行緒中執行模型下載 (佔用 download 槽位)，並透過 WebSocket 回報結果。
     這個版本會逐行讀取 stdout 來獲取即時的 JSON 進度更新。
     """
     def _download_in_thread():
         log.info(f"🧵 [執行緒] 開始下載模型: {model_size}")
+        model_registry.mark_downloading(model_size)
         try:
             tool_script_path = ROOT_DIR / "src" / "tools" / ("mock_transcriber.py" if IS_MOCK_MODE else "transcriber.py")
             cmd = [sys.executable, str(tool_script_path), "--command=download", f"--model_size={model_size}"]
@@ -832,15 +1439,17 @@ def trigger_model_download(model_size: str, loop: asyncio.AbstractEventLoop):
                 "payload": {"model": model_size, "status": "failed", "error": str(e)}
             }
             asyncio.run_coroutine_threadsafe(manager.broadcast_json(message), loop)
+        finally:
+            # 不論成功與否都重新掃描快取，讓登錄表立即反映結果
+            model_registry.mark_download_finished(model_size)
 
-    # 建立並啟動執行緒
-    thread = threading.Thread(target=_download_in_thread)
-    thread.start()
+    # 交由排程器在下載槽位可用時執行
+    job_scheduler.submit("download", _download_in_thread, name=f"model_download:{model_size}")
 
 
 def trigger_transcription(task_id: str, file_path: str, model_size: str, language: Optional[str], beam_size: int, loop: asyncio.AbstractEventLoop, original_filename: Optional[str] = None):
     """
-    在一個單獨的執行緒中執行轉錄，並透過 WebSocket 即時串流結果。
+    透過排程器在背景執行緒中執行轉錄 (佔用 transcribe 槽位)，並透過 WebSocket 即時串流結果。
     """
     def _transcribe_in_thread():
         display_name = original_filename or file_path
@@ -868,14 +1477,16 @@ def trigger_transcription(task_id: str, file_path: str, model_size: str, languag
 
             log.info(f"執行轉錄指令: {' '.join(map(str, cmd))}")
 
-            process = subprocess.Popen(
+            # 子程序以獨立的程序群組啟動並登記到排程器，取消任務時可以一併終止
+            process = job_scheduler.track_process(subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True,
                 encoding='utf-8',
-                bufsize=1
-            )
+                bufsize=1,
+                **PROCESS_GROUP_KWARGS
+            ))
 
             start_message_filename = original_filename or Path(file_path).name
             start_message = {
@@ -884,6 +1495,7 @@ def trigger_transcription(task_id: str, file_path: str, model_size: str, languag
             }
             asyncio.run_coroutine_threadsafe(manager.broadcast_json(start_message), loop)
 
+            publish = functools.partial(_publish_segments, task_id, loop)
             if process.stdout:
                 for line in iter(process.stdout.readline, ''):
                     line = line.strip()
@@ -892,15 +1504,19 @@ def trigger_transcription(task_id: str, file_path: str, model_size: str, languag
                     try:
                         data = json.loads(line)
                         if data.get("type") == "segment":
-                            message = {
-                                "type": "TRANSCRIPTION_UPDATE",
-                                "payload": {"task_id": task_id, **data}
-                            }
-                            asyncio.run_coroutine_threadsafe(manager.broadcast_json(message), loop)
+                            # 片段會依任務合併，湊滿一批或超過時限後才寫入並推送
+                            segment_batcher.add(task_id, data, publish)
                     except json.JSONDecodeError:
                         log.warning(f"[執行緒] 無法解析來自 transcriber 的 JSON 行: {line}")
 
             process.wait()
+            # 先送出剩餘的片段，確保最終狀態訊息在所有片段之後
+            segment_batcher.flush(task_id)
+
+            if job_scheduler.is_cancelled():
+                # 狀態與通知已由取消流程處理
+                log.info(f"🛑 [執行緒] 轉錄任務 '{task_id}' 已被取消。")
+                return
 
             if process.returncode == 0:
                 log.info(f"✅ [執行緒] 轉錄任務 '{task_id}' 成功完成。")
@@ -912,7 +1528,9 @@ def trigger_transcription(task_id: str, file_path: str, model_size: str, languag
                     "transcript_path": convert_to_media_url(str(output_file_path)),
                     "output_path": convert_to_media_url(str(output_file_path)) # 增加一個通用的 output_path
                 }
-                db_client.update_task_status(task_id, 'completed', json.dumps(final_result_obj))
+                if not db_client.update_task_status(task_id, 'completed', json.dumps(final_result_obj)):
+                    log.info(f"🛑 [執行緒] 轉錄任務 '{task_id}' 已被取消，不送出完成通知。")
+                    return
                 log.info(f"✅ [執行緒] 已將任務 {task_id} 的狀態和結果更新至資料庫。")
 
                 final_message = {
@@ -931,18 +1549,20 @@ def trigger_transcription(task_id: str, file_path: str, model_size: str, languag
 
         except Exception as e:
             log.error(f"❌ [執行緒] 轉錄執行緒中發生嚴重錯誤: {e}", exc_info=True)
+            segment_batcher.flush(task_id)
+            if job_scheduler.is_cancelled():
+                return
             error_message = {
                 "type": "TRANSCRIPTION_STATUS",
                 "payload": {"task_id": task_id, "status": "failed", "error": str(e)}
             }
             asyncio.run_coroutine_threadsafe(manager.broadcast_json(error_message), loop)
 
-    thread = threading.Thread(target=_transcribe_in_thread)
-    thread.start()
+    job_scheduler.submit("transcribe", _transcribe_in_thread, task_id=task_id, name="transcription")
 
 
 def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
-    """在一個單獨的執行緒中執行 YouTube 處理流程（已更新為彈性模式）。"""
+    """透過排程器在背景執行緒中執行 YouTube 處理流程（已更新為彈性模式）。"""
     def _process_in_thread():
         log.info(f"🧵 [執行緒] 開始處理 YouTube 任務鏈，起始 ID: {task_id}")
 
@@ -976,7 +1596,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
                 cmd_dl.extend(["--cookies-file", str(cookies_path)])
 
             proc_env = os.environ.copy()
-            process_dl = subprocess.Popen(cmd_dl, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', env=proc_env)
+            process_dl = job_scheduler.track_process(subprocess.Popen(
+                cmd_dl, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', env=proc_env, **PROCESS_GROUP_KWARGS
+            ))
 
             # JULES'S FIX: 讀取 stderr 以獲取即時進度更新，與 Gemini 處理器保持一致
             if process_dl.stderr:
@@ -995,6 +1617,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
 
 
             stdout_output, stderr_output = process_dl.communicate()
+            if job_scheduler.is_cancelled():
+                log.info(f"🛑 [執行緒] YouTube 任務 {task_id} 已被取消。")
+                return
 
             if process_dl.returncode != 0:
                 raise RuntimeError(f"YouTube downloader failed. stderr: {stderr_output}")
@@ -1007,7 +1632,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
             if task_type == 'youtube_download_only':
                 # 問題二：將檔案系統路徑轉換為可存取的 URL
                 download_result['output_path'] = convert_to_media_url(download_result['output_path'])
-                db_client.update_task_status(task_id, 'completed', json.dumps(download_result))
+                if not db_client.update_task_status(task_id, 'completed', json.dumps(download_result)):
+                    log.info(f"🛑 [執行緒] '僅下載媒體' 任務 {task_id} 已被取消。")
+                    return
                 log.info(f"✅ [執行緒] '僅下載媒體' 任務 {task_id} 完成。")
                 asyncio.run_coroutine_threadsafe(manager.broadcast_json({
                     "type": "YOUTUBE_STATUS",
@@ -1015,12 +1642,21 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
                 }), loop)
                 return
 
-            db_client.update_task_status(task_id, 'completed', json.dumps(download_result))
+            if not db_client.update_task_status(task_id, 'completed', json.dumps(download_result)):
+                log.info(f"🛑 [執行緒] YouTube 下載任務 {task_id} 已被取消。")
+                return
             dependent_task_id = db_client.find_dependent_task(task_id)
             if not dependent_task_id:
                 raise ValueError(f"找不到依賴於下載任務 {task_id} 的 gemini_process 任務")
+            # 訂閱了下載任務的連線也會收到後續 AI 分析任務的訊息
+            loop.call_soon_threadsafe(manager.follow_task, task_id, dependent_task_id)
+            # 下載完成：釋放下載槽位，等待 gemini 槽位後才開始 AI 分析
+            job_scheduler.handoff("gemini", task_id=dependent_task_id)
 
             process_task_info = db_client.get_task_status(dependent_task_id)
+            if job_scheduler.is_cancelled() or process_task_info.get('status') == 'cancelled':
+                log.info(f"🛑 [執行緒] AI 分析任務 {dependent_task_id} 已被取消，略過處理。")
+                return
             process_payload = json.loads(process_task_info['payload'])
             model = process_payload['model']
             tasks_to_run = process_payload.get('tasks', 'summary,transcript')
@@ -1049,9 +1685,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
             ]
 
             proc_env = os.environ.copy()
-            process_gemini = subprocess.Popen(
-                cmd_process, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', env=proc_env
-            )
+            process_gemini = job_scheduler.track_process(subprocess.Popen(
+                cmd_process, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', env=proc_env, **PROCESS_GROUP_KWARGS
+            ))
 
             if process_gemini.stderr:
                 for line in iter(process_gemini.stderr.readline, ''):
@@ -1068,6 +1704,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
                         log.debug(f"[stderr from gemini_processor]: {line}")
 
             stdout_output, _ = process_gemini.communicate()
+            if job_scheduler.is_cancelled():
+                log.info(f"🛑 [執行緒] AI 分析任務 {dependent_task_id} 已被取消。")
+                return
             if process_gemini.returncode != 0:
                 raise RuntimeError(f"Gemini processor failed with exit code {process_gemini.returncode}. Stderr: {stdout_output}")
 
@@ -1077,7 +1716,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
                  if key in process_result and process_result[key]:
                     process_result[key] = convert_to_media_url(process_result[key])
 
-            db_client.update_task_status(dependent_task_id, 'completed', json.dumps(process_result))
+            if not db_client.update_task_status(dependent_task_id, 'completed', json.dumps(process_result)):
+                log.info(f"🛑 [執行緒] AI 分析任務 {dependent_task_id} 已被取消，不送出完成通知。")
+                return
             log.info(f"✅ [執行緒] Gemini AI 處理完成。")
 
             asyncio.run_coroutine_threadsafe(manager.broadcast_json({
@@ -1086,6 +1727,9 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
             }), loop)
 
         except Exception as e:
+            if job_scheduler.is_cancelled():
+                log.info(f"🛑 [執行緒] YouTube 處理鏈 {task_id} 已被取消。")
+                return
             log.error(f"❌ [執行緒] YouTube 處理鏈中發生錯誤: {e}", exc_info=True)
             failed_task_id = dependent_task_id if dependent_task_id else task_id
             error_payload = {"error": str(e)}
@@ -1097,14 +1741,15 @@ def trigger_youtube_processing(task_id: str, loop: asyncio.AbstractEventLoop):
                         error_payload["error_type"] = "AUTH_REQUIRED"
             except (json.JSONDecodeError, TypeError):
                 pass
-            db_client.update_task_status(failed_task_id, 'failed', json.dumps(error_payload))
+            if not db_client.update_task_status(failed_task_id, 'failed', json.dumps(error_payload)):
+                return
             asyncio.run_coroutine_threadsafe(manager.broadcast_json({
                 "type": "YOUTUBE_STATUS",
                 "payload": {"task_id": failed_task_id, "status": "failed", **error_payload}
             }), loop)
 
-    thread = threading.Thread(target=_process_in_thread)
-    thread.start()
+    # 下載階段佔用 download 槽位，AI 分析階段再改用 gemini 槽位 (見 handoff)
+    job_scheduler.submit("download", _process_in_thread, task_id=task_id, name="youtube_processing")
 
 
 @app.get("/api/debug/latest_frontend_action_log")
@@ -1114,14 +1759,13 @@ async def get_latest_frontend_action_log():
     用於 E2E 測試，以驗證日誌是否已成功寫入資料庫。
     """
     try:
-        # 我們只關心來自 'frontend_action' logger 的日誌
-        logs = db_client.get_system_logs(sources=['frontend_action'])
+        # 我們只關心來自 'frontend_action' logger 的日誌，且只需要最新的一筆
+        logs = db_client.get_system_logs(sources=['frontend_action'], limit=1, latest=True)
         if not logs:
             # 如果沒有日誌，返回一個清晰的空回應，而不是 404
             return JSONResponse(content={"latest_log": None}, status_code=200)
 
-        # get_system_logs 按時間戳升序排序，所以最後一個就是最新的
-        latest_log = logs[-1]
+        latest_log = logs[0]
         return JSONResponse(content={"latest_log": latest_log})
     except Exception as e:
         log.error(f"❌ 查詢最新前端日誌時出錯: {e}", exc_info=True)
@@ -1152,17 +1796,30 @@ async def websocket_endpoint(websocket: WebSocket):
                         loop = asyncio.get_running_loop()
                         trigger_model_download(model_size, loop)
                     else:
-                        await manager.broadcast_json({"type": "ERROR", "payload": "缺少模型大小參數"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": "缺少模型大小參數"}, websocket)
 
                 elif msg_type == "START_TRANSCRIPTION":
                     task_id = payload.get("task_id")
                     if not task_id:
-                        await manager.broadcast_json({"type": "ERROR", "payload": "缺少 task_id 參數"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": "缺少 task_id 參數"}, websocket)
                         continue
 
                     task_info = db_client.get_task_status(task_id)
                     if not task_info:
-                        await manager.broadcast_json({"type": "ERROR", "payload": f"找不到任務 {task_id}"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": f"找不到任務 {task_id}"}, websocket)
+                        continue
+
+                    if task_info.get("status") == "completed":
+                        # 例如重用了相同檔案的轉錄結果：不需要再執行，直接回傳結果
+                        try:
+                            completed_result = json.loads(task_info.get("result") or "{}")
+                            completed_filename = json.loads(task_info["payload"]).get("original_filename")
+                        except (json.JSONDecodeError, TypeError):
+                            completed_result, completed_filename = {}, None
+                        await manager.send_personal_json({
+                            "type": "TRANSCRIPTION_STATUS",
+                            "payload": {"task_id": task_id, "status": "completed", "result": completed_result, "filename": completed_filename}
+                        }, websocket)
                         continue
 
                     try:
@@ -1173,11 +1830,11 @@ async def websocket_endpoint(websocket: WebSocket):
                         beam_size = task_payload.get("beam_size", 5)
                         original_filename = task_payload.get("original_filename") # JULES'S FIX
                     except (json.JSONDecodeError, KeyError) as e:
-                        await manager.broadcast_json({"type": "ERROR", "payload": f"解析任務 {task_id} 的 payload 失敗: {e}"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": f"解析任務 {task_id} 的 payload 失敗: {e}"}, websocket)
                         continue
 
                     if not file_path:
-                        await manager.broadcast_json({"type": "ERROR", "payload": "任務 payload 中缺少檔案路徑"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": "任務 payload 中缺少檔案路徑"}, websocket)
                     else:
                         display_name = original_filename or file_path
                         log.info(f"收到開始轉錄 '{display_name}' 的請求 (來自任務 {task_id})。")
@@ -1187,22 +1844,44 @@ async def websocket_endpoint(websocket: WebSocket):
                 elif msg_type == "START_YOUTUBE_PROCESSING":
                     task_id = payload.get("task_id") # This is the download_task_id
                     if not task_id:
-                        await manager.broadcast_json({"type": "ERROR", "payload": "缺少 task_id 參數"})
+                        await manager.send_personal_json({"type": "ERROR", "payload": "缺少 task_id 參數"}, websocket)
                         continue
 
                     log.info(f"收到開始處理 YouTube 任務鏈的請求 (起始任務 ID: {task_id})。")
                     loop = asyncio.get_running_loop()
                     trigger_youtube_processing(task_id, loop)
 
+                elif msg_type == "CANCEL_TASK":
+                    task_id = payload.get("task_id")
+                    if not task_id:
+                        await manager.send_personal_json({"type": "ERROR", "payload": "缺少 task_id 參數"}, websocket)
+                        continue
+                    log.info(f"收到取消任務 {task_id} 的請求。")
+                    result = await cancel_task(task_id, reason="使用者取消了任務")
+                    if result is None:
+                        await manager.send_personal_json({"type": "ERROR", "payload": f"找不到任務 {task_id}"}, websocket)
+                    elif not result["cancelled"]:
+                        await manager.send_personal_json({"type": "ERROR", "payload": f"任務 {task_id} 已經結束，無法取消"}, websocket)
+
+                elif msg_type in ("SUBSCRIBE", "UNSUBSCRIBE"):
+                    # payload: {"task_ids": [...], "events": [...]}；SUBSCRIBE 時可用 {"all": true} 恢復接收全部訊息
+                    task_ids = payload.get("task_ids") or []
+                    events = payload.get("events") or []
+                    if msg_type == "SUBSCRIBE":
+                        subscriptions = manager.subscribe(websocket, task_ids, events, all_topics=bool(payload.get("all")))
+                    else:
+                        subscriptions = manager.unsubscribe(websocket, task_ids, events)
+                    await manager.send_personal_json({"type": "SUBSCRIPTIONS", "payload": subscriptions}, websocket)
+
                 else:
-                    await manager.broadcast_json({
+                    await manager.send_personal_json({
                         "type": "ECHO",
                         "payload": f"已收到未知類型的訊息: {msg_type}"
-                    })
+                    }, websocket)
 
             except json.JSONDecodeError:
                 log.error("收到了非 JSON 格式的 WebSocket 訊息。")
-                await manager.broadcast_json({"type": "ERROR", "payload": "訊息必須是 JSON 格式"})
+                await manager.send_personal_json({"type": "ERROR", "payload": "訊息必須是 JSON 格式"}, websocket)
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -1210,8 +1889,7 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         log.error(f"WebSocket 發生未預期錯誤: {e}", exc_info=True)
         # 確保在發生錯誤時也中斷連線
-        if websocket in manager.active_connections:
-            manager.disconnect(websocket)
+        manager.disconnect(websocket)
 
 
 @app.get("/api/health")
@@ -1235,9 +1913,7 @@ async def notify_task_update(payload: Dict):
     task_info = db_client.get_task_status(task_id)
     task_type = task_info.get("type", "transcribe") if task_info else "transcribe"
 
-    message_type = "TRANSCRIPTION_STATUS"
-    if "youtube" in task_type or "gemini" in task_type:
-        message_type = "YOUTUBE_STATUS"
+    message_type = _status_message_type(task_type)
 
     log.info(f"根據任務類型 '{task_type}'，將使用 WebSocket 訊息類型: '{message_type}'")
 
@@ -0,0 +1,278 @@
+# api/connection_manager.py
+#
+# `/api/ws` 的 WebSocket 連線管理器。
+#
+# 每個連線都有自己的有界發送佇列與專屬的發送任務 (sender task)：
+#   - 廣播時訊息只序列化一次，接著放入每個連線的佇列後立即返回，不等待任何 send；
+#   - 各連線的發送任務各自把佇列中的訊息送出，緩慢或卡住的瀏覽器只會拖慢自己；
+#   - 佇列滿載時依 `overflow_policy` 丟棄最舊的訊息或中斷該連線；
+#   - 送出失敗的連線 (已離線的 socket) 會被自動移除。
+#
+# 主題訂閱 (topic subscription)：
+#   連線預設會收到所有訊息。用戶端一旦送出 SUBSCRIBE，就只會收到它訂閱的事件類型
+#   (訊息的 `type`，例如 SYSTEM_STATS) 或任務 (訊息 `payload.task_id`) 的訊息，
+#   直到以 `{"all": true}` 重新訂閱全部為止。管理器以主題建立反向索引，
+#   廣播時只查詢相關連線，因此每個連線的流量只與它關注的內容有關。
+import asyncio
+import json
+import logging
+
+from fastapi import WebSocket
+
+from db import config
+
+log = logging.getLogger(__name__)
+
+# 佇列滿載時的處理策略：
+#   drop_oldest: 丟棄佇列中最舊的訊息，保留最新的狀態 (預設)
+#   disconnect:  中斷該連線，讓用戶端重新連線後取得最新狀態
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+# 可在 config.json 的 `websocket` 區段中覆寫
+DEFAULT_SETTINGS = {
+    "queue_size": 256,             # 每個連線最多暫存的待送訊息數
+    "overflow_policy": "drop_oldest",
+}
+
+# 佇列滿載而中斷連線時使用的關閉代碼 (1013: Try Again Later)
+OVERFLOW_CLOSE_CODE = 1013
+
+
+class _Client:
+    """單一 WebSocket 連線的發送狀態。"""
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.sender: asyncio.Task | None = None
+        self.dropped = 0
+        # filtered 為 False 時接收所有訊息；為 True 時只接收下列主題
+        self.filtered = False
+        self.task_ids: set[str] = set()
+        self.events: set[str] = set()
+
+
+class ConnectionManager:
+    """
+    管理所有 WebSocket 連線，並以每個連線各自的佇列進行非阻塞的廣播。
+
+    :param queue_size: 每個連線的發送佇列大小。
+    :param overflow_policy: 佇列滿載時的策略，見 `OVERFLOW_POLICIES`。
+    """
+    def __init__(self, queue_size: int = None, overflow_policy: str = None):
+        settings = config.get_section("websocket", DEFAULT_SETTINGS)
+        self.queue_size = max(1, int(queue_size or settings["queue_size"]))
+        self.overflow_policy = overflow_policy or settings["overflow_policy"]
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            log.warning(f"未知的 WebSocket 佇列溢出策略 '{self.overflow_policy}'，將改用 'drop_oldest'。")
+            self.overflow_policy = "drop_oldest"
+        self._clients: dict[WebSocket, _Client] = {}
+        # 主題 -> 訂閱者 的反向索引
+        self._unfiltered: set[_Client] = set()
+        self._task_index: dict[str, set[_Client]] = {}
+        self._event_index: dict[str, set[_Client]] = {}
+
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        return list(self._clients)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = _Client(websocket, self.queue_size)
+        client.sender = asyncio.create_task(self._sender_loop(client))
+        self._clients[websocket] = client
+        self._unfiltered.add(client)
+        log.info(f"新用戶端連線。目前共 {len(self._clients)} 個連線。")
+
+    def disconnect(self, websocket: WebSocket):
+        """移除連線並停止其發送任務。重複呼叫是安全的。"""
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        self._clear_topics(client)
+        self._unfiltered.discard(client)
+        if client.sender and client.sender is not asyncio.current_task():
+            client.sender.cancel()
+        log.info(f"一個用戶端離線。目前共 {len(self._clients)} 個連線。")
+
+    # --- 主題訂閱 ---
+
+    @staticmethod
+    def _index_add(index: dict, keys, client: _Client):
+        for key in keys:
+            index.setdefault(key, set()).add(client)
+
+    @staticmethod
+    def _index_remove(index: dict, keys, client: _Client):
+        for key in keys:
+            subscribers = index.get(key)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del index[key]
+
+    def _clear_topics(self, client: _Client):
+        self._index_remove(self._task_index, client.task_ids, client)
+        self._index_remove(self._event_index, client.events, client)
+        client.task_ids.clear()
+        client.events.clear()
+
+    def subscribe(self, websocket: WebSocket, task_ids=(), events=(), all_topics: bool = False) -> dict:
+        """
+        訂閱任務或事件類型。第一次訂閱後，此連線只會收到訂閱主題的訊息。
+
+        :param task_ids: 要接收其訊息的任務 ID。
+        :param events: 要接收的訊息類型 (例如 'DOWNLOAD_STATUS')。
+        :param all_topics: 為 True 時清除所有主題，恢復接收全部訊息。
+        :return: 此連線目前的訂閱狀態。
+        """
+        client = self._clients.get(websocket)
+        if client is None:
+            return {}
+        if all_topics:
+            self._clear_topics(client)
+            client.filtered = False
+            self._unfiltered.add(client)
+            return self.subscriptions(websocket)
+
+        new_tasks = {str(t) for t in task_ids} - client.task_ids
+        new_events = {str(e) for e in events} - client.events
+        client.task_ids |= new_tasks
+        client.events |= new_events
+        self._index_add(self._task_index, new_tasks, client)
+        self._index_add(self._event_index, new_events, client)
+        client.filtered = True
+        self._unfiltered.discard(client)
+        return self.subscriptions(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, task_ids=(), events=()) -> dict:
+        """取消訂閱指定的任務或事件類型 (連線仍維持在篩選模式)。"""
+        client = self._clients.get(websocket)
+        if client is None:
+            return {}
+        removed_tasks = {str(t) for t in task_ids} & client.task_ids
+        removed_events = {str(e) for e in events} & client.events
+        client.task_ids -= removed_tasks
+        client.events -= removed_events
+        self._index_remove(self._task_index, removed_tasks, client)
+        self._index_remove(self._event_index, removed_events, client)
+        return self.subscriptions(websocket)
+
+    def follow_task(self, parent_task_id: str, child_task_id: str):
+        """讓訂閱了父任務的連線也自動訂閱其後續任務 (例如下載完成後的 AI 分析任務)。"""
+        followers = self._task_index.get(str(parent_task_id))
+        if not followers:
+            return
+        child = str(child_task_id)
+        for client in list(followers):
+            client.task_ids.add(child)
+            self._index_add(self._task_index, [child], client)
+
+    def subscriptions(self, websocket: WebSocket) -> dict:
+        client = self._clients.get(websocket)
+        if client is None:
+            return {}
+        return {"all": not client.filtered, "task_ids": sorted(client.task_ids), "events": sorted(client.events)}
+
+    def _recipients(self, data: dict) -> set[_Client]:
+        """依訊息的 type 與 payload.task_id 找出應收到此訊息的連線。"""
+        recipients = set(self._unfiltered)
+        recipients.update(self._event_index.get(data.get("type"), ()))
+        payload = data.get("payload")
+        task_id = payload.get("task_id") if isinstance(payload, dict) else None
+        if task_id is not None:
+            recipients.update(self._task_index.get(str(task_id), ()))
+        return recipients
+
+    def has_recipients(self, event: str) -> bool:
+        """是否有任何連線會收到此類型 (與任務無關) 的訊息，可用來略過不必要的工作。"""
+        return bool(self._unfiltered or self._event_index.get(event))
+
+    # --- 發送 ---
+
+    async def _sender_loop(self, client: _Client):
+        """將此連線佇列中的訊息依序送出；送出失敗時移除此連線。"""
+        try:
+            while True:
+                message = await client.queue.get()
+                await client.websocket.send_text(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.warning(f"⚠️ 傳送 WebSocket 訊息失敗，將移除此連線: {e}")
+            self.disconnect(client.websocket)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            # 連線可能早已中斷，忽略關閉時的錯誤
+            pass
+
+    def _enqueue(self, client: _Client, message: str):
+        """將訊息放入連線的佇列，佇列已滿時套用溢出策略。"""
+        try:
+            client.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "disconnect":
+            log.warning(f"⚠️ WebSocket 用戶端的發送佇列已滿 ({self.queue_size} 則)，將中斷此連線。")
+            self.disconnect(client.websocket)
+            asyncio.create_task(self._close(client.websocket, OVERFLOW_CLOSE_CODE))
+            return
+
+        # drop_oldest: 移除最舊的一則後放入新訊息
+        client.queue.get_nowait()
+        client.queue.put_nowait(message)
+        client.dropped += 1
+        if client.dropped == 1:
+            log.warning(f"⚠️ WebSocket 用戶端的發送佇列已滿 ({self.queue_size} 則)，開始丟棄最舊的訊息。")
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        client = self._clients.get(websocket)
+        if client is None:
+            await websocket.send_text(message)
+            return
+        self._enqueue(client, message)
+
+    async def send_personal_json(self, data: dict, websocket: WebSocket):
+        """只傳送給單一連線 (例如對其請求的錯誤回覆)，不受訂閱篩選影響。"""
+        await self.send_personal_message(json.dumps(data, separators=(",", ":"), ensure_ascii=False), websocket)
+
+    async def broadcast(self, message: str):
+        """將已序列化的訊息放入每個連線的佇列後立即返回 (不經主題篩選)。"""
+        for client in list(self._clients.values()):
+            self._enqueue(client, message)
+
+    async def broadcast_json(self, data: dict):
+        """依主題將訊息送給訂閱的連線 (以及未篩選的連線)。"""
+        recipients = self._recipients(data)
+        if not recipients:
+            return
+        # 只序列化一次 (格式與 WebSocket.send_json 相同)，所有連線共用同一個字串
+        message = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        for client in recipients:
+            self._enqueue(client, message)
+
+    def stats(self) -> dict:
+        """回傳每個連線的佇列深度與丟棄數，供除錯使用。"""
+        return {
+            "connections": len(self._clients),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "clients": [
+                {"queued": c.queue.qsize(), "dropped": c.dropped, "filtered": c.filtered,
+                 "task_ids": len(c.task_ids), "events": len(c.events)}
+                for c in self._clients.values()
+            ],
+        }
+
+    async def close_all(self):
+        """停止所有發送任務 (應用程式關閉時呼叫)。"""
+        clients = list(self._clients.values())
+        for client in clients:
+            self.disconnect(client.websocket)
+        senders = [c.sender for c in clients if c.sender]
+        if senders:
+            await asyncio.gather(*senders, return_exceptions=True)
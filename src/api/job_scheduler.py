@@ -0,0 +1,301 @@
+# api/job_scheduler.py
+#
+# API 伺服器的背景工作排程器。
+#
+# 過去 `trigger_transcription`、`trigger_model_download` 與 `trigger_youtube_processing`
+# 每收到一個請求就直接啟動一個執行緒與子程序，同時湧入的請求會一次啟動多個 whisper
+# 程序而耗盡 CPU 與記憶體。此模組為每種資源維護固定數量的「槽位」(slot)：
+#   - transcribe: 本地轉錄 (CPU 密集)
+#   - download:   YouTube 與模型下載 (網路)
+#   - gemini:     Gemini AI 分析 (外部 API 配額)
+# 槽位已滿時工作會排入該資源的佇列，等到有槽位釋放才建立執行緒開始執行。
+#
+# 工作可以被取消：排隊中的工作直接移出佇列；執行中的工作會被標記為已取消，
+# 並終止它透過 `track_process` 登記的子程序 (連同其整個程序群組)。
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+from db import config
+
+log = logging.getLogger(__name__)
+
+# 可在 config.json 的 `scheduler` 區段中覆寫
+DEFAULT_SETTINGS = {
+    "slots": {
+        "transcribe": 1,
+        "download": 3,
+        "gemini": 2,
+    },
+}
+
+# 未列在設定中的資源使用的槽位數
+DEFAULT_SLOTS = 1
+
+# 子程序收到終止訊號後，超過此秒數仍未結束就強制結束
+KILL_TIMEOUT = 5.0
+
+# 傳給 subprocess.Popen 的參數：讓子程序成為新程序群組的首領，
+# 取消時才能一併終止它衍生的程序 (例如 ffmpeg)
+if os.name == "posix":
+    PROCESS_GROUP_KWARGS = {"start_new_session": True}
+else:
+    PROCESS_GROUP_KWARGS = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def _signal_process_group(proc: subprocess.Popen, force: bool = False):
+    if proc.poll() is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+        elif force:
+            proc.kill()
+        else:
+            proc.send_signal(signal.CTRL_BREAK_EVENT)
+    except (ProcessLookupError, PermissionError, OSError):
+        # 程序群組已不存在 (或子程序未以新群組啟動)，退而只終止子程序本身
+        try:
+            proc.kill() if force else proc.terminate()
+        except OSError:
+            pass
+
+
+def terminate_process_tree(proc: subprocess.Popen, timeout: float = KILL_TIMEOUT):
+    """
+    終止子程序及其程序群組。不會阻塞呼叫端：先送出終止訊號，
+    若 `timeout` 秒後仍未結束，再由計時器執行緒強制結束。
+    """
+    _signal_process_group(proc)
+    timer = threading.Timer(timeout, _signal_process_group, args=(proc,), kwargs={"force": True})
+    timer.daemon = True
+    timer.start()
+
+
+class Job:
+    """排程器中的一個工作。"""
+    _ids = itertools.count(1)
+
+    def __init__(self, resource: str, fn, task_id: str = None, name: str = None):
+        self.job_id = next(self._ids)
+        self.resource = resource
+        self.fn = fn
+        self.task_id = task_id
+        self.name = name or getattr(fn, "__name__", "job")
+        self.state = "queued"
+        self.thread = None
+        self.cancel_event = threading.Event()
+        self.processes: list[subprocess.Popen] = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "task_id": self.task_id,
+            "resource": self.resource,
+            "state": self.state,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class _Resource:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, int(limit))
+        self.running: list[Job] = []
+        self.queue: deque[Job] = deque()
+        self.completed = 0
+
+
+class JobScheduler:
+    """
+    依資源限制並行數的工作排程器。
+
+    :param slots: 各資源的槽位數，例如 {"transcribe": 1, "download": 3}。
+                  未指定時從設定檔讀取。
+    """
+    def __init__(self, slots: dict = None):
+        if slots is None:
+            slots = config.get_section("scheduler", DEFAULT_SETTINGS)["slots"]
+        self._cond = threading.Condition()
+        self._resources: dict[str, _Resource] = {name: _Resource(name, limit) for name, limit in slots.items()}
+        self._local = threading.local()
+
+    def _resource(self, name: str) -> _Resource:
+        if name not in self._resources:
+            self._resources[name] = _Resource(name, DEFAULT_SLOTS)
+        return self._resources[name]
+
+    def submit(self, resource: str, fn, task_id: str = None, name: str = None) -> Job:
+        """
+        提交一個工作。有空的槽位時立即在新執行緒中執行，否則排入佇列。
+
+        :param resource: 工作使用的資源名稱。
+        :param fn: 要執行的函式 (無參數)。
+        :param task_id: 相關的任務 ID，用於狀態查詢。
+        :param name: 工作名稱，預設為函式名稱。
+        :return: 建立的工作。
+        """
+        job = Job(resource, fn, task_id=task_id, name=name)
+        with self._cond:
+            res = self._resource(resource)
+            if len(res.running) < res.limit:
+                self._start(res, job)
+            else:
+                res.queue.append(job)
+                log.info(f"⏳ 工作 '{job.name}' (任務 {task_id}) 已排入 {resource} 佇列，前方還有 {len(res.queue) - 1} 個工作。")
+        return job
+
+    def _start(self, res: _Resource, job: Job):
+        """在持有鎖的情況下佔用槽位並啟動工作。"""
+        res.running.append(job)
+        job.state = "running"
+        job.started_at = time.time()
+        if job.thread is None:
+            job.thread = threading.Thread(target=self._run, args=(job,), name=f"job-{job.resource}-{job.job_id}", daemon=True)
+            job.thread.start()
+        else:
+            # 已在執行中的工作 (handoff) 正在等待此資源的槽位
+            self._cond.notify_all()
+
+    def _run(self, job: Job):
+        self._local.job = job
+        try:
+            job.fn()
+            job.state = "cancelled" if job.cancel_event.is_set() else "completed"
+        except Exception as e:
+            job.state = "cancelled" if job.cancel_event.is_set() else "failed"
+            log.error(f"❌ 背景工作 '{job.name}' (任務 {job.task_id}) 發生未處理的錯誤: {e}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            self._local.job = None
+            with self._cond:
+                self._release(job)
+
+    def _release(self, job: Job):
+        """在持有鎖的情況下釋放工作佔用的槽位，並讓佇列中的下一個工作開始。"""
+        res = self._resource(job.resource)
+        if job in res.running:
+            res.running.remove(job)
+            res.completed += 1
+        while res.queue and len(res.running) < res.limit:
+            self._start(res, res.queue.popleft())
+
+    def handoff(self, resource: str, task_id: str = None):
+        """
+        在工作執行中改用另一種資源：釋放目前的槽位並等待新資源的槽位。
+        例如 YouTube 處理鏈下載完成後，改佔用 gemini 槽位進行 AI 分析。
+
+        :param resource: 新的資源名稱。
+        :param task_id: (可選) 此階段處理的任務 ID。
+        """
+        job = getattr(self._local, "job", None)
+        if job is None:
+            return
+        with self._cond:
+            self._release(job)
+            job.resource = resource
+            if task_id:
+                job.task_id = task_id
+            res = self._resource(resource)
+            if len(res.running) < res.limit:
+                self._start(res, job)
+                return
+            job.state = "queued"
+            res.queue.append(job)
+            log.info(f"⏳ 工作 '{job.name}' (任務 {job.task_id}) 正在等待 {resource} 槽位。")
+            # 等待期間被取消時直接返回，由呼叫端以 is_cancelled() 判斷
+            while job not in res.running and not job.cancel_event.is_set():
+                self._cond.wait()
+
+    # --- 取消 ---
+
+    def track_process(self, proc: subprocess.Popen) -> subprocess.Popen:
+        """
+        將子程序登記到目前執行中的工作，取消工作時會一併終止它。
+        若工作在啟動子程序前就已被取消，子程序會立即被終止。
+        """
+        job = getattr(self._local, "job", None)
+        if job is not None:
+            with self._cond:
+                job.processes.append(proc)
+            if job.cancel_event.is_set():
+                terminate_process_tree(proc)
+        return proc
+
+    def is_cancelled(self) -> bool:
+        """目前執行緒中的工作是否已被取消。"""
+        job = getattr(self._local, "job", None)
+        return job is not None and job.cancel_event.is_set()
+
+    def cancel(self, task_id: str) -> Job | None:
+        """
+        取消與某個任務相關的工作。排隊中的工作會被移出佇列；
+        執行中的工作會被標記為已取消，並終止其子程序。
+
+        :return: 被取消的工作，找不到時回傳 None。
+        """
+        processes = []
+        with self._cond:
+            job = None
+            for res in self._resources.values():
+                for candidate in [*res.running, *res.queue]:
+                    if candidate.task_id == task_id:
+                        job = candidate
+                        break
+                if job:
+                    break
+            if job is None:
+                return None
+            job.cancel_event.set()
+            res = self._resource(job.resource)
+            if job in res.queue:
+                res.queue.remove(job)
+                if job.thread is None:
+                    # 尚未開始的工作：不會再被執行
+                    job.state = "cancelled"
+                    job.finished_at = time.time()
+                else:
+                    # 在 handoff 中等待槽位的工作：執行緒醒來後會自行結束
+                    job.state = "cancelling"
+            else:
+                job.state = "cancelling"
+                processes = [p for p in job.processes if p.poll() is None]
+            # 喚醒在 handoff 中等待的執行緒
+            self._cond.notify_all()
+        for proc in processes:
+            terminate_process_tree(proc)
+        log.info(f"🛑 已取消工作 '{job.name}' (任務 {task_id})，終止了 {len(processes)} 個子程序。")
+        return job
+
+    def find_job(self, task_id: str) -> Job | None:
+        """尋找與某個任務相關、尚未結束的工作。"""
+        with self._cond:
+            for res in self._resources.values():
+                for job in [*res.running, *res.queue]:
+                    if job.task_id == task_id:
+                        return job
+        return None
+
+    def snapshot(self) -> dict:
+        """回傳各資源的槽位、執行中與排隊中的工作，供 API 使用。"""
+        with self._cond:
+            return {
+                name: {
+                    "limit": res.limit,
+                    "running": [job.to_dict() for job in res.running],
+                    "queued": [job.to_dict() for job in res.queue],
+                    "completed": res.completed,
+                }
+                for name, res in self._resources.items()
+            }
@@ -0,0 +1,203 @@
+# api/model_registry.py
+#
+# 記憶體內的 Whisper 模型登錄表 (model registry)。
+#
+# 過去每次上傳都要啟動一個 `transcriber.py --command=check` 子程序來判斷模型是否存在，
+# 光是匯入 torch 與 faster_whisper 就要花上數秒。此模組改為在 API 程序內：
+#   1. 啟動時掃描一次 Hugging Face 模型快取目錄 (faster-whisper 下載模型的位置)；
+#   2. 以背景執行緒定期比對目錄的修改時間，只有在快取內容變動時才重新掃描；
+#   3. 以集合查詢回答「模型是否存在」，並記錄目前正在下載中的模型。
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# faster-whisper 的模型名稱與其在 Hugging Face Hub 上的儲存庫對應
+# (與 faster_whisper.utils._MODELS 相同，複製於此以避免在 API 程序中匯入 faster_whisper)
+MODEL_REPOS = {
+    "tiny.en": "Systran/faster-whisper-tiny.en",
+    "tiny": "Systran/faster-whisper-tiny",
+    "base.en": "Systran/faster-whisper-base.en",
+    "base": "Systran/faster-whisper-base",
+    "small.en": "Systran/faster-whisper-small.en",
+    "small": "Systran/faster-whisper-small",
+    "medium.en": "Systran/faster-whisper-medium.en",
+    "medium": "Systran/faster-whisper-medium",
+    "large-v1": "Systran/faster-whisper-large-v1",
+    "large-v2": "Systran/faster-whisper-large-v2",
+    "large-v3": "Systran/faster-whisper-large-v3",
+    "large": "Systran/faster-whisper-large-v3",
+    "distil-large-v2": "Systran/faster-distil-whisper-large-v2",
+    "distil-medium.en": "Systran/faster-distil-whisper-medium.en",
+    "distil-small.en": "Systran/faster-distil-whisper-small.en",
+    "distil-large-v3": "Systran/faster-distil-whisper-large-v3",
+    "large-v3-turbo": "mobiuslabsgmbh/faster-whisper-large-v3-turbo",
+    "turbo": "mobiuslabsgmbh/faster-whisper-large-v3-turbo",
+}
+
+# 一個可用的 CTranslate2 模型快照至少需要這些檔案
+REQUIRED_FILES = ("model.bin", "config.json")
+
+
+def default_cache_dir() -> Path:
+    """依照 huggingface_hub 的規則決定模型快取目錄。"""
+    hub_cache = os.environ.get("HF_HUB_CACHE") or os.environ.get("HUGGINGFACE_HUB_CACHE")
+    if hub_cache:
+        return Path(hub_cache).expanduser()
+    hf_home = os.environ.get("HF_HOME")
+    if not hf_home:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        hf_home = Path(xdg_cache) / "huggingface"
+    return Path(hf_home).expanduser() / "hub"
+
+
+def repo_id_for(model_size: str) -> str:
+    """將模型名稱 (例如 'tiny') 轉換為 Hugging Face 儲存庫 ID；已是儲存庫 ID 時原樣回傳。"""
+    if "/" in model_size:
+        return model_size
+    return MODEL_REPOS.get(model_size, f"Systran/faster-whisper-{model_size}")
+
+
+def _has_required_files(directory: Path) -> bool:
+    return all((directory / name).is_file() for name in REQUIRED_FILES)
+
+
+class ModelRegistry:
+    """
+    追蹤本地快取中已存在與正在下載的模型。
+
+    `is_present` / `status` 只做記憶體內的查詢，不觸碰檔案系統；
+    快取目錄的變動由 `check_for_changes` (背景執行緒定期呼叫) 偵測。
+    """
+    def __init__(self, cache_dir: Path = None, poll_interval: float = 5.0):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._present_repos: set[str] = set()
+        self._downloading: dict[str, dict] = {}
+        self._signature = None
+        self._scanned = False
+        self._watcher = None
+        self._stop_event = threading.Event()
+
+    # --- 掃描與監看 ---
+
+    def _snapshot_dirs(self):
+        """列出快取中每個模型儲存庫的 snapshots 目錄。"""
+        if not self.cache_dir.is_dir():
+            return []
+        return [d / "snapshots" for d in self.cache_dir.glob("models--*") if (d / "snapshots").is_dir()]
+
+    def _compute_signature(self) -> tuple:
+        """
+        以快取目錄與各 snapshots 目錄的修改時間作為快取內容的「指紋」。
+        下載新模型或新版本時，這些目錄的修改時間都會改變。
+        """
+        entries = []
+        for path in [self.cache_dir, *self._snapshot_dirs()]:
+            try:
+                entries.append((str(path), path.stat().st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(sorted(entries))
+
+    def scan(self):
+        """完整掃描一次快取目錄，重建已存在模型的集合。"""
+        present = set()
+        for snapshots in self._snapshot_dirs():
+            repo_dir = snapshots.parent
+            if any(_has_required_files(snapshot) for snapshot in snapshots.iterdir() if snapshot.is_dir()):
+                # 'models--Systran--faster-whisper-tiny' -> 'Systran/faster-whisper-tiny'
+                present.add(repo_dir.name[len("models--"):].replace("--", "/"))
+        signature = self._compute_signature()
+        with self._lock:
+            newly_present = present - self._present_repos
+            self._present_repos = present
+            self._signature = signature
+            self._scanned = True
+            # 已出現在快取中的模型不再視為下載中
+            for model_size in [m for m in self._downloading if repo_id_for(m) in present]:
+                del self._downloading[model_size]
+        if newly_present:
+            log.info(f"📦 模型登錄表偵測到新模型: {', '.join(sorted(newly_present))}")
+
+    def check_for_changes(self) -> bool:
+        """若快取目錄自上次掃描後有變動則重新掃描。回傳是否進行了掃描。"""
+        if self._scanned and self._compute_signature() == self._signature:
+            return False
+        self.scan()
+        return True
+
+    def _ensure_scanned(self):
+        if not self._scanned:
+            self.scan()
+
+    def start(self):
+        """掃描一次快取並啟動背景監看執行緒。"""
+        self.scan()
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._stop_event.clear()
+
+        def _watch():
+            while not self._stop_event.wait(self.poll_interval):
+                try:
+                    self.check_for_changes()
+                except Exception as e:
+                    log.error(f"❌ 監看模型快取時發生錯誤: {e}", exc_info=True)
+
+        self._watcher = threading.Thread(target=_watch, name="model-registry", daemon=True)
+        self._watcher.start()
+        log.info(f"📦 模型登錄表已啟動 (快取目錄: {self.cache_dir}，已存在 {len(self._present_repos)} 個模型)。")
+
+    def stop(self):
+        self._stop_event.set()
+
+    # --- 查詢 ---
+
+    def is_present(self, model_size: str) -> bool:
+        """模型是否已存在於本地快取 (或為一個包含完整模型檔案的本地目錄)。"""
+        self._ensure_scanned()
+        if repo_id_for(model_size) in self._present_repos:
+            return True
+        # 也支援直接指定本地模型目錄的用法
+        return os.sep in model_size and _has_required_files(Path(model_size))
+
+    def status(self, model_size: str) -> str:
+        """回傳 'present'、'downloading' 或 'missing'。"""
+        if self.is_present(model_size):
+            return "present"
+        if model_size in self._downloading:
+            return "downloading"
+        return "missing"
+
+    # --- 下載追蹤 ---
+
+    def mark_downloading(self, model_size: str, task_id: str = None):
+        """記錄某個模型開始下載 (task_id 為負責下載的任務，若有的話)。"""
+        with self._lock:
+            self._downloading[model_size] = {"task_id": task_id, "started_at": time.time()}
+
+    def get_download_task(self, model_size: str) -> str | None:
+        """回傳目前負責下載此模型的任務 ID。"""
+        entry = self._downloading.get(model_size)
+        return entry["task_id"] if entry else None
+
+    def mark_download_finished(self, model_size: str):
+        """下載結束 (成功或失敗) 後呼叫；會立即重新掃描快取。"""
+        with self._lock:
+            self._downloading.pop(model_size, None)
+        self.scan()
+
+    def snapshot(self) -> dict:
+        """回傳登錄表目前的狀態，供 API 使用。"""
+        self._ensure_scanned()
+        with self._lock:
+            return {
+                "cache_dir": str(self.cache_dir),
+                "present": sorted(self._present_repos),
+                "downloading": {k: dict(v) for k, v in self._downloading.items()},
+            }
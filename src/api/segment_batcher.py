@@ -0,0 +1,111 @@
+# api/segment_batcher.py
+#
+# 轉錄片段的合併器 (coalescer)。
+#
+# 轉錄工具每輸出一行片段，過去就會觸發一次資料庫寫入與一次跨執行緒的
+# `run_coroutine_threadsafe(broadcast_json)`。速度快的模型搭配短片段時，事件迴圈
+# 會被大量的小訊息淹沒。此模組依任務暫存片段，湊滿 `max_segments` 筆或距離第一筆
+# 超過 `flush_interval` 秒時，才一次交給該任務的輸出函式 (sink) 處理。
+import logging
+import threading
+import time
+
+from db import config
+
+log = logging.getLogger(__name__)
+
+# 可在 config.json 的 `segment_batching` 區段中覆寫
+DEFAULT_SETTINGS = {
+    "flush_interval": 0.25,  # 秒；未湊滿一批時，第一個片段最多等待這麼久就送出
+    "max_segments": 20,      # 單批最多的片段數
+}
+
+
+class SegmentBatcher:
+    """
+    依任務 ID 暫存片段並批次送出。
+
+    大小觸發的送出在呼叫 `add` 的執行緒中進行；時間觸發的送出由一個共用的背景執行緒負責，
+    因此即使轉錄工具暫時沒有輸出，已暫存的片段也會在時限內送出。
+    同一時間只會有一批在送出，所以同一任務的批次 (以及 `flush` 之後送出的訊息) 順序固定。
+
+    :param flush_interval: 批次的最長等待時間 (秒)。
+    :param max_segments: 單批最多的片段數。
+    """
+    def __init__(self, flush_interval: float = None, max_segments: int = None):
+        settings = config.get_section("segment_batching", DEFAULT_SETTINGS)
+        self.flush_interval = float(flush_interval or settings["flush_interval"])
+        self.max_segments = max(1, int(max_segments or settings["max_segments"]))
+        # task_id -> {"segments": [...], "first_at": monotonic 時間, "sink": callable}
+        self._pending: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        # 確保同一時間只有一批在送出，維持訊息順序
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def add(self, task_id: str, segment: dict, sink):
+        """
+        暫存一個片段。
+
+        :param task_id: 任務 ID。
+        :param segment: 片段資料。
+        :param sink: 送出一批片段時呼叫的函式，參數為片段列表 (依加入順序)。
+        """
+        with self._lock:
+            entry = self._pending.get(task_id)
+            if entry is None:
+                entry = self._pending[task_id] = {"segments": [], "first_at": time.monotonic(), "sink": sink}
+            entry["segments"].append(segment)
+            full = len(entry["segments"]) >= self.max_segments
+        if full:
+            self.flush(task_id)
+        else:
+            self._ensure_flusher()
+            self._wakeup.set()
+
+    def flush(self, task_id: str = None):
+        """
+        立即送出暫存的片段。任務結束時應先呼叫此方法，再送出最終狀態。
+
+        :param task_id: 只送出此任務的片段；若為 None 則送出全部。
+        """
+        with self._flush_lock:
+            with self._lock:
+                keys = [task_id] if task_id is not None else list(self._pending)
+                entries = [(key, self._pending.pop(key)) for key in keys if key in self._pending]
+            for key, entry in entries:
+                self._emit(key, entry)
+
+    def _emit(self, task_id: str, entry: dict):
+        try:
+            entry["sink"](entry["segments"])
+        except Exception as e:
+            log.error(f"❌ 送出任務 {task_id} 的 {len(entry['segments'])} 個片段時發生錯誤: {e}", exc_info=True)
+
+    def _flush_expired(self) -> float | None:
+        """送出已超過等待時間的批次，並回傳距離下一批到期的秒數 (沒有暫存時為 None)。"""
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                expired = [k for k, e in self._pending.items() if now - e["first_at"] >= self.flush_interval]
+                entries = [(key, self._pending.pop(key)) for key in expired]
+                next_due = min((e["first_at"] + self.flush_interval for e in self._pending.values()), default=None)
+            for key, entry in entries:
+                self._emit(key, entry)
+        return None if next_due is None else max(0.0, next_due - time.monotonic())
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flusher_loop, name="segment-batcher", daemon=True)
+                self._flusher.start()
+
+    def _flusher_loop(self):
+        while True:
+            timeout = self._flush_expired()
+            # 沒有暫存的片段時一直等待，直到 add() 喚醒
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
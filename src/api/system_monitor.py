@@ -0,0 +1,128 @@
+# api/system_monitor.py
+#
+# 背景系統資源取樣器。
+#
+# 以固定頻率在背景執行緒中收集 CPU、RAM、各程序 RSS、磁碟與 (可選的) GPU 使用率，
+# 存入一個環形緩衝區。`/api/system_stats` 只回傳快取的最新樣本與近期歷史，
+# 新樣本則透過 `on_sample` 回呼推送到 `/api/ws`，因此成本不會隨著觀看者數量增加。
+import logging
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import psutil
+
+log = logging.getLogger(__name__)
+
+
+class SystemStatsSampler:
+    """
+    在背景執行緒中定期取樣系統資源使用狀態。
+
+    :param interval: 取樣間隔 (秒)。
+    :param history_size: 環形緩衝區保留的樣本數。
+    :param disk_path: 要統計磁碟使用量的路徑。
+    :param on_sample: 每取得一個新樣本時呼叫的回呼 (在取樣執行緒中執行)。
+    """
+    def __init__(self, interval: float = 2.0, history_size: int = 150, disk_path: Path = None, on_sample=None):
+        self.interval = interval
+        self.disk_path = Path(disk_path) if disk_path else Path.cwd()
+        self.on_sample = on_sample
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._process = psutil.Process()
+        # nvidia-smi 只在啟動時尋找一次；不存在時之後的取樣完全略過 GPU
+        self._nvidia_smi = shutil.which("nvidia-smi")
+
+    def _sample_gpu(self) -> float | None:
+        if not self._nvidia_smi:
+            return None
+        try:
+            result = subprocess.run(
+                [self._nvidia_smi, '--query-gpu=utilization.gpu', '--format=csv,noheader,nounits'],
+                capture_output=True, text=True, check=True, timeout=5
+            )
+            # 多張 GPU 時取平均
+            values = [float(v) for v in result.stdout.split() if v.strip()]
+            return sum(values) / len(values) if values else None
+        except (OSError, subprocess.SubprocessError, ValueError) as e:
+            log.debug(f"無法獲取 GPU 資訊: {e}")
+            return None
+
+    def _sample_processes(self) -> list[dict]:
+        """本程序及其子程序 (例如轉錄工具) 的常駐記憶體用量。"""
+        processes = []
+        try:
+            candidates = [self._process, *self._process.children(recursive=True)]
+        except psutil.Error:
+            candidates = [self._process]
+        for proc in candidates:
+            try:
+                processes.append({"pid": proc.pid, "name": proc.name(), "rss": proc.memory_info().rss})
+            except psutil.Error:
+                continue
+        return processes
+
+    def sample(self) -> dict:
+        """收集一個樣本並放入環形緩衝區。"""
+        ram = psutil.virtual_memory()
+        try:
+            disk = psutil.disk_usage(str(self.disk_path))
+            disk_info = {"disk_usage": disk.percent, "disk_free": disk.free}
+        except OSError:
+            disk_info = {"disk_usage": None, "disk_free": None}
+        gpu_usage = self._sample_gpu()
+        sample = {
+            "timestamp": time.time(),
+            # interval=None 不會阻塞，回傳自上次呼叫以來的平均使用率
+            "cpu_usage": psutil.cpu_percent(interval=None),
+            "ram_usage": ram.percent,
+            "ram_used": ram.used,
+            **disk_info,
+            "gpu_usage": gpu_usage,
+            "gpu_detected": gpu_usage is not None,
+            "processes": self._sample_processes(),
+        }
+        with self._lock:
+            self._history.append(sample)
+        return sample
+
+    def latest(self) -> dict | None:
+        with self._lock:
+            return self._history[-1] if self._history else None
+
+    def history(self, limit: int = None) -> list[dict]:
+        """回傳最近的樣本 (由舊到新)。"""
+        with self._lock:
+            samples = list(self._history)
+        return samples[-limit:] if limit else samples
+
+    def start(self):
+        """啟動背景取樣執行緒。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        # 第一次 cpu_percent(interval=None) 只會回傳 0.0，先呼叫一次作為基準
+        psutil.cpu_percent(interval=None)
+
+        def _run():
+            while not self._stop_event.is_set():
+                try:
+                    sample = self.sample()
+                    if self.on_sample:
+                        self.on_sample(sample)
+                except Exception as e:
+                    log.error(f"❌ 系統資源取樣時發生錯誤: {e}", exc_info=True)
+                self._stop_event.wait(self.interval)
+
+        self._thread = threading.Thread(target=_run, name="system-stats", daemon=True)
+        self._thread.start()
+        log.info(f"📊 系統資源取樣器已啟動 (間隔: {self.interval} 秒，GPU: {'nvidia-smi' if self._nvidia_smi else '未偵測到'})。")
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,128 @@
+# db/backends.py
+#
+# 儲存後端 (storage backend)。
+#
+# `database.py` 中所有的函式都透過 `get_db_connection()` 取得連線，而連線的實際來源
+# 由此處的後端決定：
+#   - file:   預設值。連線到磁碟上的 `tasks.db`，適用於正式環境。
+#   - memory: 純記憶體資料庫，不產生任何檔案 I/O。適合測試與微基準測試，
+#             資料只存在於目前程序中 (例如 db/manager.py)，程序結束即消失。
+#
+# 後端名稱依序從 `DB_BACKEND` 環境變數、config.json 的 `database.backend` 讀取。
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+from db import config
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "file"
+
+
+class SQLiteFileBackend:
+    """連線到磁碟上的 SQLite 資料庫檔案。"""
+    name = "file"
+    persistent = True
+
+    def connect(self, db_file: Path) -> sqlite3.Connection:
+        return sqlite3.connect(db_file, timeout=10)
+
+    def reset(self, db_file: Path = None):
+        """檔案後端沒有需要釋放的程序內狀態。"""
+
+
+class SQLiteMemoryBackend:
+    """
+    以 SQLite 的 memdb VFS 實作的共享記憶體資料庫。
+
+    同一程序中以相同名稱開啟的連線會看到同一份資料，並且和檔案資料庫一樣支援
+    busy_timeout 與多執行緒並行存取。資料庫的名稱取自 `db_file` 的路徑，因此
+    指向不同路徑 (例如測試中的暫存目錄) 的呼叫者會得到彼此隔離的資料庫。
+
+    SQLite 在最後一個連線關閉時會釋放記憶體資料庫，所以這裡為每個資料庫保留一個
+    「錨點」連線，直到呼叫 `reset()` 為止。
+    """
+    name = "memory"
+    persistent = False
+
+    def __init__(self):
+        self._anchors = {}
+        self._lock = threading.Lock()
+        self._use_memdb = True
+
+    def _uri(self, db_file: Path) -> str:
+        name = quote(Path(db_file).as_posix().lstrip("/"))
+        if self._use_memdb:
+            return f"file:/{name}?vfs=memdb"
+        # 舊版 SQLite (< 3.36) 沒有 memdb VFS，改用共享快取的 :memory: 資料庫
+        return f"file:{name}?mode=memory&cache=shared"
+
+    def connect(self, db_file: Path) -> sqlite3.Connection:
+        with self._lock:
+            uri = self._uri(db_file)
+            if uri not in self._anchors:
+                try:
+                    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                except sqlite3.OperationalError as e:
+                    if not self._use_memdb or "no such vfs" not in str(e):
+                        raise
+                    log.warning("目前的 SQLite 不支援 memdb VFS，記憶體後端將改用共享快取模式。")
+                    self._use_memdb = False
+                    uri = self._uri(db_file)
+                    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                self._anchors[uri] = anchor
+        return sqlite3.connect(uri, uri=True, timeout=10)
+
+    def reset(self, db_file: Path = None):
+        """
+        釋放記憶體資料庫。
+
+        :param db_file: 只釋放此路徑對應的資料庫；若為 None 則釋放全部。
+        """
+        with self._lock:
+            uris = [self._uri(db_file)] if db_file is not None else list(self._anchors)
+            for uri in uris:
+                anchor = self._anchors.pop(uri, None)
+                if anchor:
+                    anchor.close()
+
+
+BACKENDS = {
+    "file": SQLiteFileBackend,
+    "memory": SQLiteMemoryBackend,
+}
+
+_active_backend = None
+
+
+def get_backend():
+    """
+    取得目前使用的儲存後端實例。結果會被快取，整個程序共用同一個實例。
+    """
+    global _active_backend
+    if _active_backend is None:
+        name = os.environ.get("DB_BACKEND") or config.get_section("database").get("backend")
+        name = (name or DEFAULT_BACKEND).lower()
+        if name not in BACKENDS:
+            log.warning(f"未知的儲存後端 '{name}'，將改用 '{DEFAULT_BACKEND}'。")
+            name = DEFAULT_BACKEND
+        _active_backend = BACKENDS[name]()
+        log.info(f"資料庫儲存後端: {name}")
+    return _active_backend
+
+
+def set_backend(name: str | None):
+    """覆寫 (或以 None 重設) 目前使用的儲存後端，主要供測試與基準測試使用。"""
+    global _active_backend
+    if _active_backend is not None:
+        _active_backend.reset()
+    if name is None:
+        _active_backend = None
+        return
+    if name not in BACKENDS:
+        raise ValueError(f"未知的儲存後端: {name}")
+    _active_backend = BACKENDS[name]()
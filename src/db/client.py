@@ -93,55 +93,149 @@ class DBClient:
     # 這些方法模仿了 db/database.py 中的函式簽名，
     # 使得從舊的直接呼叫模式遷移到新的客戶端模式變得非常簡單。
 
-    def add_task(self, task_id: str, payload: str, task_type: str = 'transcribe', depends_on: str = None) -> bool:
+    def add_task(self, task_id: str, payload: str, task_type: str = 'transcribe', depends_on: str | list[str] = None,
+                 dedup_key: str = None) -> bool:
         return self._send_request("add_task", {
             "task_id": task_id,
             "payload": payload,
             "task_type": task_type,
-            "depends_on": depends_on
+            "depends_on": depends_on,
+            "dedup_key": dedup_key
+        })
+
+    def add_task_from_completed(self, task_id: str, payload: str, dedup_key: str, task_type: str = 'transcribe') -> str | None:
+        """
+        若已有相同 dedup_key 的已完成任務，以其結果建立一個已完成的新任務，回傳來源任務 ID。
+        """
+        return self._send_request("add_task_from_completed", {
+            "task_id": task_id,
+            "payload": payload,
+            "dedup_key": dedup_key,
+            "task_type": task_type
         })
 
     def fetch_and_lock_task(self) -> dict | None:
         return self._send_request("fetch_and_lock_task")
 
-    def update_task_progress(self, task_id: str, progress: int, partial_result: str):
+    def update_task_progress(self, task_id: str, progress: int, partial_result: str = None, is_segment: bool = False):
         return self._send_request("update_task_progress", {
             "task_id": task_id,
             "progress": progress,
-            "partial_result": partial_result
+            "partial_result": partial_result,
+            "is_segment": is_segment
         })
 
-    def update_task_status(self, task_id: str, status: str, result: str = None):
+    def append_task_segments(self, task_id: str, segments: list[dict], progress: int = None) -> int | None:
+        """
+        將一批新的轉錄片段附加到任務。
+        """
+        return self._send_request("append_task_segments", {
+            "task_id": task_id,
+            "segments": segments,
+            "progress": progress
+        })
+
+    def get_task_segments(self, task_id: str, after_seq: int = 0, limit: int = None) -> list[dict]:
+        """
+        獲取任務在指定序號之後的轉錄片段。
+        """
+        return self._send_request("get_task_segments", {
+            "task_id": task_id,
+            "after_seq": after_seq,
+            "limit": limit
+        })
+
+    def update_task_status(self, task_id: str, status: str, result: str = None) -> bool:
+        """
+        更新任務的狀態和結果。任務已被取消時不會更新並回傳 False。
+        """
         return self._send_request("update_task_status", {
             "task_id": task_id,
             "status": status,
             "result": result
         })
 
+    def cancel_task(self, task_id: str, reason: str = None) -> list[str]:
+        """
+        取消任務及其所有待處理的依賴任務，回傳實際被取消的 task_id 列表。
+        """
+        return self._send_request("cancel_task", {"task_id": task_id, "reason": reason})
+
     def get_task_status(self, task_id: str) -> dict | None:
         return self._send_request("get_task_status", {"task_id": task_id})
 
     def are_tasks_active(self) -> bool:
         return self._send_request("are_tasks_active")
 
+    def get_queue_stats(self, window_minutes: int = 5) -> dict:
+        """
+        獲取佇列統計資訊 (各狀態/類型數量、最舊待處理任務等待時間、每分鐘完成數)。
+        """
+        return self._send_request("get_queue_stats", {"window_minutes": window_minutes})
+
     def get_all_tasks(self) -> list[dict]:
         return self._send_request("get_all_tasks")
 
-    def get_system_logs(self, levels: list[str] = None, sources: list[str] = None) -> list[dict]:
+    def get_system_logs(
+        self,
+        levels: list[str] = None,
+        sources: list[str] = None,
+        since_id: int = None,
+        until: str = None,
+        limit: int = None,
+        latest: bool = False,
+        task_id: str = None
+    ) -> list[dict]:
         """
-        從資料庫獲取系統日誌，可選擇性地按等級和來源篩選。
+        從資料庫獲取系統日誌，可選擇性地按等級、來源與任務 ID 篩選，
+        並支援 since_id 游標、until 時間上限、limit 與「最新 N 筆」模式。
         """
         return self._send_request("get_system_logs", {
             "levels": levels or [],
-            "sources": sources or []
+            "sources": sources or [],
+            "since_id": since_id,
+            "until": until,
+            "limit": limit,
+            "latest": latest,
+            "task_id": task_id
         })
 
+    def get_stage_durations(self, task_id: str = None, since: str = None) -> list[dict]:
+        """
+        依處理階段彙總結構化日誌中的耗時 (次數、平均、最小、最大、總和)。
+        """
+        return self._send_request("get_stage_durations", {"task_id": task_id, "since": since})
+
+    def add_system_logs_batch(self, logs: list[dict]) -> int:
+        """
+        批次寫入多筆系統日誌 (供 DatabaseLogHandler 使用)。
+        """
+        return self._send_request("add_system_logs_batch", {"logs": logs})
+
+    def search_transcripts(self, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+        """
+        在已完成任務的逐字稿與 AI 報告中進行全文檢索。
+        """
+        return self._send_request("search_transcripts", {"query": query, "limit": limit, "offset": offset})
+
     def find_dependent_task(self, parent_task_id: str) -> str | None:
         """
         尋找依賴於某個父任務的任務。
         """
         return self._send_request("find_dependent_task", {"parent_task_id": parent_task_id})
 
+    def find_dependent_tasks(self, parent_task_id: str) -> list[str]:
+        """
+        尋找所有直接依賴於某個父任務的子任務。
+        """
+        return self._send_request("find_dependent_tasks", {"parent_task_id": parent_task_id})
+
+    def get_task_dependencies(self, task_id: str) -> list[dict]:
+        """
+        獲取某個任務的所有父任務及其狀態。
+        """
+        return self._send_request("get_task_dependencies", {"task_id": task_id})
+
     # JULES'S NEW FEATURE: App State methods
     def get_app_state(self, key: str) -> str | None:
         """
@@ -149,11 +243,37 @@ class DBClient:
         """
         return self._send_request("get_app_state", {"key": key})
 
-    def set_app_state(self, key: str, value: str) -> bool:
+    def set_app_state(self, key: str, value: str, expected_version: int = None) -> dict:
         """
         在資料庫中設定一個應用程式狀態值。
+        回傳 {"status": "success" | "conflict" | "error", "version": int}。
+        """
+        params = {"key": key, "value": value}
+        if expected_version is not None:
+            params["expected_version"] = expected_version
+        return self._send_request("set_app_state", params)
+
+    def get_app_state_versioned(self, key: str) -> dict | None:
+        """
+        獲取一個應用程式狀態值及其版本號。
+        """
+        return self._send_request("get_app_state_versioned", {"key": key})
+
+    def patch_app_state(self, key: str, patch: dict, expected_version: int = None) -> dict:
+        """
+        以 JSON Merge Patch 局部更新一個應用程式狀態值。
+        """
+        return self._send_request("patch_app_state", {
+            "key": key,
+            "patch": patch,
+            "expected_version": expected_version
+        })
+
+    def run_retention(self) -> dict:
+        """
+        立即執行一次資料保留流程（封存、批次刪除過期資料並回收空間）。
         """
-        return self._send_request("set_app_state", {"key": key, "value": value})
+        return self._send_request("run_retention")
 
 # 可選：提供一個簡單的方式來獲取客戶端實例
 _client_instance = None
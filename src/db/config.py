@@ -0,0 +1,47 @@
+# db/config.py
+import json
+import logging
+import os
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# --- 設定檔路徑 ---
+# 與 colab.py / local_run.py 相同，設定檔位於專案根目錄的 config.json
+# 可透過 PHOENIX_CONFIG 環境變數指向其他檔案
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+CONFIG_FILE = Path(os.environ.get("PHOENIX_CONFIG", ROOT_DIR / "config.json"))
+
+
+def load_config() -> dict:
+    """
+    讀取專案的 config.json。檔案不存在或格式錯誤時回傳空字典。
+    """
+    if not CONFIG_FILE.is_file():
+        return {}
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, OSError) as e:
+        log.error(f"讀取或解析設定檔 {CONFIG_FILE} 時發生錯誤: {e}")
+        return {}
+
+
+def get_section(name: str, defaults: dict = None) -> dict:
+    """
+    取得設定檔中的某個區段，並以 defaults 補齊缺少的鍵。
+    巢狀字典會逐層合併，讓使用者只需覆寫想要調整的值。
+    """
+    section = load_config().get(name) or {}
+    return _merge(defaults or {}, section if isinstance(section, dict) else {})
+
+
+def _merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -2,8 +2,14 @@
 import sqlite3
 import logging
 import json
+import re
+import sys
+import threading
+from datetime import datetime
 from pathlib import Path
 
+from db import backends, config, pragmas
+
 # --- 日誌設定 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
@@ -14,11 +20,11 @@ DB_FILE = Path(__file__).parent / "tasks.db"
 def get_db_connection():
     """建立並回傳一個資料庫連線。"""
     try:
-        # isolation_level=None 會開啟 autocommit 模式，但我們將手動管理交易
-        conn = sqlite3.connect(DB_FILE, timeout=10) # 增加 timeout
+        # 連線的實際來源 (磁碟檔案或記憶體) 由儲存後端決定，見 db/backends.py
+        conn = backends.get_backend().connect(DB_FILE)
         conn.row_factory = sqlite3.Row # 將回傳結果設定為類似 dict 的物件
-        # 啟用 WAL (Write-Ahead Logging) 模式以提高併發性
-        conn.execute("PRAGMA journal_mode=WAL")
+        # 套用 PRAGMA 設定檔 (WAL、synchronous、快取等)，見 db/pragmas.py
+        pragmas.apply_pragmas(conn)
         return conn
     except sqlite3.Error as e:
         log.error(f"資料庫連線失敗: {e}")
@@ -29,14 +35,26 @@ def initialize_database():
     初始化資料庫。如果 `tasks` 資料表不存在，就建立它。
     """
     log.info(f"正在檢查並初始化資料庫於: {DB_FILE}")
-    # 在嘗試連線前，確保父目錄存在
-    DB_FILE.parent.mkdir(parents=True, exist_ok=True)
+    # 重新初始化時，捨棄可能屬於其他資料庫檔案的快取內容
+    with _app_state_lock:
+        _app_state_cache.clear()
+    _reset_log_ring_settings()
+    # 在嘗試連線前，確保父目錄存在 (記憶體後端不需要)
+    if backends.get_backend().persistent:
+        DB_FILE.parent.mkdir(parents=True, exist_ok=True)
     conn = get_db_connection()
     if not conn:
         log.critical("無法建立資料庫連線，初始化失敗。")
         return
 
     try:
+        # 啟用增量回收模式，讓資料保留流程可以透過 `PRAGMA incremental_vacuum` 歸還空間。
+        # 既有的資料庫需要一次完整的 VACUUM 才能切換模式。
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            log.info("正在將資料庫切換為 auto_vacuum=INCREMENTAL 模式...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
         with conn: # 使用 with 陳述式來自動管理交易
             cursor = conn.cursor()
             cursor.execute("""
@@ -50,14 +68,16 @@ def initialize_database():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     type TEXT DEFAULT 'transcribe',
-                    depends_on TEXT
+                    depends_on TEXT,
+                    dedup_key TEXT
                 )
             """)
             # Add columns if they don't exist (for migration)
             migrations = {
                 "progress": "INTEGER DEFAULT 0",
                 "type": "TEXT DEFAULT 'transcribe'",
-                "depends_on": "TEXT"
+                "depends_on": "TEXT",
+                "dedup_key": "TEXT"
             }
             for col, col_type in migrations.items():
                 try:
@@ -68,9 +88,31 @@ def initialize_database():
                         pass # Column already exists, ignore
                     else:
                         raise
+            # 建立任務依賴的邊 (edge) 資料表，一個任務可以依賴多個父任務 (fan-in)，
+            # 一個父任務也可以被多個子任務依賴 (fan-out)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_dependencies (
+                    task_id TEXT NOT NULL,
+                    depends_on TEXT NOT NULL,
+                    PRIMARY KEY (task_id, depends_on)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_dep_depends_on ON task_dependencies (depends_on)")
+            # 將舊的單一 depends_on 欄位遷移為邊
+            cursor.execute("""
+                INSERT OR IGNORE INTO task_dependencies (task_id, depends_on)
+                SELECT task_id, depends_on FROM tasks WHERE depends_on IS NOT NULL
+            """)
+
             # 建立索引以加速查詢
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_status ON tasks (status)")
+            # (status, created_at) 同時服務狀態篩選與「最舊待處理任務」查詢
+            cursor.execute("DROP INDEX IF EXISTS idx_status")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_created ON tasks (status, created_at)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_id ON tasks (task_id)")
+            # 內容去重：以 (檔案雜湊 + 參數) 尋找已完成的相同任務；大多數任務沒有 dedup_key，使用部分索引
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_dedup_key ON tasks (dedup_key, status) WHERE dedup_key IS NOT NULL"
+            )
 
             # 新增一個觸發器來自動更新 updated_at 時間戳
             cursor.execute("""
@@ -81,6 +123,10 @@ def initialize_database():
                     UPDATE tasks SET updated_at = CURRENT_TIMESTAMP WHERE id = OLD.id;
                 END;
             """)
+            # 建立佇列統計計數器，由觸發器在每次新增、狀態轉換與刪除時維護，
+            # 讓 get_queue_stats 不需要掃描 tasks 資料表
+            _create_queue_counters(cursor)
+
             # 建立一個用於儲存系統日誌的資料表
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS system_logs (
@@ -92,16 +138,59 @@ def initialize_database():
                 )
             """)
             # 為日誌表建立索引
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_source_level ON system_logs (source, level)")
+            # (source, level, id) 讓篩選後的游標分頁與「最新 N 筆」查詢都只需走訪索引範圍，
+            # (timestamp) 則用於時間範圍查詢與資料保留清理
+            cursor.execute("DROP INDEX IF EXISTS idx_log_source_level")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_source_level_id ON system_logs (source, level, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_timestamp ON system_logs (timestamp)")
+            # (source, id) 讓環形緩衝區可以直接找到每個來源最舊的日誌
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_source_id ON system_logs (source, id)")
+            # 結構化欄位：由 DatabaseLogHandler 從日誌記錄的 `extra` 中擷取
+            for col, col_type in {"task_id": "TEXT", "stage": "TEXT", "duration_ms": "REAL"}.items():
+                try:
+                    cursor.execute(f"ALTER TABLE system_logs ADD COLUMN {col} {col_type}")
+                    log.info(f"欄位 '{col}' 已成功新增至 'system_logs' 資料表。")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column name" not in str(e):
+                        raise
+            # 大部分日誌沒有這些欄位，因此使用部分索引 (partial index) 只索引有值的列
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_task_id ON system_logs (task_id, id) WHERE task_id IS NOT NULL")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_log_stage_duration ON system_logs (stage, duration_ms) WHERE stage IS NOT NULL")
+            # 每個來源的日誌筆數與位元組數，由觸發器維護，供環形緩衝區判斷是否需要修剪
+            _create_log_counters(cursor)
+
+            # 建立逐段轉錄結果的附加式 (append-only) 資料表
+            # 每個新片段只寫入一列，避免在每次進度更新時重寫整份逐字稿
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_segments (
+                    task_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    start REAL,
+                    "end" REAL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (task_id, seq)
+                ) WITHOUT ROWID
+            """)
+
+            # 建立逐字稿與 AI 報告的 FTS5 全文檢索索引 (rowid 對應 tasks.id)
+            _create_transcript_index(cursor)
 
             # --- JULES'S NEW FEATURE: 為 App State 建立資料表 ---
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS app_state (
                     key TEXT PRIMARY KEY,
                     value TEXT NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            # 為舊的 app_state 資料表補上版本號欄位 (用於 ETag 與樂觀並行控制)
+            try:
+                cursor.execute("ALTER TABLE app_state ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+                log.info("欄位 'version' 已成功新增至 'app_state' 資料表。")
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise
             cursor.execute("""
                 CREATE TRIGGER IF NOT EXISTS update_app_state_updated_at
                 AFTER UPDATE ON app_state FOR EACH ROW
@@ -111,7 +200,7 @@ def initialize_database():
             """)
             # --- END ---
 
-        log.info("✅ 資料庫初始化完成。`tasks`, `system_logs`, `app_state` 資料表已存在。")
+        log.info("✅ 資料庫初始化完成。`tasks`, `task_dependencies`, `task_counters`, `system_logs`, `log_counters`, `task_segments`, `transcripts_fts`, `app_state` 資料表已存在。")
     except sqlite3.Error as e:
         log.error(f"初始化資料庫時發生錯誤: {e}")
     finally:
@@ -119,39 +208,305 @@ def initialize_database():
             conn.close()
 
 
-# --- JULES'S NEW FEATURE: App State 核心功能 ---
+# --- 佇列統計計數器 ---
+
+def _create_queue_counters(cursor: sqlite3.Cursor):
+    """
+    建立 `task_counters` (每個狀態/類型的任務數) 與 `task_completions`
+    (每分鐘完成數) 資料表及維護它們的觸發器，並從 tasks 重建一次計數以自我修復。
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_counters (
+            status TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (status, type)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS task_completions (
+            minute TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_counters_after_insert
+        AFTER INSERT ON tasks FOR EACH ROW
+        BEGIN
+            INSERT INTO task_counters (status, type, count) VALUES (NEW.status, COALESCE(NEW.type, ''), 1)
+            ON CONFLICT (status, type) DO UPDATE SET count = count + 1;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_counters_after_update
+        AFTER UPDATE OF status, type ON tasks FOR EACH ROW
+        WHEN OLD.status IS NOT NEW.status OR OLD.type IS NOT NEW.type
+        BEGIN
+            UPDATE task_counters SET count = count - 1
+            WHERE status = OLD.status AND type = COALESCE(OLD.type, '');
+            INSERT INTO task_counters (status, type, count) VALUES (NEW.status, COALESCE(NEW.type, ''), 1)
+            ON CONFLICT (status, type) DO UPDATE SET count = count + 1;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_counters_after_delete
+        AFTER DELETE ON tasks FOR EACH ROW
+        BEGIN
+            UPDATE task_counters SET count = count - 1
+            WHERE status = OLD.status AND type = COALESCE(OLD.type, '');
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS task_completions_after_update
+        AFTER UPDATE OF status ON tasks FOR EACH ROW
+        WHEN NEW.status = 'completed' AND OLD.status IS NOT 'completed'
+        BEGIN
+            INSERT INTO task_completions (minute, count) VALUES (strftime('%Y-%m-%d %H:%M', 'now'), 1)
+            ON CONFLICT (minute) DO UPDATE SET count = count + 1;
+        END;
+    """)
+    # 每次啟動時重建計數，修正任何在觸發器建立前或手動修改造成的偏差
+    cursor.execute("DELETE FROM task_counters")
+    cursor.execute("""
+        INSERT INTO task_counters (status, type, count)
+        SELECT status, COALESCE(type, ''), COUNT(*) FROM tasks GROUP BY status, COALESCE(type, '')
+    """)
+
 
-def set_app_state(key: str, value: str) -> bool:
+def get_queue_stats(window_minutes: int = 5) -> dict:
     """
-    儲存或更新一個鍵值對到 app_state 表中 (Upsert)。
+    回傳佇列統計資訊：各狀態與類型的任務數、最舊待處理任務的等待秒數，
+    以及最近 `window_minutes` 分鐘內平均每分鐘完成的任務數。
+    所有查詢都只讀取計數器或索引端點，不掃描 tasks 資料表。
     """
-    sql = "INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)"
     conn = get_db_connection()
-    if not conn: return False
+    if not conn: return {}
     try:
-        with conn:
-            conn.execute(sql, (key, value))
-        log.info(f"✅ App state '{key}' 已更新。")
-        return True
+        rows = conn.execute("SELECT status, type, count FROM task_counters WHERE count > 0").fetchall()
+        by_status, by_type = {}, {}
+        for row in rows:
+            by_status[row["status"]] = by_status.get(row["status"], 0) + row["count"]
+            by_type[row["type"]] = by_type.get(row["type"], 0) + row["count"]
+
+        oldest = conn.execute("""
+            SELECT (julianday('now') - julianday(MIN(created_at))) * 86400
+            FROM tasks WHERE status = 'pending'
+        """).fetchone()[0]
+
+        window = max(int(window_minutes), 1)
+        completed = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM task_completions WHERE minute > strftime('%Y-%m-%d %H:%M', 'now', ?)",
+            (f"-{window} minutes",)
+        ).fetchone()[0]
+
+        return {
+            "by_status": by_status,
+            "by_type": by_type,
+            "total": sum(by_status.values()),
+            "oldest_pending_age_seconds": round(oldest, 1) if oldest is not None else None,
+            "completions_per_minute": round(completed / window, 2),
+            "window_minutes": window,
+        }
     except sqlite3.Error as e:
-        log.error(f"❌ 更新 app_state '{key}' 時發生錯誤: {e}", exc_info=True)
-        return False
+        log.error(f"❌ 獲取佇列統計時發生錯誤: {e}", exc_info=True)
+        return {}
     finally:
         if conn:
             conn.close()
 
-def get_app_state(key: str) -> str | None:
+
+# --- 逐字稿全文檢索 (FTS5) ---
+
+# 從已完成任務的 result / payload JSON 中擷取可供檢索的欄位。
+# Whisper 轉錄結果提供 `transcript`，Gemini 報告提供 `summary` 與 `transcript`。
+_TRANSCRIPT_INDEX_SQL = """
+    INSERT INTO transcripts_fts (rowid, task_id, title, summary, transcript)
+    SELECT id, task_id, title, summary, transcript FROM (
+        SELECT
+            id,
+            task_id,
+            COALESCE(
+                CASE WHEN json_valid(result) THEN json_extract(result, '$.video_title') END,
+                CASE WHEN json_valid(payload) THEN json_extract(payload, '$.original_filename') END
+            ) AS title,
+            CASE WHEN json_valid(result) THEN json_extract(result, '$.summary') END AS summary,
+            CASE WHEN json_valid(result) THEN json_extract(result, '$.transcript') END AS transcript
+        FROM tasks
+        WHERE status = 'completed' {condition}
+    )
+    WHERE COALESCE(summary, transcript) IS NOT NULL
+"""
+
+# trigram 分詞器無法以 MATCH 搜尋少於 3 個字元的詞
+_TRIGRAM_MIN_TERM = 3
+
+
+def _create_transcript_index(cursor: sqlite3.Cursor):
     """
-    根據鍵從 app_state 表中獲取值。
+    建立 `transcripts_fts` 虛擬表。優先使用 trigram 分詞器以支援中文子字串搜尋，
+    若 SQLite 版本不支援則退回 unicode61。首次建立時會為既有的已完成任務建立索引。
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcripts_fts'"
+    ).fetchone()
+    if exists:
+        return
+
+    columns = "task_id UNINDEXED, title, summary, transcript"
+    try:
+        cursor.execute(f"CREATE VIRTUAL TABLE transcripts_fts USING fts5({columns}, tokenize = 'trigram')")
+    except sqlite3.OperationalError:
+        log.warning("SQLite 不支援 trigram 分詞器，全文檢索將改用 unicode61。")
+        cursor.execute(f"CREATE VIRTUAL TABLE transcripts_fts USING fts5({columns})")
+
+    cursor.execute(_TRANSCRIPT_INDEX_SQL.format(condition=""))
+    log.info(f"🔎 已為 {cursor.rowcount} 個既有任務建立全文檢索索引。")
+
+
+def _index_transcript(conn: sqlite3.Connection, task_id: str):
+    """在既有交易中，以增量方式更新單一任務的全文檢索索引。"""
+    conn.execute(
+        "DELETE FROM transcripts_fts WHERE rowid = (SELECT id FROM tasks WHERE task_id = ?)", (task_id,)
+    )
+    conn.execute(_TRANSCRIPT_INDEX_SQL.format(condition="AND task_id = ?"), (task_id,))
+
+
+def _is_trigram_index(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'transcripts_fts'").fetchone()
+    return bool(row) and "trigram" in row[0]
+
+
+def _make_snippet(text: str, term: str, width: int = 32) -> str:
+    """為無法使用 FTS snippet() 的短詞搜尋產生與 snippet() 相同格式的摘錄。"""
+    index = text.find(term)
+    if index < 0:
+        return text[:width * 2]
+    start = max(index - width, 0)
+    end = min(index + len(term) + width, len(text))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    return f"{prefix}{text[start:index]}<b>{term}</b>{text[index + len(term):end]}{suffix}"
+
+
+def search_transcripts(query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    """
+    在所有已完成任務的逐字稿與 AI 報告中進行全文檢索。
+
+    :param query: 以空白分隔的搜尋詞，所有詞都必須出現 (AND)。
+    :param limit: 最多回傳的結果數量。
+    :param offset: 分頁偏移量。
+    :return: 依相關度排序的結果列表，每筆包含 task_id、標題、類型與標示過的摘錄。
+    """
+    terms = [term for term in (query or "").split() if term]
+    if not terms:
+        return []
+
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        # trigram 索引無法比對過短的詞，這些詞改以 LIKE 條件過濾
+        min_len = _TRIGRAM_MIN_TERM if _is_trigram_index(conn) else 1
+        match_terms = [t for t in terms if len(t) >= min_len]
+        like_terms = [t for t in terms if len(t) < min_len]
+
+        conditions, params = [], []
+        if match_terms:
+            conditions.append("transcripts_fts MATCH ?")
+            params.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in match_terms))
+        for term in like_terms:
+            conditions.append("(f.title LIKE ? OR f.summary LIKE ? OR f.transcript LIKE ?)")
+            params.extend([f"%{term}%"] * 3)
+
+        if match_terms:
+            select = (
+                "bm25(transcripts_fts, 0.0, 5.0, 2.0, 1.0) AS score, "
+                "snippet(transcripts_fts, -1, '<b>', '</b>', '…', 16) AS snippet"
+            )
+            order = "ORDER BY score"
+        else:
+            select = "NULL AS score, NULL AS snippet"
+            order = "ORDER BY f.rowid DESC"
+
+        sql = f"""
+            SELECT f.task_id, f.title, f.summary, f.transcript, t.type, t.updated_at, {select}
+            FROM transcripts_fts AS f JOIN tasks AS t ON t.id = f.rowid
+            WHERE {' AND '.join(conditions)}
+            {order}
+            LIMIT ? OFFSET ?
+        """
+        params.extend([limit, offset])
+        rows = conn.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            snippet = row["snippet"]
+            if not snippet:
+                text = row["transcript"] or row["summary"] or row["title"] or ""
+                snippet = _make_snippet(text, like_terms[0] if like_terms else terms[0])
+            results.append({
+                "task_id": row["task_id"],
+                "title": row["title"],
+                "type": row["type"],
+                "updated_at": row["updated_at"],
+                "score": row["score"],
+                "snippet": snippet,
+            })
+        return results
+    except sqlite3.Error as e:
+        log.error(f"❌ 全文檢索 '{query}' 時發生錯誤: {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+# --- JULES'S NEW FEATURE: App State 核心功能 ---
+
+# App state 的記憶體快取: {key: {"value": str, "version": int}}
+# DB 管理者是 app_state 唯一的寫入者，因此讀取可以直接由快取回答，
+# 只有在寫入成功後才更新快取。
+_app_state_cache: dict[str, dict] = {}
+_app_state_lock = threading.Lock()
+
+
+def _json_merge_patch(target, patch):
+    """
+    依照 RFC 7386 (JSON Merge Patch) 將 patch 套用到 target 上。
+    patch 中值為 null 的鍵會被移除；非物件的 patch 會直接取代 target。
     """
-    sql = "SELECT value FROM app_state WHERE key = ?"
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = _json_merge_patch(result.get(key), value)
+    return result
+
+
+def get_app_state_versioned(key: str) -> dict | None:
+    """
+    根據鍵獲取 app_state 的值與版本號，優先由記憶體快取回答。
+
+    :return: {"value": str, "version": int}，找不到時回傳 None。
+    """
+    with _app_state_lock:
+        cached = _app_state_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    sql = "SELECT value, version FROM app_state WHERE key = ?"
     conn = get_db_connection()
     if not conn: return None
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql, (key,))
-        row = cursor.fetchone()
-        return row['value'] if row else None
+        row = conn.execute(sql, (key,)).fetchone()
+        if not row:
+            return None
+        entry = {"value": row["value"], "version": row["version"]}
+        with _app_state_lock:
+            _app_state_cache[key] = entry
+        return dict(entry)
     except sqlite3.Error as e:
         log.error(f"❌ 獲取 app_state '{key}' 時發生錯誤: {e}", exc_info=True)
         return None
@@ -160,25 +515,125 @@ def get_app_state(key: str) -> str | None:
             conn.close()
 
 
+def set_app_state(key: str, value: str, expected_version: int = None) -> dict:
+    """
+    儲存或更新一個鍵值對到 app_state 表中 (Upsert)，並遞增版本號。
+
+    :param expected_version: (可選) 若提供，只有在目前版本相符時才寫入；
+                             尚未有任何狀態時目前版本視為 0。
+    :return: {"status": "success" | "conflict" | "error", "version": int}
+    """
+    conn = get_db_connection()
+    if not conn: return {"status": "error", "version": None}
+    try:
+        with conn:
+            # 以 BEGIN IMMEDIATE 取得寫入鎖，讓「比對版本-寫入」成為原子操作
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT version FROM app_state WHERE key = ?", (key,)).fetchone()
+            current_version = row["version"] if row else 0
+            if expected_version is not None and expected_version != current_version:
+                return {"status": "conflict", "version": current_version}
+            version = current_version + 1
+            conn.execute("""
+                INSERT INTO app_state (key, value, version) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, version = excluded.version
+            """, (key, value, version))
+        with _app_state_lock:
+            _app_state_cache[key] = {"value": value, "version": version}
+        log.info(f"✅ App state '{key}' 已更新 (版本 {version})。")
+        return {"status": "success", "version": version}
+    except sqlite3.Error as e:
+        log.error(f"❌ 更新 app_state '{key}' 時發生錯誤: {e}", exc_info=True)
+        return {"status": "error", "version": None}
+    finally:
+        if conn:
+            conn.close()
+
+
+def patch_app_state(key: str, patch: dict, expected_version: int = None) -> dict:
+    """
+    以 JSON Merge Patch 局部更新 app_state 中的 JSON 文件，並使用版本號進行樂觀並行控制。
+
+    :param key: app_state 的鍵。
+    :param patch: 要合併的 merge-patch 物件。
+    :param expected_version: (可選) 客戶端所持有的版本號，與目前版本不符時拒絕寫入。
+    :return: {"status": "success" | "conflict" | "error", "version": int, "value": str}
+    """
+    conn = get_db_connection()
+    if not conn: return {"status": "error", "version": None}
+    try:
+        with conn:
+            # 以 BEGIN IMMEDIATE 取得寫入鎖，讓「讀取-合併-寫回」成為原子操作
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value, version FROM app_state WHERE key = ?", (key,)).fetchone()
+            current_version = row["version"] if row else 0
+            if expected_version is not None and expected_version != current_version:
+                return {"status": "conflict", "version": current_version}
+
+            try:
+                current = json.loads(row["value"]) if row else {}
+            except json.JSONDecodeError:
+                current = {}
+            new_value = json.dumps(_json_merge_patch(current, patch), ensure_ascii=False)
+            new_version = current_version + 1
+            conn.execute("""
+                INSERT INTO app_state (key, value, version) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, version = excluded.version
+            """, (key, new_value, new_version))
+        with _app_state_lock:
+            _app_state_cache[key] = {"value": new_value, "version": new_version}
+        log.debug(f"App state '{key}' 已局部更新 (版本 {new_version})。")
+        return {"status": "success", "version": new_version, "value": new_value}
+    except sqlite3.Error as e:
+        log.error(f"❌ 局部更新 app_state '{key}' 時發生錯誤: {e}", exc_info=True)
+        return {"status": "error", "version": None}
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_app_state(key: str) -> str | None:
+    """
+    根據鍵從 app_state 表中獲取值。
+    """
+    entry = get_app_state_versioned(key)
+    return entry["value"] if entry else None
+
+
 # --- 任務佇列核心功能 ---
 
-def add_task(task_id: str, payload: str, task_type: str = 'transcribe', depends_on: str = None) -> bool:
+def add_task(task_id: str, payload: str, task_type: str = 'transcribe', depends_on: str | list[str] = None,
+             dedup_key: str = None) -> bool:
     """
     新增一個新任務到佇列中。
 
     :param task_id: 唯一的任務 ID。
     :param payload: 任務的內容，通常是 JSON 字串。
     :param task_type: 任務類型 ('transcribe' 或 'download').
-    :param depends_on: 此任務所依賴的另一個任務的 task_id。
+    :param depends_on: 此任務所依賴的父任務 task_id，可以是單一 ID 或 ID 列表。
+                       只有在所有父任務都完成後，此任務才會被取出執行。
+    :param dedup_key: (可選) 內容去重鍵，之後相同輸入的任務可透過 `add_task_from_completed` 重用結果。
     :return: 如果成功新增則回傳 True，否則回傳 False。
     """
-    sql = "INSERT INTO tasks (task_id, payload, status, type, depends_on) VALUES (?, ?, 'pending', ?, ?)"
+    if isinstance(depends_on, str):
+        parents = [depends_on]
+    else:
+        parents = list(dict.fromkeys(depends_on or []))
+    # 舊的 depends_on 欄位保留第一個父任務，以相容既有的查詢與報表
+    legacy_depends_on = parents[0] if parents else None
+
+    sql = "INSERT INTO tasks (task_id, payload, status, type, depends_on, dedup_key) VALUES (?, ?, 'pending', ?, ?, ?)"
     conn = get_db_connection()
     if not conn: return False
-    log.info(f"DB:{DB_FILE} 準備新增 '{task_type}' 任務: {task_id} (依賴: {depends_on or '無'})")
+    log.info(f"DB:{DB_FILE} 準備新增 '{task_type}' 任務: {task_id} (依賴: {', '.join(parents) or '無'})")
     try:
         with conn:
-            conn.execute(sql, (task_id, payload, task_type, depends_on))
+            conn.execute(sql, (task_id, payload, task_type, legacy_depends_on, dedup_key))
+            if parents:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO task_dependencies (task_id, depends_on) VALUES (?, ?)",
+                    [(task_id, parent) for parent in parents]
+                )
         log.info(f"✅ 已成功新增任務到佇列: {task_id}")
         return True
     except sqlite3.IntegrityError:
@@ -191,6 +646,47 @@ def add_task(task_id: str, payload: str, task_type: str = 'transcribe', depends_
         if conn:
             conn.close()
 
+def add_task_from_completed(task_id: str, payload: str, dedup_key: str, task_type: str = 'transcribe') -> str | None:
+    """
+    若已有相同 dedup_key 的已完成任務，直接以其結果建立一個「已完成」的新任務。
+    查詢與新增在同一個交易中完成，新任務不會以 pending 狀態出現在佇列中。
+
+    :param task_id: 新任務的 ID。
+    :param payload: 新任務的內容 (JSON 字串)。
+    :param dedup_key: 內容去重鍵。
+    :param task_type: 任務類型。
+    :return: 被重用結果的來源任務 ID；找不到可重用的任務時回傳 None (不會新增任何任務)。
+    """
+    conn = get_db_connection()
+    if not conn: return None
+
+    try:
+        with conn:
+            source = conn.execute(
+                "SELECT task_id FROM tasks WHERE dedup_key = ? AND status = 'completed' ORDER BY id DESC LIMIT 1",
+                (dedup_key,)
+            ).fetchone()
+            if not source:
+                return None
+            source_task_id = source["task_id"]
+            # 複製結果並標記來源，讓前端與除錯時知道這是重用的結果
+            conn.execute("""
+                INSERT INTO tasks (task_id, payload, status, progress, type, dedup_key, result)
+                SELECT ?, ?, 'completed', 100, ?, ?,
+                       CASE WHEN json_valid(result) THEN json_set(result, '$.deduplicated_from', ?) ELSE result END
+                FROM tasks WHERE task_id = ?
+            """, (task_id, payload, task_type, dedup_key, source_task_id, source_task_id))
+            _index_transcript(conn, task_id)
+        log.info(f"♻️ 任務 {task_id} 的輸入與已完成的任務 {source_task_id} 相同，直接重用其結果。")
+        return source_task_id
+    except sqlite3.Error as e:
+        log.error(f"❌ 以已完成的結果建立任務 {task_id} 時出錯: {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
 def fetch_and_lock_task() -> dict | None:
     """
     以原子操作獲取一個待處理的任務，並將其狀態更新為 'processing'。
@@ -208,15 +704,18 @@ def fetch_and_lock_task() -> dict | None:
             cursor = conn.cursor()
             # 1. 查詢一個可執行的待處理任務
             #    - 優先處理無依賴的任務 (例如下載任務)
-            #    - 對於有依賴的任務，只有在其依賴的任務已完成時才選取
+            #    - 對於有依賴的任務，只有在其「所有」父任務都已完成時才選取 (fan-in)
+            #    - 父任務已不存在的依賴視為未滿足，不會執行缺少輸入的任務
             sql = """
                 SELECT id, task_id, payload, type
-                FROM tasks
-                WHERE status = 'pending' AND (
-                    depends_on IS NULL OR
-                    depends_on IN (SELECT task_id FROM tasks WHERE status = 'completed')
+                FROM tasks AS t
+                WHERE t.status = 'pending' AND NOT EXISTS (
+                    SELECT 1
+                    FROM task_dependencies AS d
+                    LEFT JOIN tasks AS parent ON parent.task_id = d.depends_on
+                    WHERE d.task_id = t.task_id AND (parent.task_id IS NULL OR parent.status != 'completed')
                 )
-                ORDER BY depends_on NULLS FIRST, created_at
+                ORDER BY t.depends_on NULLS FIRST, t.created_at
                 LIMIT 1
             """
             cursor.execute(sql)
@@ -227,8 +726,12 @@ def fetch_and_lock_task() -> dict | None:
                 task_id_to_process = task["id"]
                 log.info(f"🔒 找到並鎖定任務 ID: {task['task_id']} (資料庫 id: {task_id_to_process})")
                 cursor.execute(
-                    "UPDATE tasks SET status = 'processing' WHERE id = ?", (task_id_to_process,)
+                    "UPDATE tasks SET status = 'processing' WHERE id = ? AND status = 'pending'", (task_id_to_process,)
                 )
+                if cursor.rowcount == 0:
+                    # 另一個 worker 已搶先鎖定此任務
+                    log.debug(f"任務 {task['task_id']} 已被其他 worker 鎖定。")
+                    return None
                 return dict(task)
             else:
                 # 佇列中沒有待處理的任務
@@ -242,19 +745,101 @@ def fetch_and_lock_task() -> dict | None:
             conn.close()
 
 
-def update_task_progress(task_id: str, progress: int, partial_result: str):
+def _append_segments(conn: sqlite3.Connection, task_id: str, segments: list[dict]) -> int | None:
+    """
+    在既有交易中，將片段依序附加到 task_segments 表。
+    序號由 (task_id, seq) 主鍵上的 MAX 查詢決定，成本與已存在的片段數量無關。
+
+    :return: 最後一個寫入片段的序號，若沒有寫入任何片段則回傳 None。
     """
-    更新任務的即時進度和部分結果。
+    row = conn.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM task_segments WHERE task_id = ?", (task_id,)
+    ).fetchone()
+    seq = row[0]
+    rows = []
+    for segment in segments:
+        seq += 1
+        rows.append((task_id, seq, segment.get("start"), segment.get("end"), segment.get("text") or ""))
+    if not rows:
+        return None
+    conn.executemany(
+        'INSERT INTO task_segments (task_id, seq, start, "end", text) VALUES (?, ?, ?, ?, ?)', rows
+    )
+    return seq
+
+
+def append_task_segments(task_id: str, segments: list[dict], progress: int = None) -> int | None:
+    """
+    將一批新的轉錄片段附加到任務，並可選擇性地同時更新進度。
+    每次寫入的資料量只與新片段的大小成正比。
+
+    :param task_id: 任務 ID。
+    :param segments: 片段列表，每個片段為包含 'start', 'end', 'text' 的字典。
+    :param progress: (可選) 新的進度百分比。
+    :return: 最後一個片段的序號，失敗或無片段時回傳 None。
+    """
+    conn = get_db_connection()
+    if not conn: return None
+
+    try:
+        with conn:
+            last_seq = _append_segments(conn, task_id, segments)
+            if progress is not None:
+                conn.execute("UPDATE tasks SET progress = ? WHERE task_id = ?", (progress, task_id))
+        log.debug(f"🧩 任務 {task_id} 新增了 {len(segments)} 個片段 (最後序號: {last_seq})")
+        return last_seq
+    except sqlite3.Error as e:
+        log.error(f"❌ 附加任務 {task_id} 的轉錄片段時出錯: {e}", exc_info=True)
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_task_segments(task_id: str, after_seq: int = 0, limit: int = None) -> list[dict]:
+    """
+    獲取某個任務在指定序號之後的轉錄片段，供客戶端增量續讀即時畫面。
+
+    :param task_id: 任務 ID。
+    :param after_seq: 只回傳序號大於此值的片段。
+    :param limit: (可選) 最多回傳的片段數量。
+    :return: 依序號排序的片段字典列表。
+    """
+    sql = 'SELECT seq, start, "end", text FROM task_segments WHERE task_id = ? AND seq > ? ORDER BY seq'
+    params = [task_id, after_seq or 0]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        log.error(f"❌ 獲取任務 {task_id} 的轉錄片段時出錯: {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def update_task_progress(task_id: str, progress: int, partial_result: str = None, is_segment: bool = False):
+    """
+    更新任務的即時進度。不再於每次更新時把完整的部分逐字稿序列化到 `result` 欄位。
+
+    :param partial_result: 部分結果 (逐字稿文字或進度訊息)。
+    :param is_segment: 為 True 時表示 partial_result 是逐字稿文字，會附加為一個片段；
+                       其他任務 (例如模型下載) 的進度訊息只更新進度，不會成為片段。
     """
-    # 將部分結果打包成與最終結果相同的 JSON 結構
-    result_payload = json.dumps({"transcript": partial_result})
-    sql = "UPDATE tasks SET progress = ?, result = ? WHERE task_id = ?"
     conn = get_db_connection()
     if not conn: return
 
     try:
         with conn:
-            conn.execute(sql, (progress, result_payload, task_id))
+            conn.execute("UPDATE tasks SET progress = ? WHERE task_id = ?", (progress, task_id))
+            if is_segment and partial_result:
+                _append_segments(conn, task_id, [{"text": partial_result}])
         log.debug(f"📈 任務 {task_id} 進度已更新為: {progress}%")
     except sqlite3.Error as e:
         log.error(f"❌ 更新任務 {task_id} 進度時出錯: {e}", exc_info=True)
@@ -262,24 +847,74 @@ def update_task_progress(task_id: str, progress: int, partial_result: str):
         if conn:
             conn.close()
 
-def update_task_status(task_id: str, status: str, result: str = None):
+def update_task_status(task_id: str, status: str, result: str = None) -> bool:
     """
     更新一個任務的狀態和結果。
+    已取消的任務不會再被更新：取消後仍在收尾的背景工作不能把狀態改回 completed / failed。
 
     :param task_id: 要更新的任務 ID。
     :param status: 新的狀態 ('completed', 'failed')。
     :param result: 任務的結果或錯誤訊息。
+    :return: 是否實際更新了任務 (任務不存在或已取消時為 False)，呼叫端據此決定是否通知前端。
     """
-    sql = "UPDATE tasks SET status = ?, result = ? WHERE task_id = ?"
+    sql = "UPDATE tasks SET status = ?, result = ? WHERE task_id = ? AND status != 'cancelled'"
     conn = get_db_connection()
-    if not conn: return
+    if not conn: return False
 
     try:
         with conn:
-            conn.execute(sql, (status, result, task_id))
-        log.info(f"✅ 任務 {task_id} 狀態已更新為: {status}")
+            updated = conn.execute(sql, (status, result, task_id)).rowcount > 0
+            if updated:
+                # 在同一個交易中增量維護全文檢索索引
+                _index_transcript(conn, task_id)
+        if updated:
+            log.info(f"✅ 任務 {task_id} 狀態已更新為: {status}")
+        else:
+            log.info(f"任務 {task_id} 不存在或已被取消，略過狀態更新 ({status})。")
+        return updated
     except sqlite3.Error as e:
         log.error(f"❌ 更新任務 {task_id} 狀態時出錯: {e}", exc_info=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def cancel_task(task_id: str, reason: str = None) -> list[str]:
+    """
+    取消一個尚未結束的任務，並連帶取消所有 (直接或間接) 依賴它的待處理任務，
+    避免它們因父任務永遠不會完成而一直停留在佇列中。
+
+    :param task_id: 要取消的任務 ID。
+    :param reason: (可選) 取消原因，會寫入每個被取消任務的 result。
+    :return: 實際被取消的 task_id 列表 (依建立順序)。任務不存在或已結束時回傳空列表。
+    """
+    sql_chain = """
+        WITH RECURSIVE chain(task_id) AS (
+            SELECT ?
+            UNION
+            SELECT d.task_id FROM task_dependencies AS d JOIN chain AS c ON d.depends_on = c.task_id
+        )
+        SELECT t.task_id FROM tasks AS t JOIN chain AS c ON c.task_id = t.task_id
+        WHERE t.status IN ('pending', 'processing')
+        ORDER BY t.created_at, t.id
+    """
+    conn = get_db_connection()
+    if not conn: return []
+
+    try:
+        with conn:
+            cancelled = [row["task_id"] for row in conn.execute(sql_chain, (task_id,))]
+            conn.executemany(
+                "UPDATE tasks SET status = 'cancelled', result = ? WHERE task_id = ?",
+                [(json.dumps({"error": reason or "任務已被取消", "cancelled_by": task_id}, ensure_ascii=False), t)
+                 for t in cancelled]
+            )
+        if cancelled:
+            log.info(f"🛑 已取消任務 {task_id} 及其 {len(cancelled) - (task_id in cancelled)} 個依賴任務。")
+        return cancelled
+    except sqlite3.Error as e:
+        log.error(f"❌ 取消任務 {task_id} 時出錯: {e}", exc_info=True)
+        return []
     finally:
         if conn:
             conn.close()
@@ -313,17 +948,57 @@ def find_dependent_task(parent_task_id: str) -> str | None:
     :param parent_task_id: 依賴的父任務 ID。
     :return: 依賴任務的 task_id，如果找不到則回傳 None。
     """
-    sql = "SELECT task_id FROM tasks WHERE depends_on = ?"
+    dependents = find_dependent_tasks(parent_task_id)
+    return dependents[0] if dependents else None
+
+def find_dependent_tasks(parent_task_id: str) -> list[str]:
+    """
+    尋找所有直接依賴於某個父任務的子任務 (fan-out)。
+
+    :param parent_task_id: 依賴的父任務 ID。
+    :return: 子任務的 task_id 列表，依建立時間排序。
+    """
+    sql = """
+        SELECT t.task_id FROM task_dependencies AS d
+        JOIN tasks AS t ON t.task_id = d.task_id
+        WHERE d.depends_on = ?
+        ORDER BY t.created_at, t.id
+    """
     conn = get_db_connection()
-    if not conn: return None
+    if not conn: return []
     try:
         cursor = conn.cursor()
         cursor.execute(sql, (parent_task_id,))
-        task = cursor.fetchone()
-        return task['task_id'] if task else None
+        return [row['task_id'] for row in cursor.fetchall()]
     except sqlite3.Error as e:
         log.error(f"❌ 尋找依賴於 {parent_task_id} 的任務時出錯: {e}", exc_info=True)
-        return None
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def get_task_dependencies(task_id: str) -> list[dict]:
+    """
+    獲取某個任務的所有父任務及其目前狀態 (fan-in)。
+
+    :param task_id: 子任務 ID。
+    :return: 包含父任務 task_id 與 status 的字典列表。父任務已被清理時 status 為 None。
+    """
+    sql = """
+        SELECT d.depends_on AS task_id, t.status FROM task_dependencies AS d
+        LEFT JOIN tasks AS t ON t.task_id = d.depends_on
+        WHERE d.task_id = ?
+        ORDER BY d.depends_on
+    """
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, (task_id,))
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        log.error(f"❌ 獲取任務 {task_id} 的依賴時出錯: {e}", exc_info=True)
+        return []
     finally:
         if conn:
             conn.close()
@@ -335,7 +1010,8 @@ def are_tasks_active() -> bool:
 
     :return: 如果有活動中任務則回傳 True，否則回傳 False。
     """
-    sql = "SELECT 1 FROM tasks WHERE status IN ('pending', 'processing') LIMIT 1"
+    # 直接讀取由觸發器維護的計數器，心跳檢查不需觸及 tasks 資料表
+    sql = "SELECT 1 FROM task_counters WHERE status IN ('pending', 'processing') AND count > 0 LIMIT 1"
     conn = get_db_connection()
     if not conn: return False # 如果無法連線，假設沒有活動任務以避免死鎖
 
@@ -374,16 +1050,164 @@ def get_all_tasks() -> list[dict]:
             conn.close()
 
 
-def add_system_log(source: str, level: str, message: str) -> bool:
+# --- 日誌環形緩衝區 ---
+# system_logs 中每個來源最多保留 max_rows 筆 / max_bytes 位元組的訊息。
+# 超過上限時，由寫入日誌的同一個交易刪除該來源最舊的日誌，直到降回
+# 上限的 low_watermark 比例；每次最多刪除 trim_batch 筆，讓寫入的延遲維持在有限範圍。
+# 可選擇在刪除前將舊日誌封存為壓縮的 JSONL 檔案 (與資料保留流程共用封存目錄)。
+# 可在 config.json 的 `log_ring` 區段中覆寫，per_source 可針對個別來源調整上限。
+DEFAULT_LOG_RING = {
+    "enabled": True,
+    "max_rows": 200000,              # 每個來源的最大筆數，0 表示不限制
+    "max_bytes": 64 * 1024 * 1024,   # 每個來源的訊息位元組上限，0 表示不限制
+    "low_watermark": 0.9,
+    "trim_batch": 5000,
+    "archive": False,
+    "per_source": {
+        "frontend_action": {"max_rows": 50000},
+    },
+}
+
+_log_ring_settings = None
+
+
+def _get_log_ring_settings() -> dict:
+    """讀取並快取環形緩衝區設定，避免每次寫入日誌都讀取設定檔。"""
+    global _log_ring_settings
+    if _log_ring_settings is None:
+        _log_ring_settings = config.get_section("log_ring", DEFAULT_LOG_RING)
+    return _log_ring_settings
+
+
+def _reset_log_ring_settings():
+    global _log_ring_settings
+    _log_ring_settings = None
+
+
+def _create_log_counters(cursor: sqlite3.Cursor):
+    """
+    建立 `log_counters` (每個來源的日誌筆數與訊息位元組數) 資料表及維護它的觸發器，
+    並從 system_logs 重建一次計數以自我修復。
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS log_counters (
+            source TEXT PRIMARY KEY,
+            rows INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS log_counters_after_insert
+        AFTER INSERT ON system_logs FOR EACH ROW
+        BEGIN
+            INSERT INTO log_counters (source, rows, bytes)
+            VALUES (NEW.source, 1, COALESCE(length(CAST(NEW.message AS BLOB)), 0))
+            ON CONFLICT (source) DO UPDATE SET rows = rows + 1, bytes = bytes + excluded.bytes;
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS log_counters_after_delete
+        AFTER DELETE ON system_logs FOR EACH ROW
+        BEGIN
+            UPDATE log_counters
+            SET rows = rows - 1, bytes = bytes - COALESCE(length(CAST(OLD.message AS BLOB)), 0)
+            WHERE source = OLD.source;
+        END;
+    """)
+    cursor.execute("DELETE FROM log_counters")
+    cursor.execute("""
+        INSERT INTO log_counters (source, rows, bytes)
+        SELECT source, COUNT(*), COALESCE(SUM(length(CAST(message AS BLOB))), 0) FROM system_logs GROUP BY source
+    """)
+
+
+def _trim_log_ring(conn: sqlite3.Connection, sources) -> list[tuple[str, list[dict]]]:
+    """
+    檢查剛寫入日誌的來源是否超過上限，並刪除最舊的日誌。
+    必須在寫入日誌的同一個交易中呼叫；需要封存的批次會回傳給呼叫端，
+    由呼叫端在交易提交後交給 `_archive_trimmed_logs`，回滾的刪除因此不會留下封存。
+
+    :param sources: 本次寫入涉及的日誌來源。
+    :return: 需要封存的 (封存檔名稱, 日誌列表)。
+    """
+    settings = _get_log_ring_settings()
+    if not settings["enabled"]:
+        return []
+
+    to_archive = []
+    for source in set(sources):
+        limits = {**settings, **(settings["per_source"].get(source) or {})}
+        counter = conn.execute("SELECT rows, bytes FROM log_counters WHERE source = ?", (source,)).fetchone()
+        if not counter or counter["rows"] <= 0:
+            continue
+        rows, size = counter["rows"], counter["bytes"]
+        max_rows, max_bytes = int(limits["max_rows"] or 0), int(limits["max_bytes"] or 0)
+        low = float(limits["low_watermark"])
+
+        excess = 0
+        if max_rows and rows > max_rows:
+            excess = rows - int(max_rows * low)
+        if max_bytes and size > max_bytes:
+            # 以平均訊息大小估算需要刪除的筆數
+            average = size / rows
+            excess = max(excess, int((size - max_bytes * low) / average) + 1)
+        if excess <= 0:
+            continue
+
+        batch = conn.execute(
+            "SELECT id, timestamp, source, level, message FROM system_logs WHERE source = ? ORDER BY id LIMIT ?",
+            (source, min(excess, int(limits["trim_batch"])))
+        ).fetchall()
+        if not batch:
+            continue
+        conn.execute("DELETE FROM system_logs WHERE source = ? AND id <= ?", (source, batch[-1]["id"]))
+        if limits["archive"]:
+            archive_name = "logs-ring-" + re.sub(r"[^\w.-]", "_", source)
+            to_archive.append((archive_name, [dict(r) for r in batch]))
+    return to_archive
+
+
+def _archive_trimmed_logs(to_archive: list[tuple[str, list[dict]]]):
+    """
+    在交易提交後封存被修剪的日誌。封存失敗 (例如磁碟已滿) 不影響日誌的寫入，
+    只在控制台打印錯誤，避免再次觸發日誌處理器。
+    """
+    if not to_archive:
+        return
+    # 延遲匯入：retention 模組本身依賴 database
+    from db import retention
+    # 每個來源每天一個封存檔，被修剪的批次依序附加
+    stamp = datetime.now().strftime("%Y%m%d")
+    for archive_name, rows in to_archive:
+        try:
+            retention.archive_rows(archive_name, rows, stamp)
+        except OSError as e:
+            print(f"CRITICAL: Failed to archive {len(rows)} trimmed logs to {archive_name}. Error: {e}", file=sys.stderr)
+
+
+def add_system_log(
+    source: str,
+    level: str,
+    message: str,
+    task_id: str = None,
+    stage: str = None,
+    duration_ms: float = None
+) -> bool:
     """
     一個簡單的函式，用於從外部腳本（如 colab.py）直接寫入系統日誌。
+
+    :param task_id: (可選) 此日誌相關的任務 ID。
+    :param stage: (可選) 處理階段名稱，例如 'transcribe'、'download'。
+    :param duration_ms: (可選) 該階段的耗時 (毫秒)。
     """
-    sql = "INSERT INTO system_logs (source, level, message) VALUES (?, ?, ?)"
+    sql = "INSERT INTO system_logs (source, level, message, task_id, stage, duration_ms) VALUES (?, ?, ?, ?, ?, ?)"
     conn = get_db_connection()
     if not conn: return False
     try:
         with conn:
-            conn.execute(sql, (source, level.upper(), message))
+            conn.execute(sql, (source, level.upper(), message, task_id, stage, duration_ms))
+            to_archive = _trim_log_ring(conn, [source])
+        _archive_trimmed_logs(to_archive)
         return True
     except sqlite3.Error as e:
         # 在這種情況下，我們只在控制台打印錯誤，因為我們不能觸發日誌處理器
@@ -394,15 +1218,71 @@ def add_system_log(source: str, level: str, message: str) -> bool:
             conn.close()
 
 
-def get_system_logs_by_filter(levels: list[str] = None, sources: list[str] = None) -> list[dict]:
+def add_system_logs_batch(logs: list[dict]) -> int:
+    """
+    在單一交易中批次寫入多筆系統日誌，供 DatabaseLogHandler 透過 DB 管理者呼叫。
+
+    :param logs: 日誌列表，每筆包含 source、level、message，以及可選的 timestamp
+                 (UTC，'YYYY-MM-DD HH:MM:SS'；未提供時使用寫入當下的時間)
+                 與結構化欄位 task_id、stage、duration_ms。
+    :return: 成功寫入的筆數。
+    """
+    if not logs:
+        return 0
+    sql = (
+        "INSERT INTO system_logs (timestamp, source, level, message, task_id, stage, duration_ms) "
+        "VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?)"
+    )
+    rows = [
+        (
+            entry.get("timestamp"), entry["source"], str(entry["level"]).upper(), entry.get("message"),
+            entry.get("task_id"), entry.get("stage"), entry.get("duration_ms")
+        )
+        for entry in logs
+    ]
+    conn = get_db_connection()
+    if not conn: return 0
+    try:
+        with conn:
+            conn.executemany(sql, rows)
+            to_archive = _trim_log_ring(conn, [row[1] for row in rows])
+        _archive_trimmed_logs(to_archive)
+        return len(rows)
+    except sqlite3.Error as e:
+        # 與 add_system_log 相同，只在控制台打印錯誤，避免再次觸發日誌處理器
+        print(f"CRITICAL: Failed to write {len(rows)} system logs to DB. Error: {e}", file=sys.stderr)
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_system_logs_by_filter(
+    levels: list[str] = None,
+    sources: list[str] = None,
+    since_id: int = None,
+    until: str = None,
+    limit: int = None,
+    latest: bool = False,
+    task_id: str = None
+) -> list[dict]:
     """
     根據等級和來源篩選，從資料庫獲取系統日誌。
+
+    :param levels: (可選) 要包含的日誌等級。
+    :param sources: (可選) 要包含的日誌來源。
+    :param since_id: (可選) 游標，只回傳 id 大於此值的日誌。
+    :param until: (可選) 只回傳時間戳小於或等於此值的日誌 (格式 'YYYY-MM-DD HH:MM:SS')。
+    :param limit: (可選) 最多回傳的筆數。
+    :param latest: 若為 True，則以 id 遞減排序回傳最新的 `limit` 筆 (最新的在最前面)。
+    :param task_id: (可選) 只回傳與此任務相關的日誌 (走 `idx_log_task_id` 索引)。
+    :return: 日誌字典列表。預設依 id 遞增排序。
     """
     conn = get_db_connection()
     if not conn: return []
 
     try:
-        sql = "SELECT timestamp, source, level, message FROM system_logs"
+        sql = "SELECT id, timestamp, source, level, message, task_id, stage, duration_ms FROM system_logs"
         conditions = []
         params = []
 
@@ -418,10 +1298,27 @@ def get_system_logs_by_filter(levels: list[str] = None, sources: list[str] = Non
             conditions.append(f"source IN ({','.join(['?'] * len(sources))})")
             params.extend(sources)
 
+        if task_id:
+            conditions.append("task_id = ?")
+            params.append(task_id)
+
+        if since_id is not None:
+            conditions.append("id > ?")
+            params.append(since_id)
+
+        if until:
+            conditions.append("timestamp <= ?")
+            params.append(until)
+
         if conditions:
             sql += " WHERE " + " AND ".join(conditions)
 
-        sql += " ORDER BY timestamp ASC"
+        # id 與寫入順序一致，且可直接利用主鍵與 (source, level, id) 索引排序
+        sql += " ORDER BY id DESC" if latest else " ORDER BY id ASC"
+
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
 
         cursor = conn.cursor()
         cursor.execute(sql, params)
@@ -435,6 +1332,40 @@ def get_system_logs_by_filter(levels: list[str] = None, sources: list[str] = Non
             conn.close()
 
 
+def get_stage_durations(task_id: str = None, since: str = None) -> list[dict]:
+    """
+    依處理階段彙總帶有 duration_ms 的結構化日誌。
+
+    :param task_id: (可選) 只彙總此任務的日誌。
+    :param since: (可選) 只彙總時間戳大於或等於此值的日誌 (格式 'YYYY-MM-DD HH:MM:SS')。
+    :return: 每個階段一筆，包含 stage、count、avg_ms、min_ms、max_ms、total_ms。
+    """
+    conn = get_db_connection()
+    if not conn: return []
+    try:
+        sql = """
+            SELECT stage, COUNT(*) AS count, AVG(duration_ms) AS avg_ms,
+                   MIN(duration_ms) AS min_ms, MAX(duration_ms) AS max_ms, SUM(duration_ms) AS total_ms
+            FROM system_logs
+            WHERE stage IS NOT NULL AND duration_ms IS NOT NULL
+        """
+        params = []
+        if task_id:
+            sql += " AND task_id = ?"
+            params.append(task_id)
+        if since:
+            sql += " AND timestamp >= ?"
+            params.append(since)
+        sql += " GROUP BY stage ORDER BY total_ms DESC"
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    except sqlite3.Error as e:
+        log.error(f"❌ 彙總階段耗時時發生錯誤: {e}", exc_info=True)
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
 if __name__ == "__main__":
     # 直接執行此檔案時，會進行初始化
     initialize_database()
@@ -1,10 +1,16 @@
 # db/log_handler.py
+#
+# 將各服務 (api_server、worker、orchestrator) 的日誌寫入 `tasks.db` 的 `system_logs` 資料表。
+# 日誌經由 DB 管理者的 `add_system_logs_batch` action 批次送出，因此與
+# `get_system_logs` / `/api/logs` 讀取的是同一份資料，並且只有一條寫入路徑。
 import logging
-import sqlite3
+import queue
 import sys
-from pathlib import Path
 import threading
 import time
+from datetime import datetime, timezone
+
+from db import config
 
 # 避免在日誌處理器中再次觸發日誌，導致無限迴圈
 # 我們為這個模組建立一個獨立的、只輸出到控制台的日誌器
@@ -16,71 +22,196 @@ if not handler_log.handlers:
     console_handler.setFormatter(formatter)
     handler_log.addHandler(console_handler)
 
-DB_FILE = Path(__file__).parent / "queue.db"
+# 佇列滿載時的處理策略：
+#   drop_new:    丟棄新進的日誌 (預設，呼叫端永遠不會被阻塞)
+#   drop_oldest: 丟棄佇列中最舊的一筆，保留最新的日誌
+#   block:       阻塞呼叫端直到佇列有空位 (不遺失日誌，但可能拖慢呼叫端)
+DROP_POLICIES = ("drop_new", "drop_oldest", "block")
+
+# 會從日誌記錄的 `extra` 中擷取並寫入獨立 (有索引) 欄位的結構化欄位，例如：
+#   log.info("轉錄完成", extra={"task_id": task_id, "stage": "transcribe", "duration_ms": 1234.5})
+STRUCTURED_FIELDS = ("task_id", "stage", "duration_ms")
+
+# 可在 config.json 的 `log_handler` 區段中覆寫
+DEFAULT_SETTINGS = {
+    "queue_size": 10000,     # 佇列中最多暫存的日誌筆數
+    "batch_size": 200,       # 單次寫入的最大筆數
+    "flush_interval": 0.5,   # 秒；未湊滿一批時，最多等待這麼久就寫入
+    "drop_policy": "drop_new",
+}
 
 class DatabaseLogHandler(logging.Handler):
     """
-    一個自訂的日誌處理器，將日誌記錄寫入 SQLite 資料庫。
-    為確保執行緒安全，它為每個執行緒維護一個獨立的資料庫連線。
+    一個自訂的日誌處理器，將日誌記錄寫入資料庫的 `system_logs` 資料表。
+
+    `emit` 只會將格式化後的記錄放入一個有界的記憶體佇列並立即返回，
+    實際的寫入由背景執行緒負責：依筆數或時間湊成一批後，透過 DB 管理者
+    一次寫入 (伺服器端以 `executemany` 在單一交易中完成)。
+    因此資料庫忙碌時不會阻塞 API 事件迴圈或轉錄執行緒。
     """
-    def __init__(self, source: str):
+    def __init__(self, source: str, queue_size: int = None, batch_size: int = None,
+                 flush_interval: float = None, drop_policy: str = None, client=None):
         super().__init__()
         self.source = source
-        self.local = threading.local()
+        self._client = client
+        settings = config.get_section("log_handler", DEFAULT_SETTINGS)
+        self.batch_size = max(1, int(batch_size or settings["batch_size"]))
+        self.flush_interval = float(flush_interval or settings["flush_interval"])
+        self.drop_policy = drop_policy or settings["drop_policy"]
+        if self.drop_policy not in DROP_POLICIES:
+            handler_log.warning(f"未知的日誌丟棄策略 '{self.drop_policy}'，將改用 'drop_new'。")
+            self.drop_policy = "drop_new"
 
-    def get_conn(self):
-        """為每個執行緒建立或取得資料庫連線。"""
-        if not hasattr(self.local, 'conn') or self.local.conn is None:
-            try:
-                # 使用較長的超時並啟用 autocommit
-                conn = sqlite3.connect(DB_FILE, timeout=10, isolation_level=None)
-                # 啟用 WAL (Write-Ahead Logging) 模式以提高併發性
-                conn.execute("PRAGMA journal_mode=WAL")
-                self.local.conn = conn
-            except sqlite3.Error as e:
-                handler_log.error(f"無法建立資料庫連線: {e}")
-                self.local.conn = None
-        return self.local.conn
+        self._queue = queue.Queue(maxsize=int(queue_size or settings["queue_size"]))
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def _get_client(self):
+        """延遲取得 DBClient，避免在匯入此模組時就連線到 DB 管理者。"""
+        if self._client is None:
+            from db.client import get_client
+            self._client = get_client()
+        return self._client
+
+    def _ensure_writer(self):
+        """在第一次寫入日誌時才啟動背景寫入執行緒。"""
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._stop_event.clear()
+                self._writer = threading.Thread(
+                    target=self._writer_loop, name=f"db-log-writer-{self.source}", daemon=True
+                )
+                self._writer.start()
 
     def emit(self, record: logging.LogRecord):
         """
-        將日誌記錄寫入資料庫。
+        將日誌記錄放入佇列，由背景執行緒批次寫入資料庫。
         """
-        if record.name == 'db_log_handler':
+        # 寫入執行緒本身 (例如 DBClient 的連線錯誤) 產生的日誌不再送回資料庫，避免無限迴圈
+        if record.name == 'db_log_handler' or threading.current_thread() is self._writer:
             return
 
-        conn = self.get_conn()
-        if not conn:
-            print(f"DBLogHandler Error: Cannot get DB connection. Log from {self.source} lost.", file=sys.stderr)
+        try:
+            message = self.format(record)
+        except Exception:
+            self.handleError(record)
             return
 
-        message = self.format(record)
+        # JULES'S FIX: The source of the log should be the logger's name, not the handler's name.
+        # 記錄產生的時間 (UTC，與 CURRENT_TIMESTAMP 相同格式)，而不是批次寫入的時間
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        item = {"source": record.name, "level": record.levelname, "message": message, "timestamp": timestamp}
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                item[field] = value
+        if "duration_ms" in item:
+            try:
+                item["duration_ms"] = float(item["duration_ms"])
+            except (TypeError, ValueError):
+                del item["duration_ms"]
+        for field in ("task_id", "stage"):
+            if field in item:
+                item[field] = str(item[field])
 
-        sql = "INSERT INTO system_logs (source, level, message) VALUES (?, ?, ?)"
+        self._ensure_writer()
+        if self.drop_policy == "block":
+            self._queue.put(item)
+            return
 
-        # JULES'S FIX: The source of the log should be the logger's name, not the handler's name.
-        log_source = record.name
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.drop_policy == "drop_new":
+                    self.dropped += 1
+                    return
+                # drop_oldest: 移除最舊的一筆後再試一次
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _next_batch(self) -> list:
+        """等待下一批日誌：湊滿 batch_size 筆，或距離第一筆超過 flush_interval 秒。"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
 
+    def _writer_loop(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            self._report_dropped()
+
+    def _write_batch(self, batch: list):
+        """將一批日誌送往 DB 管理者，連線失敗時 (例如管理者正在重啟) 以退避方式重試。"""
         retries = 5
         for i in range(retries):
             try:
-                conn.execute(sql, (log_source, record.levelname, message))
+                self._get_client().add_system_logs_batch(batch)
+                return
+            except (ConnectionError, OSError) as e:
+                if i < retries - 1:
+                    time.sleep(0.1 * (2 ** i))
+                    continue
+                print(f"DBLogHandler Error: {e}. {len(batch)} logs from {self.source} lost.", file=sys.stderr)
                 return
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e):
-                    if i < retries - 1:
-                        time.sleep(0.1)
-                        continue
-                    else:
-                        print(f"DBLogHandler Error: DB locked after {retries} retries. Log from {self.source} lost.", file=sys.stderr)
-                else:
-                    print(f"DBLogHandler Error: {e}. Log from {self.source} lost.", file=sys.stderr)
-                    return
             except Exception as e:
-                print(f"DBLogHandler Error: Unexpected error: {e}. Log from {self.source} lost.", file=sys.stderr)
+                print(f"DBLogHandler Error: Unexpected error: {e}. {len(batch)} logs from {self.source} lost.", file=sys.stderr)
                 return
 
-    def __del__(self):
-        if hasattr(self.local, 'conn') and self.local.conn:
-            self.local.conn.close()
-            self.local.conn = None
+    def _report_dropped(self):
+        """若自上次回報後有日誌因佇列滿載而被丟棄，輸出一則警告。"""
+        dropped = self.dropped
+        if dropped > self._reported_dropped:
+            handler_log.warning(
+                f"日誌佇列已滿 (策略: {self.drop_policy})，共丟棄 {dropped - self._reported_dropped} 筆來自 {self.source} 的日誌。"
+            )
+            self._reported_dropped = dropped
+
+    def flush(self, timeout: float = 5.0):
+        """
+        等待佇列中所有日誌都已寫入資料庫。
+
+        :param timeout: 最長等待秒數。
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+
+    def close(self):
+        """寫完佇列中剩餘的日誌並停止背景執行緒。"""
+        self._stop_event.set()
+        if self._writer is not None and self._writer.is_alive():
+            self._writer.join(timeout=self.flush_interval + 5)
+        super().close()
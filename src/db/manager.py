@@ -26,14 +26,16 @@
 import socketserver
 import json
 import logging
+import random
 import sqlite3
+import time
 from pathlib import Path
 
 # 讓此腳本可以存取上層目錄的 db.database 模組
 import sys
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-from db import database
+from db import config, database, retention
 
 # --- 日誌設定 ---
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -43,33 +45,109 @@ log = logging.getLogger('DBManagerServer')
 # --- 伺服器設定 ---
 HOST, PORT = "127.0.0.1", 49999 # JULES: Hardcoded port to fix race condition
 
+# --- 請求日誌設定 ---
+# 每個請求只在 DEBUG 等級記錄 action、請求/回應大小與耗時，參數內容會被截斷。
+# 高頻率的 action 依取樣率只記錄一部分；超過 slow_request_ms 的請求一律以 WARNING 記錄。
+# 可在 config.json 的 `db_manager.request_log` 區段中覆寫。
+DEFAULT_REQUEST_LOG = {
+    "sample_rate": 1.0,
+    "per_action_sample_rate": {
+        "fetch_and_lock_task": 0.01,
+        "update_task_progress": 0.1,
+        "append_task_segments": 0.1,
+        "add_system_logs_batch": 0.1,
+        "get_system_logs": 0.1,
+        "are_tasks_active": 0.01,
+    },
+    "max_value_chars": 80,
+    "slow_request_ms": 1000,
+}
+REQUEST_LOG = config.get_section("db_manager", {"request_log": DEFAULT_REQUEST_LOG})["request_log"]
+
 # --- 指令分派 ---
 # 建立一個函式名稱與指令 action 的對應字典
 # 這樣可以避免巨大的 if/elif/else 結構，也更安全
 ACTION_MAP = {
     "initialize_database": database.initialize_database,
     "add_task": database.add_task,
+    "add_task_from_completed": database.add_task_from_completed,
     "fetch_and_lock_task": database.fetch_and_lock_task,
     "update_task_progress": database.update_task_progress,
+    "append_task_segments": database.append_task_segments,
+    "get_task_segments": database.get_task_segments,
     "update_task_status": database.update_task_status,
+    "cancel_task": database.cancel_task,
     "get_task_status": database.get_task_status,
     "are_tasks_active": database.are_tasks_active,
+    "get_queue_stats": database.get_queue_stats,
     "get_all_tasks": database.get_all_tasks,
     "get_system_logs": database.get_system_logs_by_filter,
+    "add_system_logs_batch": database.add_system_logs_batch,
+    "get_stage_durations": database.get_stage_durations,
+    "search_transcripts": database.search_transcripts,
     "find_dependent_task": database.find_dependent_task,
+    "find_dependent_tasks": database.find_dependent_tasks,
+    "get_task_dependencies": database.get_task_dependencies,
     # JULES'S NEW FEATURE: Add app state actions
     "get_app_state": database.get_app_state,
     "set_app_state": database.set_app_state,
+    "get_app_state_versioned": database.get_app_state_versioned,
+    "patch_app_state": database.patch_app_state,
+    "run_retention": retention.run_retention,
 }
 
 
+def _summarize(value, max_chars: int):
+    """
+    產生參數的精簡版本以便記錄：過長的字串會被截斷，列表只保留前幾個元素。
+    """
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return f"{value[:max_chars]}…(+{len(value) - max_chars} 字元)"
+        return value
+    if isinstance(value, dict):
+        return {k: _summarize(v, max_chars) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        head = [_summarize(v, max_chars) for v in value[:3]]
+        if len(value) > 3:
+            head.append(f"…(共 {len(value)} 項)")
+        return head
+    return value
+
+
+def _should_sample(action: str) -> bool:
+    """依 action 的取樣率決定這次請求是否要記錄。"""
+    rate = REQUEST_LOG["per_action_sample_rate"].get(action, REQUEST_LOG["sample_rate"])
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _log_request(action: str, params: dict, status: str, request_size: int, response_size: int, duration_ms: float):
+    """
+    記錄一個已處理的請求。熱路徑上的成本只有一次等級檢查與一次取樣判斷，
+    參數摘要只在真的要輸出時才會產生。
+    """
+    if duration_ms >= REQUEST_LOG["slow_request_ms"]:
+        level = logging.WARNING
+    elif log.isEnabledFor(logging.DEBUG) and _should_sample(action):
+        level = logging.DEBUG
+    else:
+        return
+    log.log(
+        level,
+        "請求 action=%s status=%s req=%dB resp=%dB 耗時=%.1fms params=%s",
+        action, status, request_size, response_size, duration_ms,
+        _summarize(params, REQUEST_LOG["max_value_chars"]),
+    )
+
+
 class DBRequestHandler(socketserver.BaseRequestHandler):
     """
     處理來自客戶端請求的處理器。
     每個連線都會建立一個此類別的實例。
     """
     def handle(self):
-        log.info(f"來自 {self.client_address} 的新連線。")
+        # 客戶端每個請求都會建立一條新連線，因此連線事件只在 DEBUG 等級記錄
+        log.debug("來自 %s 的新連線。", self.client_address)
         try:
             while True:
                 # 接收資料的長度 (4-byte header)
@@ -79,13 +157,21 @@ class DBRequestHandler(socketserver.BaseRequestHandler):
 
                 data_len = int.from_bytes(header, 'big')
 
-                # 根據長度接收完整的資料
-                data = self.request.recv(data_len)
-                if not data:
-                    break
+                # 根據長度接收完整的資料 (批次日誌等大型請求可能分成多個封包抵達)
+                chunks = []
+                bytes_received = 0
+                while bytes_received < data_len:
+                    chunk = self.request.recv(min(data_len - bytes_received, 65536))
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    bytes_received += len(chunk)
+                if bytes_received < data_len:
+                    break # 連線在資料傳輸途中關閉
+                data = b"".join(chunks)
 
+                start_time = time.perf_counter()
                 request = json.loads(data.decode('utf-8'))
-                log.info(f"收到請求: {request}")
 
                 action = request.get("action")
                 params = request.get("params", {})
@@ -118,12 +204,17 @@ class DBRequestHandler(socketserver.BaseRequestHandler):
 
                 self.request.sendall(response_header + response_bytes)
 
+                _log_request(
+                    action, params, response["status"], data_len, len(response_bytes),
+                    (time.perf_counter() - start_time) * 1000,
+                )
+
         except ConnectionResetError:
             log.warning(f"客戶端 {self.client_address} 強制中斷了連線。")
         except Exception as e:
             log.error(f"處理連線 {self.client_address} 時發生未預期的錯誤: {e}", exc_info=True)
         finally:
-            log.info(f"連線 {self.client_address} 已關閉。")
+            log.debug("連線 %s 已關閉。", self.client_address)
 
 
 def run_server():
@@ -150,6 +241,9 @@ def run_server():
         # 在這種嚴重錯誤下，我們應該讓程序以非零代碼退出
         sys.exit(1)
 
+    # 啟動定期的資料保留 (retention) 執行緒，讓資料庫大小維持在有限範圍內
+    retention.start_retention_thread()
+
     # 建立 TCP 伺服器
     # 讓 server 在程式結束後可以立即重用同一個位址
     socketserver.TCPServer.allow_reuse_address = True
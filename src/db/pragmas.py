@@ -0,0 +1,94 @@
+# db/pragmas.py
+#
+# SQLite 效能設定檔 (PRAGMA profile)。
+#
+# `database.py` 每建立一個新連線都會套用一次所選的設定檔。設定檔名稱依序從
+# `DB_PRAGMA_PROFILE` 環境變數、config.json 的 `database.pragma_profile` 讀取，
+# 預設為 'balanced'。
+#
+# 三種設定檔的取捨 (皆使用 WAL 模式):
+#   - durable:  synchronous=FULL，每次交易提交都會 fsync，斷電也不遺失已提交的交易。
+#   - balanced: synchronous=NORMAL，只在檢查點 (checkpoint) 時 fsync。在 WAL 模式下
+#               資料庫不會損毀，但斷電時可能遺失最後幾筆交易。
+#   - fast:     synchronous=OFF，完全交給作業系統寫回，並放大快取與檢查點間隔。
+#               適合測試、基準測試或可重建的資料。
+import logging
+import os
+import sqlite3
+
+from db import config
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = "balanced"
+
+PRAGMA_PROFILES = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,          # 負值表示 KiB，約 8 MB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 10000,        # 毫秒
+        "wal_autocheckpoint": 1000,   # 頁
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+        "wal_autocheckpoint": 1000,
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+        "wal_autocheckpoint": 10000,
+    },
+}
+
+_active_profile = None
+
+
+def get_profile_name() -> str:
+    """
+    取得目前使用的設定檔名稱。結果會被快取，避免每次建立連線都讀取設定檔。
+    """
+    global _active_profile
+    if _active_profile is None:
+        name = os.environ.get("DB_PRAGMA_PROFILE") or config.get_section("database").get("pragma_profile")
+        name = (name or DEFAULT_PROFILE).lower()
+        if name not in PRAGMA_PROFILES:
+            log.warning(f"未知的 PRAGMA 設定檔 '{name}'，將改用 '{DEFAULT_PROFILE}'。")
+            name = DEFAULT_PROFILE
+        _active_profile = name
+        log.info(f"SQLite PRAGMA 設定檔: {name}")
+    return _active_profile
+
+
+def set_profile_name(name: str | None):
+    """覆寫 (或以 None 重設) 目前使用的設定檔，主要供基準測試使用。"""
+    global _active_profile
+    if name is not None and name not in PRAGMA_PROFILES:
+        raise ValueError(f"未知的 PRAGMA 設定檔: {name}")
+    _active_profile = name
+
+
+def apply_pragmas(conn: sqlite3.Connection, profile: str = None):
+    """
+    在一個新建立的連線上套用 PRAGMA 設定檔。
+    busy_timeout 最先設定，讓後續切換 journal_mode 時也能等待鎖。
+    """
+    settings = PRAGMA_PROFILES[profile or get_profile_name()]
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+    conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {int(settings['wal_autocheckpoint'])}")
@@ -0,0 +1,271 @@
+# db/retention.py
+#
+# 資料保留 (retention) 子系統。
+#
+# `tasks.db` 會持續累積已完成的任務與 `system_logs`。此模組依照 config.json 中
+# `retention` 區段設定的 TTL，將過期的資料列封存到壓縮的 JSONL 檔案，
+# 以小批次刪除（避免長時間持有寫入鎖），最後執行 `PRAGMA incremental_vacuum`
+# 將釋放的頁面歸還給檔案系統，讓資料庫大小維持在有限範圍內。
+#
+# 由 db/manager.py 在背景執行緒中定期呼叫，也可透過 `run_retention` action 手動觸發。
+import gzip
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from db import config, database
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIR = Path(__file__).parent / "archive"
+
+# 只有進入終止狀態的任務才會被清理，pending / processing 永遠不會被刪除
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+DEFAULT_RETENTION = {
+    "enabled": True,
+    "interval_seconds": 3600,
+    "batch_size": 500,
+    "batch_pause_seconds": 0.05,
+    "archive": True,
+    "vacuum_pages": 0,  # 0 表示釋放所有空閒頁面
+    "tasks": {
+        # TTL 以天為單位；未列出的狀態不會被清理
+        "by_status": {"completed": 30, "failed": 14, "cancelled": 7},
+        # 針對特定任務類型的 TTL，優先於 by_status
+        "by_type": {"download": 7},
+    },
+    "logs": {
+        "by_level": {"DEBUG": 1, "INFO": 7, "WARNING": 30, "ERROR": 90, "CRITICAL": 90},
+    },
+}
+
+
+def get_retention_config() -> dict:
+    """讀取 retention 設定並以預設值補齊。"""
+    return config.get_section("retention", DEFAULT_RETENTION)
+
+
+def _cutoff(days: float) -> str:
+    """將 TTL 天數轉換為 SQLite datetime() 的修飾字串。"""
+    return f"-{int(float(days) * 86400)} seconds"
+
+
+def archive_rows(kind: str, rows: list[dict], stamp: str):
+    """
+    將一批資料列以 JSONL 格式附加到壓縮封存檔 `ARCHIVE_DIR/<kind>-<stamp>.jsonl.gz`。
+    資料保留流程與日誌環形緩衝區 (database._archive_trimmed_logs) 共用。
+    """
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    archive_file = ARCHIVE_DIR / f"{kind}-{stamp}.jsonl.gz"
+    with gzip.open(archive_file, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+
+
+def _fail_orphaned_dependents(conn: sqlite3.Connection, parent_ids: list[str]):
+    """
+    在既有交易中，將依賴於「未成功完成而即將被清理」之任務的待處理任務標記為失敗。
+    父任務被刪除後依賴關係也會一併刪除，若不先處理，這些任務會失去阻擋條件而在缺少輸入的情況下執行。
+    (依賴已完成父任務的邊本來就已滿足，直接刪除即可。)
+    """
+    if not parent_ids:
+        return
+    placeholders = ",".join("?" * len(parent_ids))
+    dependents = [row["task_id"] for row in conn.execute(f"""
+        SELECT DISTINCT t.task_id FROM tasks AS t
+        JOIN task_dependencies AS d ON d.task_id = t.task_id
+        WHERE t.status = 'pending' AND d.depends_on IN ({placeholders})
+    """, parent_ids)]
+    if not dependents:
+        return
+    conn.executemany(
+        "UPDATE tasks SET status = 'failed', result = ? WHERE task_id = ? AND status = 'pending'",
+        [(json.dumps({"error": "上游任務未完成且已被清理，無法執行"}, ensure_ascii=False), t) for t in dependents]
+    )
+    log.warning(f"⚠️ {len(dependents)} 個待處理任務的上游任務已被清理，已標記為失敗: {', '.join(dependents)}")
+
+
+def _purge_in_batches(select_sql: str, params: list, table: str, kind: str, settings: dict, stamp: str) -> int:
+    """
+    以小批次的方式選取、刪除並封存過期資料列。
+    每個批次都是獨立的短交易，批次之間稍作停頓讓其他寫入者取得鎖。
+    封存在交易成功提交後才寫入，刪除失敗而回滾的資料列不會被重複封存。
+    """
+    batch_size = int(settings["batch_size"])
+    pause = float(settings["batch_pause_seconds"])
+    removed = 0
+
+    while True:
+        conn = database.get_db_connection()
+        if not conn:
+            break
+        try:
+            with conn:
+                rows = [dict(r) for r in conn.execute(f"{select_sql} LIMIT ?", (*params, batch_size)).fetchall()]
+                if not rows:
+                    break
+                ids = [row["id"] for row in rows]
+                placeholders = ",".join("?" * len(ids))
+                if table == "tasks":
+                    task_ids = [row["task_id"] for row in rows]
+                    conn.execute(
+                        f"DELETE FROM task_segments WHERE task_id IN ({','.join('?' * len(task_ids))})", task_ids
+                    )
+                    conn.execute(f"DELETE FROM transcripts_fts WHERE rowid IN ({placeholders})", ids)
+                    task_placeholders = ",".join("?" * len(task_ids))
+                    _fail_orphaned_dependents(conn, [row["task_id"] for row in rows if row["status"] != "completed"])
+                    conn.execute(
+                        f"DELETE FROM task_dependencies WHERE task_id IN ({task_placeholders}) "
+                        f"OR depends_on IN ({task_placeholders})", task_ids * 2
+                    )
+                conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+            removed += len(rows)
+            if settings["archive"]:
+                try:
+                    archive_rows(kind, rows, stamp)
+                except OSError as e:
+                    log.error(f"❌ 封存 {len(rows)} 筆已刪除的 {table} 資料列時發生錯誤: {e}", exc_info=True)
+                    break
+        except sqlite3.Error as e:
+            log.error(f"❌ 清理 {table} 過期資料時發生錯誤: {e}", exc_info=True)
+            break
+        finally:
+            conn.close()
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)
+    return removed
+
+
+def purge_expired_tasks(settings: dict, stamp: str) -> int:
+    """依狀態與類型的 TTL 清理已結束的任務。"""
+    by_status = settings["tasks"].get("by_status") or {}
+    by_type = settings["tasks"].get("by_type") or {}
+    terminal = list(TERMINAL_STATUSES)
+    removed = 0
+
+    # 1. 特定類型的 TTL 優先
+    for task_type, days in by_type.items():
+        if days is None:
+            continue
+        sql = (
+            f"SELECT * FROM tasks WHERE type = ? AND status IN ({','.join('?' * len(terminal))}) "
+            "AND updated_at <= datetime('now', ?) ORDER BY id"
+        )
+        removed += _purge_in_batches(sql, [task_type, *terminal, _cutoff(days)], "tasks", "tasks", settings, stamp)
+
+    # 2. 其餘任務依狀態的 TTL
+    excluded_types = [t for t, days in by_type.items() if days is not None]
+    for status, days in by_status.items():
+        if days is None or status not in TERMINAL_STATUSES:
+            continue
+        sql = "SELECT * FROM tasks WHERE status = ? AND updated_at <= datetime('now', ?)"
+        params = [status, _cutoff(days)]
+        if excluded_types:
+            sql += f" AND type NOT IN ({','.join('?' * len(excluded_types))})"
+            params.extend(excluded_types)
+        removed += _purge_in_batches(sql + " ORDER BY id", params, "tasks", "tasks", settings, stamp)
+    return removed
+
+
+def purge_expired_logs(settings: dict, stamp: str) -> int:
+    """依日誌等級的 TTL 清理 system_logs。"""
+    removed = 0
+    for level, days in (settings["logs"].get("by_level") or {}).items():
+        if days is None:
+            continue
+        sql = "SELECT * FROM system_logs WHERE level = ? AND timestamp <= datetime('now', ?) ORDER BY id"
+        removed += _purge_in_batches(sql, [level.upper(), _cutoff(days)], "system_logs", "logs", settings, stamp)
+    return removed
+
+
+def _purge_completion_buckets():
+    """task_completions 只用於計算最近的完成速率，保留一天即可。"""
+    conn = database.get_db_connection()
+    if not conn: return
+    try:
+        with conn:
+            conn.execute("DELETE FROM task_completions WHERE minute < strftime('%Y-%m-%d %H:%M', 'now', '-1 day')")
+    except sqlite3.Error as e:
+        log.error(f"❌ 清理 task_completions 時發生錯誤: {e}", exc_info=True)
+    finally:
+        conn.close()
+
+
+def incremental_vacuum(pages: int = 0) -> int:
+    """
+    執行 `PRAGMA incremental_vacuum`，將空閒頁面歸還給檔案系統。
+
+    :return: 執行前的空閒頁面數量。
+    """
+    conn = database.get_db_connection()
+    if not conn: return 0
+    try:
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if freelist:
+            pragma = f"PRAGMA incremental_vacuum({int(pages)})" if pages else "PRAGMA incremental_vacuum"
+            # incremental_vacuum 的每一列結果對應一個被釋放的頁面，必須全部讀取才會執行完畢
+            conn.execute(pragma).fetchall()
+        return freelist
+    except sqlite3.Error as e:
+        log.error(f"❌ 執行 incremental_vacuum 時發生錯誤: {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
+
+
+def run_retention(settings: dict = None) -> dict:
+    """
+    執行一次完整的保留流程：清理任務、清理日誌、回收空間。
+
+    :return: 包含本次清理統計資訊的字典。
+    """
+    settings = settings or get_retention_config()
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    start_time = time.time()
+
+    tasks_removed = purge_expired_tasks(settings, stamp)
+    logs_removed = purge_expired_logs(settings, stamp)
+    _purge_completion_buckets()
+    freed_pages = incremental_vacuum(settings["vacuum_pages"]) if (tasks_removed or logs_removed) else 0
+
+    stats = {
+        "tasks_removed": tasks_removed,
+        "logs_removed": logs_removed,
+        "freed_pages": freed_pages,
+        "duration_seconds": round(time.time() - start_time, 3),
+    }
+    log.info(f"🧹 資料保留流程完成: {stats}")
+    return stats
+
+
+def start_retention_thread(stop_event: threading.Event = None) -> threading.Thread | None:
+    """
+    啟動一個定期執行保留流程的背景執行緒。
+    若設定中停用了保留功能，則不啟動並回傳 None。
+    """
+    settings = get_retention_config()
+    if not settings["enabled"]:
+        log.info("資料保留功能已停用。")
+        return None
+
+    stop_event = stop_event or threading.Event()
+    interval = float(settings["interval_seconds"])
+
+    def _loop():
+        while not stop_event.wait(interval):
+            try:
+                run_retention(get_retention_config())
+            except Exception as e:
+                log.error(f"❌ 資料保留執行緒發生錯誤: {e}", exc_info=True)
+
+    thread = threading.Thread(target=_loop, name="retention", daemon=True)
+    thread.start()
+    log.info(f"🧹 資料保留執行緒已啟動 (間隔: {interval} 秒)。")
+    return thread
@@ -141,9 +141,12 @@ def process_transcription_task(task: dict, use_mock: bool):
                 progress_data = json.loads(line)
                 progress = progress_data.get("progress")
                 text = progress_data.get("text")
-                if progress is not None:
+                if progress_data.get("type") == "segment":
+                    # 逐段附加到 task_segments，寫入量只與新片段大小成正比
+                    db_client.append_task_segments(task_id, [progress_data])
+                elif progress is not None:
                     log.info(f"📈 任務 {task_id} 進度: {progress}% - {text[:30]}...")
-                    db_client.update_task_progress(task_id, progress, text)
+                    db_client.update_task_progress(task_id, progress, text, is_segment=True)
             except json.JSONDecodeError:
                 # 不是 JSON 格式的日誌，直接印出
                 log.info(f"[工具 stdout] {line.strip()}")
@@ -201,6 +204,7 @@ def process_task(task: dict, use_mock: bool):
     根據任務類型分派到不同的處理函式。
     """
     task_type = task.get('type', 'transcribe') # 預設為舊的轉錄任務
+    start_time = time.monotonic()
     if task_type == 'download':
         process_download_task(task, use_mock)
     elif task_type == 'transcribe':
@@ -208,6 +212,13 @@ def process_task(task: dict, use_mock: bool):
     else:
         log.error(f"❌ 未知的任務類型: '{task_type}' (Task ID: {task['task_id']})")
         db_client.update_task_status(task['task_id'], 'failed', json.dumps({"error": f"未知的任務類型: {task_type}"}))
+        return
+    # 以結構化欄位記錄階段耗時，可透過 /api/logs/stages 在 SQL 中彙總
+    duration_ms = (time.monotonic() - start_time) * 1000
+    log.info(
+        f"⏱️ 任務 {task['task_id']} 的 '{task_type}' 階段耗時: {duration_ms / 1000:.1f} 秒",
+        extra={"task_id": task['task_id'], "stage": task_type, "duration_ms": duration_ms}
+    )
 
 def main_loop(use_mock: bool, poll_interval: int):
     """
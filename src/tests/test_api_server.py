@@ -89,3 +89,152 @@ def test_serve_media_file_success(server, temporary_media_file):
     # Assert that the content is what we expect (the dummy file content)
     source_content = (ROOT_DIR / "src" / "tests" / "fixtures" / "test_audio.mp3").read_bytes()
     assert response.content == source_content
+
+
+def test_log_event_stream_resumes_from_cursor(mocker):
+    """
+    測試日誌串流每輪都以最後送出的 id 作為 since_id 游標，並以 SSE 格式輸出。
+    """
+    import asyncio
+    import json
+    from unittest.mock import MagicMock
+    from api import api_server
+
+    batches = [
+        [{"id": 5, "source": "worker", "level": "INFO", "message": "a"},
+         {"id": 6, "source": "worker", "level": "INFO", "message": "b"}],
+        [],
+        [{"id": 9, "source": "worker", "level": "ERROR", "message": "c"}],
+    ]
+    mock_client = mocker.patch.object(api_server, "db_client")
+    mock_client.get_system_logs.side_effect = batches
+    mocker.patch.object(api_server, "LOG_STREAM_POLL_INTERVAL", 0)
+
+    request = MagicMock()
+    disconnected = iter([False, False, False, True])
+    async def is_disconnected():
+        return next(disconnected)
+    request.is_disconnected = is_disconnected
+
+    filters = {"levels": ["INFO", "ERROR"], "sources": ["worker"], "task_id": None}
+
+    async def collect():
+        return [chunk async for chunk in api_server._log_event_stream(request, filters, 4)]
+
+    chunks = asyncio.run(collect())
+
+    assert chunks[0].startswith("retry:")
+    events = [c for c in chunks if c.startswith("id:")]
+    assert [json.loads(e.split("data: ", 1)[1])["message"] for e in events] == ["a", "b", "c"]
+    assert events[0].startswith("id: 5\nevent: log\n")
+    cursors = [c.kwargs["since_id"] for c in mock_client.get_system_logs.call_args_list]
+    assert cursors == [4, 6, 6]
+    assert mock_client.get_system_logs.call_args.kwargs["levels"] == ["INFO", "ERROR"]
+
+
+def test_store_upload_is_content_addressed(mocker, tmp_path):
+    """
+    測試上傳檔案以 SHA-256 內容定址儲存：相同內容只保存一份，且不會留下暫存檔。
+    """
+    import hashlib
+    import io
+    from api import api_server
+
+    mocker.patch.object(api_server, "BLOBS_DIR", tmp_path / "blobs")
+    mocker.patch.object(api_server, "UPLOAD_CHUNK_SIZE", 4)
+    data = b"phoenix audio bytes"
+
+    first_path, first_hash = api_server._store_upload(io.BytesIO(data), ".MP3")
+    second_path, second_hash = api_server._store_upload(io.BytesIO(data), ".mp3")
+
+    assert first_hash == second_hash == hashlib.sha256(data).hexdigest()
+    assert first_path == second_path == tmp_path / "blobs" / f"{first_hash}.mp3"
+    assert first_path.read_bytes() == data
+    assert list((tmp_path / "blobs").iterdir()) == [first_path]
+
+
+def test_resumable_chunked_upload(server, mocker, tmp_path):
+    """
+    測試分段上傳：依 offset 附加分段、offset 不符時回傳 409 與正確位置、
+    finalize 後檔案移入內容定址儲存區並建立任務。
+    """
+    import hashlib
+    from api import api_server
+
+    mocker.patch.object(api_server, "INCOMING_DIR", tmp_path / "incoming")
+    mocker.patch.object(api_server, "BLOBS_DIR", tmp_path / "blobs")
+    # 讓一個分段跨越多次執行緒寫入
+    mocker.patch.object(api_server, "UPLOAD_CHUNK_SIZE", 64)
+    create_tasks = mocker.patch.object(
+        api_server, "create_transcription_tasks_for_file",
+        return_value={"task_id": "t-1", "type": "transcribe", "status": "pending"}
+    )
+    data = b"0123456789" * 100
+
+    invalid = requests.post(f"{BASE_URL}/api/uploads", json={"filename": "long.MP3", "beam_size": "wide"})
+    assert invalid.status_code == 400
+
+    response = requests.post(f"{BASE_URL}/api/uploads", json={"filename": "long.MP3", "size": len(data), "model_size": "tiny"})
+    assert response.status_code == 200
+    upload_id = response.json()["upload_id"]
+    upload_url = f"{BASE_URL}/api/uploads/{upload_id}"
+
+    assert requests.put(f"{upload_url}?offset=0", data=data[:400]).json()["offset"] == 400
+    # 重送已收到的分段 (例如回應遺失) 不會重複寫入
+    conflict = requests.put(f"{upload_url}?offset=0", data=data[:400])
+    assert conflict.status_code == 409
+    assert conflict.json()["offset"] == 400
+    # 尚未收齊時不能 finalize
+    assert requests.post(f"{upload_url}/finalize").status_code == 409
+    assert requests.get(upload_url).json()["offset"] == 400
+
+    assert requests.put(f"{upload_url}?offset=400", data=data[400:]).json()["offset"] == len(data)
+    response = requests.post(f"{upload_url}/finalize")
+    assert response.status_code == 200
+    assert response.json()["task_id"] == "t-1"
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    blob_path = tmp_path / "blobs" / f"{content_hash}.mp3"
+    assert blob_path.read_bytes() == data
+    assert list((tmp_path / "incoming").iterdir()) == []
+    args = create_tasks.call_args.args
+    assert args[1:5] == (blob_path, content_hash, "long.MP3", "tiny")
+    # 完成後上傳即不存在
+    assert requests.get(upload_url).status_code == 404
+    assert requests.get(f"{BASE_URL}/api/uploads/not-an-id").status_code == 404
+
+
+def test_serve_media_file_supports_range_and_etag(server, temporary_media_file):
+    """
+    測試 /media 的快取與部分下載：Range 請求回傳 206 與指定的位元組，
+    帶回 ETag 的 If-None-Match 請求回傳 304 且不含內容。
+    """
+    file_url = f"{BASE_URL}/media/test_audio.mp3"
+    source_content = temporary_media_file.read_bytes()
+
+    full = requests.get(file_url)
+    etag = full.headers["ETag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+    assert full.headers["Accept-Ranges"] == "bytes"
+    assert full.headers["Cache-Control"] == "no-cache"
+
+    partial = requests.get(file_url, headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.headers["Content-Range"] == f"bytes 10-19/{len(source_content)}"
+    assert partial.content == source_content[10:20]
+
+    not_modified = requests.get(file_url, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+
+    # 內容定址的檔案以內容雜湊作為 ETag，並可長期快取
+    from api import api_server
+    with open(temporary_media_file, "rb") as source:
+        blob_path, content_hash = api_server._store_upload(source, ".mp3")
+    try:
+        blob = requests.get(f"{BASE_URL}/media/blobs/{blob_path.name}")
+        assert blob.headers["ETag"] == f'"{content_hash}"'
+        assert "immutable" in blob.headers["Cache-Control"]
+    finally:
+        blob_path.unlink()
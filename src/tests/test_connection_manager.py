@@ -0,0 +1,115 @@
+# tests/test_connection_manager.py
+import asyncio
+import json
+
+from api.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """記錄收到的訊息；`stalled` 為 True 時 send_text 會一直卡住，模擬緩慢的瀏覽器。"""
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+        if not stalled:
+            self.release.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_broadcast_is_not_blocked_by_stalled_client():
+    """
+    測試卡住的用戶端不會延遲其他連線，且其佇列滿載時只保留最新的訊息。
+    """
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, overflow_policy="drop_oldest")
+        fast, stalled = FakeWebSocket(), FakeWebSocket(stalled=True)
+        await manager.connect(fast)
+        await manager.connect(stalled)
+
+        for i in range(5):
+            await asyncio.wait_for(manager.broadcast_json({"type": "TICK", "payload": i}), timeout=0.1)
+        await asyncio.sleep(0)
+
+        assert [json.loads(m)["payload"] for m in fast.sent] == [0, 1, 2, 3, 4]
+        # 卡住的連線：第一則已由發送任務取出 (卡在 send)，佇列中只留下最新的兩則
+        stalled.release.set()
+        await asyncio.sleep(0.01)
+        assert [json.loads(m)["payload"] for m in stalled.sent] == [0, 3, 4]
+        assert manager.stats()["clients"][1]["dropped"] == 2
+        await manager.close_all()
+
+    asyncio.run(scenario())
+
+
+def test_overflow_disconnect_policy_removes_client():
+    """
+    測試 disconnect 策略：佇列滿載的連線會被移除並以 1013 關閉，其他連線不受影響。
+    """
+    async def scenario():
+        manager = ConnectionManager(queue_size=1, overflow_policy="disconnect")
+        fast, stalled = FakeWebSocket(), FakeWebSocket(stalled=True)
+        await manager.connect(fast)
+        await manager.connect(stalled)
+
+        for i in range(3):
+            await manager.broadcast_json({"type": "TICK", "payload": i})
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+
+        assert manager.active_connections == [fast]
+        assert stalled.closed_with == 1013
+        assert len(fast.sent) == 3
+        await manager.close_all()
+        assert manager.active_connections == []
+
+    asyncio.run(scenario())
+
+
+def test_subscriptions_route_messages_by_topic():
+    """
+    測試訂閱後只會收到訂閱的任務與事件類型，未訂閱的連線仍收到全部訊息。
+    """
+    async def scenario():
+        manager = ConnectionManager(queue_size=10)
+        watcher, dashboard = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(watcher)
+        await manager.connect(dashboard)
+
+        manager.subscribe(watcher, task_ids=["task-a"], events=["DOWNLOAD_STATUS"])
+        await manager.broadcast_json({"type": "TRANSCRIPTION_UPDATE", "payload": {"task_id": "task-a", "text": "a"}})
+        await manager.broadcast_json({"type": "TRANSCRIPTION_UPDATE", "payload": {"task_id": "task-b", "text": "b"}})
+        await manager.broadcast_json({"type": "DOWNLOAD_STATUS", "payload": {"model": "tiny"}})
+        await manager.broadcast_json({"type": "SYSTEM_STATS", "payload": {}})
+        assert manager.has_recipients("SYSTEM_STATS")
+
+        # 後續任務會自動加入父任務訂閱者的主題
+        manager.follow_task("task-a", "task-a2")
+        await manager.broadcast_json({"type": "YOUTUBE_STATUS", "payload": {"task_id": "task-a2"}})
+
+        manager.unsubscribe(watcher, task_ids=["task-a", "task-a2"])
+        await manager.broadcast_json({"type": "TRANSCRIPTION_UPDATE", "payload": {"task_id": "task-a", "text": "late"}})
+        await asyncio.sleep(0.01)
+
+        received = [json.loads(m) for m in watcher.sent]
+        assert [(m["type"], m["payload"].get("task_id")) for m in received] == [
+            ("TRANSCRIPTION_UPDATE", "task-a"), ("DOWNLOAD_STATUS", None), ("YOUTUBE_STATUS", "task-a2"),
+        ]
+        assert len(dashboard.sent) == 6
+        assert manager.subscriptions(watcher) == {"all": False, "task_ids": [], "events": ["DOWNLOAD_STATUS"]}
+
+        manager.subscribe(dashboard, events=["DOWNLOAD_STATUS"])
+        assert not manager.has_recipients("SYSTEM_STATS")
+        manager.disconnect(watcher)
+        assert manager._event_index == {"DOWNLOAD_STATUS": {manager._clients[dashboard]}}
+        await manager.close_all()
+
+    asyncio.run(scenario())
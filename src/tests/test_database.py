@@ -0,0 +1,399 @@
+# tests/test_database.py
+import pytest
+import json
+
+from db import database
+
+
+@pytest.fixture
+def temp_db(mocker, tmp_path):
+    """
+    一個將 database 模組指向暫存檔案的 fixture。
+    每個測試都會得到一個全新、已初始化的 tasks.db。
+    """
+    mocker.patch('db.database.DB_FILE', tmp_path / "tasks.db")
+    database.initialize_database()
+    yield database
+
+
+def test_task_segments_append_and_resume(temp_db):
+    """
+    測試片段會依序附加，且客戶端可以從指定序號之後續讀。
+    """
+    task_id = "segment-task-1"
+    assert temp_db.add_task(task_id, json.dumps({}))
+
+    last_seq = temp_db.append_task_segments(task_id, [
+        {"start": 0.0, "end": 1.5, "text": "第一句"},
+        {"start": 1.5, "end": 3.0, "text": "第二句"},
+    ], progress=10)
+    assert last_seq == 2
+
+    # 舊介面仍然可用，並且會以附加的方式寫入
+    temp_db.update_task_progress(task_id, 20, "第三句", is_segment=True)
+    # 一般的進度訊息 (例如模型下載日誌) 只更新進度，不會成為片段
+    temp_db.update_task_progress(task_id, 20, "正在下載模型...")
+
+    all_segments = temp_db.get_task_segments(task_id)
+    assert [s["seq"] for s in all_segments] == [1, 2, 3]
+    assert all_segments[1] == {"seq": 2, "start": 1.5, "end": 3.0, "text": "第二句"}
+
+    resumed = temp_db.get_task_segments(task_id, after_seq=2)
+    assert [s["text"] for s in resumed] == ["第三句"]
+
+    task = temp_db.get_task_status(task_id)
+    assert task["progress"] == 20
+    # 進度更新不應再重寫整份結果
+    assert task["result"] is None
+
+
+def test_retention_archives_and_purges_expired_rows(temp_db, mocker, tmp_path):
+    """
+    測試保留流程只會清理已結束且過期的任務與日誌，並將其封存為壓縮 JSONL。
+    """
+    import gzip
+    from db import retention
+
+    mocker.patch('db.retention.ARCHIVE_DIR', tmp_path / "archive")
+
+    temp_db.add_task("done-task", json.dumps({}))
+    temp_db.update_task_status("done-task", "completed", json.dumps({"transcript": "x"}))
+    temp_db.append_task_segments("done-task", [{"text": "x"}])
+    temp_db.add_task("pending-task", json.dumps({}))
+    temp_db.add_system_log("test", "DEBUG", "debug message")
+    temp_db.add_system_log("test", "ERROR", "error message")
+
+    settings = retention.get_retention_config()
+    settings["batch_size"] = 1
+    settings["tasks"] = {"by_status": {"completed": 0}, "by_type": {}}
+    settings["logs"] = {"by_level": {"DEBUG": 0}}
+
+    stats = retention.run_retention(settings)
+
+    assert stats["tasks_removed"] == 1
+    assert stats["logs_removed"] == 1
+    assert temp_db.get_task_status("done-task") is None
+    assert temp_db.get_task_segments("done-task") == []
+    assert temp_db.get_task_status("pending-task") is not None
+    assert [l["level"] for l in temp_db.get_system_logs_by_filter()] == ["ERROR"]
+
+    archive_files = sorted((tmp_path / "archive").glob("tasks-*.jsonl.gz"))
+    assert len(archive_files) == 1
+    with gzip.open(archive_files[0], "rt", encoding="utf-8") as f:
+        archived = [json.loads(line) for line in f]
+    assert archived[0]["task_id"] == "done-task"
+
+
+def test_retention_does_not_archive_rows_when_delete_fails(temp_db, mocker, tmp_path):
+    """
+    測試封存在刪除成功提交後才寫入：刪除失敗回滾時不會留下封存，下次執行不會重複封存。
+    """
+    import sqlite3
+    from db import retention
+
+    mocker.patch('db.retention.ARCHIVE_DIR', tmp_path / "archive")
+    temp_db.add_task("done-task", json.dumps({}))
+    temp_db.update_task_status("done-task", "completed", json.dumps({"transcript": "x"}))
+
+    settings = retention.get_retention_config()
+    settings["tasks"] = {"by_status": {"completed": 0}, "by_type": {}}
+    settings["logs"] = {"by_level": {}}
+
+    # 第一次執行時交易中途失敗，第二次正常
+    mocker.patch('db.retention._fail_orphaned_dependents', side_effect=[sqlite3.OperationalError("database is locked"), None])
+    assert retention.run_retention(settings)["tasks_removed"] == 0
+    assert temp_db.get_task_status("done-task") is not None
+    assert not (tmp_path / "archive").exists()
+
+    assert retention.run_retention(settings)["tasks_removed"] == 1
+    assert len(list((tmp_path / "archive").glob("tasks-*.jsonl.gz"))) == 1
+
+
+def test_purging_failed_parent_does_not_release_pending_child(temp_db, mocker, tmp_path):
+    """
+    測試清理失敗的父任務後，依賴它的待處理任務不會被 worker 取走，而是被標記為失敗。
+    """
+    from db import retention
+
+    mocker.patch('db.retention.ARCHIVE_DIR', tmp_path / "archive")
+
+    temp_db.add_task("download", json.dumps({}), task_type="download")
+    temp_db.add_task("process", json.dumps({}), task_type="gemini_process", depends_on="download")
+    temp_db.update_task_status("download", "failed", json.dumps({"error": "boom"}))
+
+    settings = retention.get_retention_config()
+    settings["tasks"] = {"by_status": {"failed": 0}, "by_type": {}}
+    settings["logs"] = {"by_level": {}}
+    retention.run_retention(settings)
+
+    assert temp_db.get_task_status("download") is None
+    assert temp_db.fetch_and_lock_task() is None
+    assert temp_db.get_task_status("process")["status"] == "failed"
+
+
+def test_search_transcripts_ranks_completed_tasks(temp_db):
+    """
+    測試任務完成時會被加入全文檢索索引，並能以長詞與短詞搜尋。
+    """
+    temp_db.add_task("whisper-task", json.dumps({"original_filename": "meeting.mp3"}))
+    temp_db.update_task_status("whisper-task", "completed", json.dumps({"transcript": "今天的會議討論鳳凰專案的預算"}))
+    temp_db.add_task("gemini-task", json.dumps({}), task_type="gemini_process")
+    temp_db.update_task_status("gemini-task", "completed", json.dumps({
+        "video_title": "年度回顧", "summary": "鳳凰專案今年的成果", "transcript": "逐字稿內容"
+    }))
+    temp_db.add_task("failed-task", json.dumps({}))
+    temp_db.update_task_status("failed-task", "failed", json.dumps({"transcript": "鳳凰專案"}))
+
+    results = temp_db.search_transcripts("鳳凰專案")
+    assert {r["task_id"] for r in results} == {"whisper-task", "gemini-task"}
+    assert all("<b>" in r["snippet"] for r in results)
+
+    short = temp_db.search_transcripts("預算")
+    assert [r["task_id"] for r in short] == ["whisper-task"]
+    assert "<b>預算</b>" in short[0]["snippet"]
+    assert short[0]["title"] == "meeting.mp3"
+
+
+def test_system_logs_cursor_and_latest_mode(temp_db):
+    """
+    測試 since_id 游標、limit 與「最新 N 筆」查詢模式。
+    """
+    for i in range(5):
+        temp_db.add_system_log("frontend_action", "INFO", f"action {i}")
+    temp_db.add_system_log("api_server", "ERROR", "boom")
+
+    first_page = temp_db.get_system_logs_by_filter(sources=["frontend_action"], limit=2)
+    assert [l["message"] for l in first_page] == ["action 0", "action 1"]
+
+    next_page = temp_db.get_system_logs_by_filter(sources=["frontend_action"], since_id=first_page[-1]["id"])
+    assert [l["message"] for l in next_page] == ["action 2", "action 3", "action 4"]
+
+    latest = temp_db.get_system_logs_by_filter(sources=["frontend_action"], limit=1, latest=True)
+    assert [l["message"] for l in latest] == ["action 4"]
+
+    assert temp_db.get_system_logs_by_filter(levels=["error"], until="1970-01-01 00:00:00") == []
+
+
+def test_pragma_profile_is_applied_per_connection(temp_db, mocker):
+    """
+    測試 get_db_connection 會套用所選的 PRAGMA 設定檔。
+    """
+    from db import pragmas
+
+    mocker.patch('db.pragmas._active_profile', "fast")
+    conn = temp_db.get_db_connection()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0  # OFF
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == pragmas.PRAGMA_PROFILES["fast"]["busy_timeout"]
+    finally:
+        conn.close()
+
+
+def test_multi_parent_task_waits_for_all_parents(temp_db):
+    """
+    測試 fan-out / fan-in：合併任務只有在所有父任務完成後才會被取出。
+    """
+    temp_db.add_task("chunk-1", json.dumps({}))
+    temp_db.add_task("chunk-2", json.dumps({}))
+    temp_db.add_task("merge", json.dumps({}), task_type="merge", depends_on=["chunk-1", "chunk-2"])
+
+    assert sorted(temp_db.find_dependent_tasks("chunk-1")) == ["merge"]
+    assert [d["task_id"] for d in temp_db.get_task_dependencies("merge")] == ["chunk-1", "chunk-2"]
+
+    first = temp_db.fetch_and_lock_task()
+    second = temp_db.fetch_and_lock_task()
+    assert {first["task_id"], second["task_id"]} == {"chunk-1", "chunk-2"}
+
+    temp_db.update_task_status("chunk-1", "completed", json.dumps({}))
+    assert temp_db.fetch_and_lock_task() is None
+
+    temp_db.update_task_status("chunk-2", "completed", json.dumps({}))
+    assert temp_db.fetch_and_lock_task()["task_id"] == "merge"
+
+
+def test_queue_stats_follow_status_transitions(temp_db):
+    """
+    測試佇列計數器會隨著新增、狀態轉換與刪除正確更新。
+    """
+    temp_db.add_task("t1", json.dumps({}))
+    temp_db.add_task("t2", json.dumps({}), task_type="download")
+    assert temp_db.are_tasks_active()
+
+    stats = temp_db.get_queue_stats()
+    assert stats["by_status"] == {"pending": 2}
+    assert stats["by_type"] == {"transcribe": 1, "download": 1}
+    assert stats["oldest_pending_age_seconds"] is not None
+
+    temp_db.fetch_and_lock_task()
+    temp_db.update_task_status("t1", "completed", json.dumps({}))
+    temp_db.update_task_status("t1", "completed", json.dumps({}))  # 重複更新不應重複計數
+    temp_db.update_task_status("t2", "failed", json.dumps({}))
+
+    stats = temp_db.get_queue_stats(window_minutes=1)
+    assert stats["by_status"] == {"completed": 1, "failed": 1}
+    assert stats["oldest_pending_age_seconds"] is None
+    assert stats["completions_per_minute"] == 1
+    assert not temp_db.are_tasks_active()
+
+
+def test_app_state_versioning_and_merge_patch(temp_db):
+    """
+    測試 app_state 的版本號、JSON Merge Patch 與樂觀並行控制。
+    """
+    # 尚無狀態時目前版本為 0，客戶端以 GET 取得的 ETag "0" 可以建立狀態
+    assert temp_db.set_app_state("ui_settings", json.dumps({}), expected_version=1) == {"status": "conflict", "version": 0}
+    result = temp_db.set_app_state("ui_settings", json.dumps({"theme": "dark", "tab": "mp3"}), expected_version=0)
+    assert result == {"status": "success", "version": 1}
+    entry = temp_db.get_app_state_versioned("ui_settings")
+    assert entry["version"] == 1
+
+    result = temp_db.patch_app_state("ui_settings", {"tab": "youtube", "theme": None}, expected_version=1)
+    assert result["status"] == "success"
+    assert result["version"] == 2
+    assert json.loads(temp_db.get_app_state("ui_settings")) == {"tab": "youtube"}
+
+    stale = temp_db.patch_app_state("ui_settings", {"tab": "logs"}, expected_version=1)
+    assert stale == {"status": "conflict", "version": 2}
+    assert json.loads(temp_db.get_app_state("ui_settings")) == {"tab": "youtube"}
+
+
+def test_memory_backend_keeps_data_without_touching_disk(mocker, tmp_path):
+    """
+    測試記憶體後端：資料在多個連線之間共享、不同路徑彼此隔離，且不會建立任何檔案。
+    """
+    from db import backends
+
+    mocker.patch('db.backends._active_backend', backends.SQLiteMemoryBackend())
+    db_a = tmp_path / "a" / "tasks.db"
+    db_b = tmp_path / "b" / "tasks.db"
+    try:
+        mocker.patch('db.database.DB_FILE', db_a)
+        database.initialize_database()
+        database.add_task("mem-task", json.dumps({}))
+        database.update_task_status("mem-task", "completed", json.dumps({"transcript": "記憶體中的逐字稿"}))
+        assert database.get_task_status("mem-task")["status"] == "completed"
+        assert [r["task_id"] for r in database.search_transcripts("逐字稿")] == ["mem-task"]
+
+        mocker.patch('db.database.DB_FILE', db_b)
+        database.initialize_database()
+        assert database.get_task_status("mem-task") is None
+
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        backends._active_backend.reset()
+
+
+def test_system_logs_ring_buffer_trims_per_source(temp_db, mocker, tmp_path):
+    """
+    測試環形緩衝區：超過上限的來源會刪除最舊的日誌直到低水位，其他來源不受影響，
+    且被修剪的日誌會被封存。
+    """
+    import gzip
+
+    mocker.patch('db.retention.ARCHIVE_DIR', tmp_path / "archive")
+    mocker.patch('db.database._log_ring_settings', {
+        **temp_db.DEFAULT_LOG_RING,
+        "max_rows": 0,
+        "low_watermark": 0.5,
+        "archive": True,
+        "per_source": {"frontend_action": {"max_rows": 10}},
+    })
+
+    temp_db.add_system_logs_batch([{"source": "frontend_action", "level": "INFO", "message": f"click {i}"} for i in range(10)])
+    temp_db.add_system_log("api_server", "INFO", "unbounded")
+    assert len(temp_db.get_system_logs_by_filter(sources=["frontend_action"])) == 10
+
+    temp_db.add_system_log("frontend_action", "INFO", "click 10")
+
+    remaining = temp_db.get_system_logs_by_filter(sources=["frontend_action"])
+    assert [l["message"] for l in remaining] == [f"click {i}" for i in range(6, 11)]
+    assert len(temp_db.get_system_logs_by_filter(sources=["api_server"])) == 1
+
+    archive_files = list((tmp_path / "archive").glob("logs-ring-frontend_action-*.jsonl.gz"))
+    assert len(archive_files) == 1
+    with gzip.open(archive_files[0], "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["message"] for line in f] == [f"click {i}" for i in range(6)]
+
+
+def test_system_logs_ring_archives_after_commit(temp_db, mocker, tmp_path):
+    """
+    測試環形緩衝區的封存在交易提交後才寫入：每筆被修剪的日誌只封存一次，
+    封存失敗 (例如磁碟已滿) 時日誌仍然會被寫入。
+    """
+    import gzip
+    from db import retention
+
+    mocker.patch('db.retention.ARCHIVE_DIR', tmp_path / "archive")
+    mocker.patch('db.database._log_ring_settings', {
+        **temp_db.DEFAULT_LOG_RING,
+        "max_rows": 2,
+        "max_bytes": 0,
+        "low_watermark": 0.5,
+        "archive": True,
+        "per_source": {},
+    })
+
+    for i in range(6):
+        assert temp_db.add_system_log("worker", "INFO", f"line {i}")
+    assert temp_db.add_system_logs_batch([{"source": "worker", "level": "INFO", "message": f"line {i}"} for i in (6, 7)]) == 2
+
+    remaining = [l["message"] for l in temp_db.get_system_logs_by_filter(sources=["worker"])]
+    archive_files = list((tmp_path / "archive").glob("logs-ring-worker-*.jsonl.gz"))
+    assert len(archive_files) == 1
+    with gzip.open(archive_files[0], "rt", encoding="utf-8") as f:
+        archived = [json.loads(line)["message"] for line in f]
+    # 每筆日誌不是仍在資料庫中就是恰好被封存一次
+    assert sorted(archived + remaining, key=lambda m: int(m.split()[1])) == [f"line {i}" for i in range(8)]
+    assert len(set(archived)) == len(archived)
+
+    mocker.patch.object(retention, "archive_rows", side_effect=OSError("No space left on device"))
+    assert temp_db.add_system_log("worker", "INFO", "line 8")
+    assert temp_db.get_system_logs_by_filter(sources=["worker"])[-1]["message"] == "line 8"
+    assert temp_db.add_system_logs_batch([{"source": "worker", "level": "INFO", "message": "line 9"}]) == 1
+    assert temp_db.get_system_logs_by_filter(sources=["worker"])[-1]["message"] == "line 9"
+
+
+def test_cancel_task_cascades_to_pending_dependents(temp_db):
+    """
+    測試取消任務會連帶取消所有 (間接) 依賴它的待處理任務，但不影響已結束或無關的任務。
+    """
+    temp_db.add_task("download", json.dumps({}), task_type="download")
+    temp_db.add_task("process", json.dumps({}), task_type="gemini_process", depends_on="download")
+    temp_db.add_task("report", json.dumps({}), task_type="report", depends_on="process")
+    temp_db.add_task("other", json.dumps({}))
+
+    assert temp_db.cancel_task("download", reason="測試取消") == ["download", "process", "report"]
+
+    for task_id in ("download", "process", "report"):
+        task = temp_db.get_task_status(task_id)
+        assert task["status"] == "cancelled"
+        assert json.loads(task["result"]) == {"error": "測試取消", "cancelled_by": "download"}
+    assert temp_db.get_task_status("other")["status"] == "pending"
+    assert temp_db.get_queue_stats()["by_status"] == {"cancelled": 3, "pending": 1}
+    # 已結束的任務無法再取消
+    assert temp_db.cancel_task("download") == []
+    # 取消後仍在收尾的背景工作無法把狀態改回 completed
+    assert not temp_db.update_task_status("download", "completed", json.dumps({"output_path": "x"}))
+    assert temp_db.get_task_status("download")["status"] == "cancelled"
+    assert temp_db.fetch_and_lock_task()["task_id"] == "other"
+
+
+def test_add_task_from_completed_reuses_matching_result(temp_db):
+    """
+    測試內容去重：只有相同 dedup_key 且已完成的任務會被重用，新任務直接以已完成狀態建立。
+    """
+    key = "transcribe:abc123:tiny:auto:5"
+    temp_db.add_task("original", json.dumps({}), dedup_key=key)
+    assert temp_db.add_task_from_completed("early-copy", json.dumps({}), key) is None
+    assert temp_db.get_task_status("early-copy") is None
+
+    temp_db.update_task_status("original", "completed", json.dumps({"transcript": "重複的鳳凰音訊"}))
+    assert temp_db.add_task_from_completed("copy", json.dumps({"original_filename": "b.mp3"}), key) == "original"
+    assert temp_db.add_task_from_completed("other", json.dumps({}), "transcribe:abc123:base:auto:5") is None
+
+    copy = temp_db.get_task_status("copy")
+    assert copy["status"] == "completed"
+    assert json.loads(copy["result"]) == {"transcript": "重複的鳳凰音訊", "deduplicated_from": "original"}
+    assert temp_db.fetch_and_lock_task() is None
+    assert {r["task_id"] for r in temp_db.search_transcripts("鳳凰音訊")} == {"original", "copy"}
@@ -0,0 +1,45 @@
+# tests/test_db_manager.py
+import logging
+
+from db import manager
+
+
+def test_summarize_truncates_long_payloads():
+    """
+    測試請求參數摘要會截斷長字串並縮短長列表，避免將整份逐字稿寫入日誌。
+    """
+    params = {
+        "task_id": "t1",
+        "result": "字" * 500,
+        "segments": [{"text": "a"}] * 10,
+    }
+    summary = manager._summarize(params, 20)
+
+    assert summary["task_id"] == "t1"
+    assert summary["result"].startswith("字" * 20)
+    assert summary["result"].endswith("(+480 字元)")
+    assert len(summary["segments"]) == 4
+    assert summary["segments"][-1] == "…(共 10 項)"
+
+
+def test_request_logging_is_gated_by_level_sampling_and_duration(mocker, caplog):
+    """
+    測試未啟用 DEBUG 時不會產生參數摘要；取樣率為 0 的 action 不會被記錄；
+    而慢請求一律以 WARNING 記錄。
+    """
+    summarize = mocker.spy(manager, "_summarize")
+    mocker.patch.dict(manager.REQUEST_LOG["per_action_sample_rate"], {"update_task_progress": 0})
+    with caplog.at_level(logging.INFO, logger=manager.log.name):
+        manager._log_request("get_task_status", {"task_id": "t1"}, "success", 40, 200, 1.5)
+    assert caplog.records == []
+    summarize.assert_not_called()
+
+    with caplog.at_level(logging.DEBUG, logger=manager.log.name):
+        manager._log_request("update_task_progress", {"task_id": "t1"}, "success", 40, 200, 1.5)
+        assert caplog.records == []
+
+        manager._log_request("get_task_status", {"task_id": "t1"}, "success", 40, 200, 1.5)
+        manager._log_request("update_task_status", {"result": "x" * 5000}, "success", 5000, 30, 5000)
+    assert [r.levelno for r in caplog.records] == [logging.DEBUG, logging.WARNING]
+    assert "action=update_task_status" in caplog.records[1].getMessage()
+    assert len(caplog.records[1].getMessage()) < 500
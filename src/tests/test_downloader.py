@@ -123,7 +123,8 @@ def test_trigger_youtube_processing_success(mock_db_client, mock_subprocess, moc
         stderr=subprocess.PIPE,
         text=True,
         encoding='utf-8',
-        env=ANY # JULES'S FIX (2025-08-12): 確保測試能處理 env 參數
+        env=ANY, # JULES'S FIX (2025-08-12): 確保測試能處理 env 參數
+        **api_server.PROCESS_GROUP_KWARGS # 子程序以獨立的程序群組啟動，以便取消任務
     )
 
     # 斷言 WebSocket 廣播的訊息
@@ -0,0 +1,104 @@
+# tests/test_job_scheduler.py
+import threading
+import time
+
+from api.job_scheduler import JobScheduler
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_scheduler_limits_concurrency_and_admits_in_order():
+    """
+    測試每種資源同時執行的工作數不會超過槽位數，排隊中的工作依提交順序開始。
+    """
+    scheduler = JobScheduler(slots={"transcribe": 2})
+    release = threading.Event()
+    started = []
+
+    def make_job(i):
+        def job():
+            started.append(i)
+            release.wait(2)
+        return job
+
+    for i in range(5):
+        scheduler.submit("transcribe", make_job(i), task_id=f"task-{i}")
+
+    assert _wait_until(lambda: len(started) == 2)
+    snapshot = scheduler.snapshot()["transcribe"]
+    assert [j["task_id"] for j in snapshot["running"]] == ["task-0", "task-1"]
+    assert [j["task_id"] for j in snapshot["queued"]] == ["task-2", "task-3", "task-4"]
+    assert scheduler.find_job("task-3").state == "queued"
+
+    release.set()
+    assert _wait_until(lambda: scheduler.snapshot()["transcribe"]["completed"] == 5)
+    assert started[:2] == [0, 1] and sorted(started) == [0, 1, 2, 3, 4]
+    assert scheduler.find_job("task-3") is None
+
+
+def test_handoff_releases_slot_and_waits_for_new_resource():
+    """
+    測試 handoff：工作改用另一種資源時會釋放原本的槽位，並在新資源滿載時排隊等待。
+    """
+    scheduler = JobScheduler(slots={"download": 1, "gemini": 1})
+    gemini_busy = threading.Event()
+    phases = []
+
+    def blocker():
+        gemini_busy.wait(2)
+
+    def chain():
+        phases.append("download")
+        scheduler.handoff("gemini", task_id="process-1")
+        phases.append("gemini")
+
+    scheduler.submit("gemini", blocker, task_id="other")
+    scheduler.submit("download", chain, task_id="download-1")
+    follower = scheduler.submit("download", lambda: phases.append("next-download"))
+
+    # 下載槽位在 handoff 後即釋放，下一個下載工作不必等待 AI 分析
+    assert _wait_until(lambda: "next-download" in phases)
+    assert "gemini" not in phases
+    assert [j["task_id"] for j in scheduler.snapshot()["gemini"]["queued"]] == ["process-1"]
+
+    gemini_busy.set()
+    assert _wait_until(lambda: "gemini" in phases)
+    assert _wait_until(lambda: follower.state == "completed")
+
+
+def test_cancel_terminates_running_process_and_drops_queued_job():
+    """
+    測試取消：執行中工作的子程序 (程序群組) 會被終止，排隊中的工作不會再被執行。
+    """
+    import subprocess
+    import sys
+    from api.job_scheduler import PROCESS_GROUP_KWARGS
+
+    scheduler = JobScheduler(slots={"transcribe": 1})
+    outcome = {}
+
+    def long_job():
+        proc = scheduler.track_process(subprocess.Popen(
+            [sys.executable, "-c", "import time; time.sleep(30)"], **PROCESS_GROUP_KWARGS
+        ))
+        proc.wait()
+        outcome["cancelled"] = scheduler.is_cancelled()
+
+    running = scheduler.submit("transcribe", long_job, task_id="long")
+    queued = scheduler.submit("transcribe", lambda: outcome.setdefault("queued_ran", True), task_id="next")
+    assert _wait_until(lambda: running.processes)
+
+    assert scheduler.cancel("next") is queued
+    assert queued.state == "cancelled"
+    assert scheduler.cancel("long") is running
+
+    assert _wait_until(lambda: running.state == "cancelled", timeout=5)
+    assert outcome == {"cancelled": True}
+    assert running.processes[0].returncode is not None
+    assert scheduler.snapshot()["transcribe"] == {"limit": 1, "running": [], "queued": [], "completed": 1}
+    assert scheduler.cancel("long") is None
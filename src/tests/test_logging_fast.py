@@ -1,48 +1,54 @@
 # tests/test_logging_fast.py
 import pytest
 import logging
-import sqlite3
 import time
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 # 由於我們要測試的目標是日誌處理器本身，我們需要匯入它
 from db.log_handler import DatabaseLogHandler
+from db import database
+
 
 @pytest.fixture
-def in_memory_db_handler(mocker):
+def temp_log_db(mocker, tmp_path):
     """
-    一個提供在記憶體中運行的 DatabaseLogHandler 的 fixture。
-    它會 patch DB_FILE 常數，讓 handler 連接到一個記憶體內的 SQLite 資料庫，
-    從而實現了完全的測試隔離，無需操作實體檔案。
+    一個將 database 模組指向暫存 tasks.db 的 fixture，並提供一個模擬的 DBClient。
+    模擬的客戶端直接呼叫 database.add_system_logs_batch，
+    等同於 DB 管理者收到 `add_system_logs_batch` action 時的行為，無需啟動任何服務。
     """
-    # 使用 mocker.patch 來修改 db.log_handler 模組中的 DB_FILE 常數
-    mocker.patch('db.log_handler.DB_FILE', ":memory:")
+    mocker.patch('db.database.DB_FILE', tmp_path / "tasks.db")
+    database.initialize_database()
+    client = MagicMock()
+    client.add_system_logs_batch.side_effect = database.add_system_logs_batch
+    yield client
+
 
-    # 建立一個 handler 實例，並將其 source 設為 'test_source'
-    handler = DatabaseLogHandler(source='test_source')
+@pytest.fixture
+def db_log_handler(temp_log_db):
+    """
+    一個提供 DatabaseLogHandler 的 fixture，其日誌會寫入暫存的 tasks.db。
+    """
+    handler = DatabaseLogHandler(source='test_source', client=temp_log_db)
 
     # 使用 yield 將 handler 提供給測試函式
     yield handler
 
     # --- Teardown ---
-    # 測試結束後，確保關閉 handler 持有的任何連線
-    # (儘管在記憶體模式下這不是嚴格必需的，但這是一個好習慣)
-    if hasattr(handler.local, 'conn') and handler.local.conn:
-        handler.local.conn.close()
-        handler.local.conn = None
+    # 測試結束後，停止背景寫入執行緒
+    handler.close()
 
 
-def test_database_log_handler_writes_log_to_in_memory_db(in_memory_db_handler):
+def test_database_log_handler_writes_log_to_system_logs(db_log_handler):
     """
-    測試 DatabaseLogHandler 是否能成功將一條日誌記錄寫入記憶體資料庫。
+    測試 DatabaseLogHandler 寫入的日誌可以被 get_system_logs_by_filter 讀回。
     """
     # --- 1. 準備 ---
-    # 獲取一個專用的 logger，並將我們的記憶體 handler 加入其中
+    # 獲取一個專用的 logger，並將我們的 handler 加入其中
     test_logger = logging.getLogger('my_test_logger')
     test_logger.setLevel(logging.INFO)
     # 清除可能由其他測試留下的 handlers
     test_logger.handlers = []
-    test_logger.addHandler(in_memory_db_handler)
+    test_logger.addHandler(db_log_handler)
     # 將 propagate 設為 False，避免日誌被傳遞到 root logger，干擾測試結果
     test_logger.propagate = False
 
@@ -50,41 +56,71 @@ def test_database_log_handler_writes_log_to_in_memory_db(in_memory_db_handler):
     test_message = f"log_message_{int(time.time())}"
 
     # --- 2. 執行 ---
-    # 發送一條 INFO 等級的日誌
+    # 發送一條 INFO 等級的日誌，並等待背景寫入器處理完畢
     test_logger.info(test_message)
+    db_log_handler.flush()
 
     # --- 3. 驗證 ---
-    # 由於 handler 的寫入是同步的，我們可以直接查詢資料庫
-    # 再次使用 in_memory_db_handler.get_conn() 來獲取到同一個記憶體資料庫的連線
-    conn = in_memory_db_handler.get_conn()
-    cursor = conn.cursor()
-
-    # JULES'S FIX: The in-memory database is empty, so we must create the table first.
-    cursor.execute("""
-        CREATE TABLE system_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            source TEXT NOT NULL,
-            level TEXT NOT NULL,
-            message TEXT
-        )
-    """)
-    # 重新發送日誌，因為在建立表格之前發送的日誌會失敗
-    test_logger.info(test_message)
-    time.sleep(0.1) # 給予一點緩衝時間
-
-    # 查詢 system_logs 表中是否有我們剛剛發送的日誌
-    cursor.execute("SELECT source, level, message FROM system_logs WHERE message LIKE ?", (f"%{test_message}%",))
-    logs = cursor.fetchall()
+    # 透過與 /api/logs 相同的查詢函式讀取日誌
+    logs = database.get_system_logs_by_filter(sources=['my_test_logger'])
 
     # 斷言我們只找到一條匹配的日誌
     assert len(logs) == 1, "應在資料庫中找到且僅找到一條匹配的日誌記錄"
 
-    # 斷言日誌的內容是否正確
+    # 根據 DatabaseLogHandler 的邏輯，source 應該是 logger 的名稱
     log_entry = logs[0]
-    log_source, log_level, log_message = log_entry
+    assert log_entry['source'] == 'my_test_logger'
+    assert log_entry['level'] == 'INFO'
+    assert test_message in log_entry['message']
 
-    # 根據 DatabaseLogHandler 的邏輯，source 應該是 logger 的名稱
-    assert log_source == 'my_test_logger'
-    assert log_level == 'INFO'
-    assert test_message in log_message
+
+def test_database_log_handler_batches_and_applies_drop_policy(temp_log_db):
+    """
+    測試 emit 不會寫入資料庫，而是由背景寫入器以批次方式寫入；
+    佇列滿載時依 drop_new 策略丟棄新日誌而不阻塞呼叫端。
+    """
+    handler = DatabaseLogHandler(source='test_source', queue_size=3, batch_size=2, flush_interval=0.05, client=temp_log_db)
+
+    # 先不啟動寫入器，以便填滿佇列
+    records = [logging.LogRecord('batch_logger', logging.INFO, __file__, 0, f"msg {i}", None, None) for i in range(5)]
+    with patch.object(handler, '_ensure_writer'):
+        for record in records:
+            handler.emit(record)
+    assert handler.dropped == 2
+    temp_log_db.add_system_logs_batch.assert_not_called()
+
+    handler._ensure_writer()
+    handler.flush()
+    try:
+        logs = database.get_system_logs_by_filter(sources=['batch_logger'])
+        assert [l['message'] for l in logs] == ["msg 0", "msg 1", "msg 2"]
+        assert [len(c.args[0]) for c in temp_log_db.add_system_logs_batch.call_args_list] == [2, 1]
+    finally:
+        handler.close()
+
+
+def test_database_log_handler_stores_structured_extra_fields(db_log_handler):
+    """
+    測試 `extra` 中的 task_id、stage、duration_ms 會被寫入獨立欄位，
+    並可依任務 ID 查詢與依階段彙總耗時。
+    """
+    test_logger = logging.getLogger('structured_logger')
+    test_logger.setLevel(logging.INFO)
+    test_logger.handlers = []
+    test_logger.addHandler(db_log_handler)
+    test_logger.propagate = False
+
+    test_logger.info("轉錄完成", extra={"task_id": "task-a", "stage": "transcribe", "duration_ms": 1000})
+    test_logger.info("轉錄完成", extra={"task_id": "task-b", "stage": "transcribe", "duration_ms": 3000})
+    test_logger.info("下載完成", extra={"task_id": "task-a", "stage": "download", "duration_ms": "250.5"})
+    test_logger.info("沒有結構化欄位的日誌")
+    db_log_handler.flush()
+
+    task_logs = database.get_system_logs_by_filter(task_id="task-a")
+    assert [(l["stage"], l["duration_ms"]) for l in task_logs] == [("transcribe", 1000.0), ("download", 250.5)]
+
+    stages = {row["stage"]: row for row in database.get_stage_durations()}
+    assert stages["transcribe"]["count"] == 2
+    assert stages["transcribe"]["avg_ms"] == 2000.0
+    assert stages["transcribe"]["max_ms"] == 3000.0
+    assert [row["stage"] for row in database.get_stage_durations(task_id="task-a")] == ["transcribe", "download"]
@@ -0,0 +1,46 @@
+# tests/test_model_registry.py
+import os
+import time
+
+from api.model_registry import ModelRegistry, repo_id_for
+
+
+def _install_fake_model(cache_dir, repo_id, revision="abc123"):
+    """在假的 Hugging Face 快取中建立一個完整的模型快照。"""
+    snapshot = cache_dir / f"models--{repo_id.replace('/', '--')}" / "snapshots" / revision
+    snapshot.mkdir(parents=True)
+    (snapshot / "model.bin").write_bytes(b"\0")
+    (snapshot / "config.json").write_text("{}")
+    return snapshot
+
+
+def test_registry_detects_models_and_changes(tmp_path):
+    """
+    測試登錄表能掃描既有的模型，並在快取目錄變動後偵測到新下載的模型。
+    """
+    _install_fake_model(tmp_path, repo_id_for("tiny"))
+    # 只有部分檔案的快照 (下載中斷) 不應被視為存在
+    partial = tmp_path / "models--Systran--faster-whisper-base" / "snapshots" / "rev"
+    partial.mkdir(parents=True)
+    (partial / "config.json").write_text("{}")
+
+    registry = ModelRegistry(cache_dir=tmp_path)
+    assert registry.is_present("tiny")
+    assert not registry.is_present("base")
+    assert registry.status("large-v3") == "missing"
+
+    # 沒有變動時不會重新掃描
+    assert registry.check_for_changes() is False
+
+    registry.mark_downloading("large-v3", "download-task-1")
+    assert registry.status("large-v3") == "downloading"
+    assert registry.get_download_task("large-v3") == "download-task-1"
+
+    snapshot = _install_fake_model(tmp_path, repo_id_for("large-v3"))
+    # 確保目錄的修改時間與上次掃描時不同
+    future = time.time() + 5
+    os.utime(snapshot.parent, (future, future))
+    assert registry.check_for_changes() is True
+    assert registry.status("large-v3") == "present"
+    assert registry.get_download_task("large-v3") is None
+    assert registry.status("large") == "present"  # 'large' 是 large-v3 的別名
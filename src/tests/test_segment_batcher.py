@@ -0,0 +1,31 @@
+# tests/test_segment_batcher.py
+import time
+
+from api.segment_batcher import SegmentBatcher
+
+
+def test_batcher_flushes_by_size_and_by_time():
+    """
+    測試片段依任務合併：湊滿 max_segments 筆立即送出，不足一批時在時限內由背景執行緒送出。
+    """
+    batcher = SegmentBatcher(flush_interval=0.05, max_segments=3)
+    sent = []
+    sink_a = lambda segments: sent.append(("a", [s["text"] for s in segments]))
+    sink_b = lambda segments: sent.append(("b", [s["text"] for s in segments]))
+
+    for i in range(4):
+        batcher.add("task-a", {"text": f"a{i}"}, sink_a)
+    batcher.add("task-b", {"text": "b0"}, sink_b)
+    assert sent == [("a", ["a0", "a1", "a2"])]
+
+    deadline = time.monotonic() + 2
+    while len(sent) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(sent[1:]) == [("a", ["a3"]), ("b", ["b0"])]
+
+    # 任務結束時 flush 會立即送出剩餘片段
+    batcher.add("task-a", {"text": "a4"}, sink_a)
+    batcher.flush("task-a")
+    assert sent[-1] == ("a", ["a4"])
+    batcher.flush()
+    assert len(sent) == 4
@@ -0,0 +1,43 @@
+# tests/test_system_monitor.py
+import asyncio
+
+from api.system_monitor import SystemStatsSampler
+
+
+def test_sampler_keeps_bounded_history(tmp_path):
+    """
+    測試取樣器只保留固定數量的樣本，並且在沒有 nvidia-smi 時略過 GPU。
+    """
+    sampler = SystemStatsSampler(history_size=3, disk_path=tmp_path)
+    sampler._nvidia_smi = None
+
+    samples = [sampler.sample() for _ in range(5)]
+
+    assert sampler.history() == samples[-3:]
+    assert sampler.history(limit=1) == [samples[-1]]
+    assert sampler.latest() is samples[-1]
+    latest = sampler.latest()
+    assert latest["gpu_detected"] is False and latest["gpu_usage"] is None
+    assert latest["disk_usage"] is not None
+    assert any(p["rss"] > 0 for p in latest["processes"])
+
+
+def test_system_stats_endpoint_returns_cached_sample(mocker):
+    """
+    測試 /api/system_stats 回傳快取的樣本與歷史，而不會自行取樣。
+    """
+    from api import api_server
+
+    sampler = SystemStatsSampler(history_size=10)
+    sampler._nvidia_smi = None
+    for _ in range(4):
+        sampler.sample()
+    mocker.patch.object(api_server, "system_sampler", sampler)
+    sample_spy = mocker.spy(sampler, "sample")
+
+    response = asyncio.run(api_server.get_system_stats(history=2))
+
+    sample_spy.assert_not_called()
+    assert response["timestamp"] == sampler.latest()["timestamp"]
+    assert len(response["history"]) == 2
+    assert "cpu_usage" in response and "ram_usage" in response
@@ -369,7 +369,10 @@ def process_audio_file(audio_path: Path, model: str, video_title: str, output_di
             "output_path": str(output_path),
             "video_title": video_title,
             "total_tokens_used": total_tokens_used,
-            "processing_duration_seconds": round(processing_duration, 2)
+            "processing_duration_seconds": round(processing_duration, 2),
+            # 附上文字內容，讓資料庫可以為報告建立全文檢索索引
+            "summary": results.get('summary'),
+            "transcript": results.get('transcript')
         }
         print(json.dumps(final_result), flush=True)
 
@@ -101,7 +101,9 @@ def main():
             "total_tokens_used": 1234,  # Mock value
             "processing_duration_seconds": 5.67,  # Mock value
             "html_report_path": str(output_path) if process_args.output_format == "html" else None,
-            "txt_report_path": str(output_path) if process_args.output_format == "txt" else None
+            "txt_report_path": str(output_path) if process_args.output_format == "txt" else None,
+            "summary": f"這是「{process_args.video_title}」的模擬重點摘要。",
+            "transcript": f"這是「{process_args.video_title}」的模擬詳細逐字稿。"
         }
         print(json.dumps(result), flush=True)
         time.sleep(0.1) # Add a small delay to ensure stdout is flushed
@@ -17,7 +17,7 @@ from pathlib import Path
 from opencc import OpenCC
 import json
 import sys
-from faster_whisper.utils import get_assets_path
+from faster_whisper.utils import download_model as download_model_files
 
 # --- 日誌設定 ---
 # 設定一個基本的日誌記錄器，以便在工具執行時提供有用的輸出
@@ -139,11 +139,14 @@ class Transcriber:
             raise e
 
 def check_model(model_size: str):
-    """檢查模型是否已下載"""
+    """
+    檢查模型是否已下載。
+    API 伺服器改用程序內的模型登錄表 (api/model_registry.py)，此命令保留給命令列使用。
+    """
     try:
-        # 這是 faster-whisper 內部用來找模型路徑的方法
-        model_path = get_assets_path(f"ctranslate2-4-avx2/whisper-{model_size}-ct2")
-        if (Path(model_path) / "config.json").is_file():
+        # 只在本地 Hugging Face 快取中尋找，與 WhisperModel 載入模型時使用的位置相同
+        model_path = download_model_files(model_size, local_files_only=True)
+        if (Path(model_path) / "model.bin").is_file():
             print("exists")
             log.info(f"✅ 模型 '{model_size}' 已存在於: {model_path}")
         else:
@@ -151,7 +154,7 @@ def check_model(model_size: str):
             log.info(f"❓ 模型 '{model_size}' 不存在。")
     except Exception as e:
         print("not_exists")
-        log.error(f"檢查模型 '{model_size}' 時出錯: {e}")
+        log.info(f"❓ 模型 '{model_size}' 不存在 ({e})。")
 
 def download_model(model_size: str):
     """下載模型並回報進度"""